@@ -116,7 +116,8 @@ class AuthCameraPanel(QFrame):
             frame_resized = cv2.resize(frame, (440, 340))
             frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
             h, w, ch = frame_rgb.shape
-            q_image = QImage(frame_rgb.tobytes(), w, h, ch * w, QImage.Format_RGB888).copy()
+            # QImage trỏ thẳng vào frame_rgb; fromImage copy sang pixmap nên không cần tobytes() / copy()
+            q_image = QImage(frame_rgb.data, w, h, ch * w, QImage.Format_RGB888)
             pixmap = QPixmap.fromImage(q_image)
 
             if self.camera_label is None:
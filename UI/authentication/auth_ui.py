@@ -11,6 +11,8 @@ from UI.styles import Theme
 import numpy as np
 import time
 from modules.camera import CameraThread
+from modules.frame_ring import FrameRef
+from modules.database import DatabaseManager
 from UI.workers.auth_worker import AuthWorker
 from UI.authentication.auth_panel import AuthCameraPanel
 from UI.authentication.auth_view_logic import AuthViewLogic
@@ -27,6 +29,7 @@ class AuthenticationView(QWidget):
 
         self.is_checking = False
         self.fps_value = 0.0
+        self.db = DatabaseManager()
         
         # Backend components (Threaded)
         self.camera_thread = None
@@ -260,7 +263,8 @@ class AuthenticationView(QWidget):
             self.progress_label.setText("Bước: 0/4")
         self.loading_label.hide()
 
-    def _on_frame_captured(self, frame: np.ndarray):
+    def _on_frame_captured(self, ref: FrameRef):
+        frame = ref.array
         t = time.time()
         if self.last_frame_time > 0:
             self.fps_value = 1.0 / (t - self.last_frame_time)
@@ -270,7 +274,7 @@ class AuthenticationView(QWidget):
         self.fps_label.setText(f"FPS: {self.fps_value:.1f}")
         
         if self.auth_worker:
-            self.auth_worker.process_frame(frame)
+            self.auth_worker.process_frame(ref)
             
         self.view_logic.draw_ui_overlay(frame)
 
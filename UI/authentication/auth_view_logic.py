@@ -2,12 +2,23 @@ from PySide6.QtCore import QTimer
 from UI.styles import Theme
 from modules.ai.face_analyzer import DistanceStatus
 import cv2
+import numpy as np
 import time
 
 
 class AuthViewLogic:
     def __init__(self, view):
         self.view = view
+        self._spoof_logged_session = None  # Chỉ ghi 1 event giả mạo cho mỗi phiên
+        self._display_buffer = None  # Buffer vẽ overlay dùng lại (frame từ ring là chỉ đọc)
+
+    def log_event(self, event_type: str, result: str, user_id: str = None, details: str = None, **fields):
+        """Ghi event xác thực kèm cột có kiểu; phiên / fail_count / liveness lấy từ kết quả AI gần nhất."""
+        last = self.view.last_ai_result or {}
+        fields.setdefault("session_id", last.get("session_id"))
+        fields.setdefault("fail_count", last.get("fail_count"))
+        fields.setdefault("liveness_status", last.get("liveness_status"))
+        self.view.db.add_event(event_type=event_type, user_id=user_id, result=result, details=details, **fields)
 
     def on_ai_result(self, result: dict):
         view = self.view
@@ -72,6 +83,9 @@ class AuthViewLogic:
         if l_status in ["SPOOF/FAKE", "SPOOF/VIDEO", "SPOOF/FLAT", "SPOOF/STRONG", "SPOOF/SOFT"]:
             # Hiển thị lý do cụ thể từ instruction
             spoof_msg = instruction if instruction else "WARNING: SPOOF DETECTED!"
+            if self._spoof_logged_session != result.get("session_id"):
+                self._spoof_logged_session = result.get("session_id")
+                self.log_event("auth_fail", "fail", details=spoof_msg, spoof_reason=result.get("spoof_reason"))
             view.status_message.setText(spoof_msg)
             view.status_message.setStyleSheet(
                 f"color: {Theme.DANGER_RED}; font-size: 13px; font-weight: bold; "
@@ -158,7 +172,7 @@ class AuthViewLogic:
                         f"background-color: rgba(0, 0, 0, 180); border-radius: 8px; padding: 8px; "
                         f"border: 1px solid {Theme.SECONDARY_GREEN};"
                     )
-                    view.auth_worker.authenticate(result["embedding"])
+                    view.auth_worker.authenticate(result["embedding"], result.get("live_pose"))
                     view.last_auth_time = now
             else:
                 if "SUCCESS" not in view.status_message.text():
@@ -167,6 +181,8 @@ class AuthViewLogic:
     def on_timeout_warning(self, warning_msg: str):
         view = self.view
         print(f"[AuthView] Timeout warning received: {warning_msg}")
+        if view.auth_worker is not None:
+            self.log_event("auth_fail", "fail", details=warning_msg, fail_count=view.auth_worker.fail_count)
 
         view.status_message.setText(f"{warning_msg}")
         view.status_message.setStyleSheet(
@@ -231,8 +247,13 @@ class AuthViewLogic:
             f"border: 1px solid {Theme.SECONDARY_GREEN};"
         )
 
-    def on_auth_result(self, success, user_id, distance):
+    def on_auth_result(self, success, user_id, distance, margin=1.0, info=None):
         view = self.view
+        info = info or {}
+        fields = {"distance": distance, "latency_ms": info.get("latency_ms")}
+        if "session_id" in info:
+            fields["session_id"] = info["session_id"]
+            fields["fail_count"] = info.get("fail_count")
         view.authentication_completed = True  # Đánh dấu đã có kết quả
         view.liveness_passed = False  # Reset state
         
@@ -246,19 +267,32 @@ class AuthViewLogic:
                 f"border: 1px solid {Theme.SECONDARY_GREEN};"
             )
             print(f"[AuthView] Authentication SUCCESS: {name}")
+            self.log_event("auth", "success", user_id=user_id, details=f"Xác thực thành công: {name}", **fields)
             view.authentication_success.emit(user_id, name)
         else:
-            view.status_message.setText("Xác thực thất bại")
+            authenticator = view.auth_worker.authenticator
+            # Distance đạt ngưỡng nhưng top1 quá sát top2 -> từ chối ngay, không đợi thêm cooldown
+            ambiguous = distance < authenticator.threshold and margin < authenticator.min_margin
+            view.status_message.setText("Xác thực thất bại" if not ambiguous else "Xác thực thất bại (không phân biệt được)")
             view.status_message.setStyleSheet(
                 f"color: {Theme.DANGER_RED}; font-size: 13px; font-weight: bold; "
                 f"background-color: rgba(255, 50, 50, 50); border-radius: 8px; padding: 8px; "
                 f"border: 1px solid {Theme.DANGER_RED};"
             )
-            print(f"[AuthView] Authentication FAILED - not recognized")
+            if ambiguous:
+                print(f"[AuthView] Authentication FAILED - ambiguous match (distance={distance:.3f}, margin={margin:.3f})")
+                details = f"Không phân biệt được (margin={margin:.3f})"
+            else:
+                print(f"[AuthView] Authentication FAILED - not recognized (distance={distance:.3f})")
+                details = "Không nhận diện được"
+            self.log_event("auth_fail", "fail", details=details, **fields)
 
     def draw_ui_overlay(self, frame):
         view = self.view
-        display_frame = frame.copy()
+        if self._display_buffer is None or self._display_buffer.shape != frame.shape:
+            self._display_buffer = np.empty_like(frame)
+        display_frame = self._display_buffer
+        np.copyto(display_frame, frame)
         h, w = display_frame.shape[:2]
 
         color_hex = Theme.PRIMARY
@@ -9,6 +9,9 @@ from UI.dashboard.dashboard_ui import DashboardView
 from UI.profile.profile_ui import ProfileView
 from UI.about.about_ui import AboutView
 from UI.components.sidebar import Sidebar
+from UI.workers.maintenance_worker import MaintenanceWorker
+from UI.workers.inference_scheduler import wait_inference_scheduler
+from UI.event_bridge import DatabaseEventBridge
 
 class BaseWindow(QMainWindow):
     """
@@ -16,6 +19,10 @@ class BaseWindow(QMainWindow):
     - Guest mode: chỉ Authentication + Enrollment
     - Authenticated mode: Dashboard + Profile + About + Logout
     """
+
+    # Bảo trì database (archive event cũ + vacuum): lần đầu sau khi mở, sau đó định kỳ
+    MAINTENANCE_FIRST_DELAY_MS = 60 * 1000
+    MAINTENANCE_INTERVAL_MS = 6 * 60 * 60 * 1000
     
     def __init__(self):
         super().__init__()
@@ -39,6 +46,14 @@ class BaseWindow(QMainWindow):
         # Initialize UI Components
         from modules.database import DatabaseManager
         self.db = DatabaseManager()
+        # Thông tin user đang đăng nhập được sửa -> Profile đổi theo (push qua bus)
+        self.db_events = DatabaseEventBridge(self.db.bus, self)
+        self.db_events.user_updated.connect(self._on_user_updated)
+        self.maintenance_worker = None
+        self.maintenance_timer = QTimer(self)
+        self.maintenance_timer.timeout.connect(self.run_maintenance)
+        self.maintenance_timer.start(self.MAINTENANCE_INTERVAL_MS)
+        QTimer.singleShot(self.MAINTENANCE_FIRST_DELAY_MS, self.run_maintenance)
         self.setup_sidebar()
         self.setup_content_area()
         
@@ -144,8 +159,6 @@ class BaseWindow(QMainWindow):
         # Xử lý đặc biệt cho từng trang
         if nav_key == "auth":
             pass  # Không auto-start, user nhấn nút Start
-        elif nav_key == "dashboard":
-            self.dashboard_view.refresh_data()
         elif nav_key == "profile" and self.current_user:
             self.profile_view.set_user(self.current_user)
 
@@ -167,7 +180,7 @@ class BaseWindow(QMainWindow):
     
     def on_authentication_success(self, user_id: str, fullname: str):
         """Xử lý khi authentication thành công - unlock menu và chuyển Dashboard"""
-        # Lấy đầy đủ thông tin từ DB
+        # Lấy đầy đủ thông tin (cache user của DatabaseManager, AuthView vừa đọc cùng user)
         user_data = self.db.get_user(user_id)
         print(f"[BaseWindow] Auth success for {user_id}: {user_data}")
         
@@ -180,14 +193,6 @@ class BaseWindow(QMainWindow):
         self.is_authenticated = True
         self.current_user = user_data if user_data else {"id": user_id, "fullname": fullname}
         
-        # Ghi event vào DB
-        self.db.add_event(
-            event_type="auth",
-            user_id=user_id,
-            result="success",
-            details=f"Xác thực thành công: {fullname}"
-        )
-        
         # Rebuild sidebar với menu authenticated
         self.sidebar.build_menu(authenticated=True)
         
@@ -220,8 +225,31 @@ class BaseWindow(QMainWindow):
         # Chuyển về trang Authentication
         self.switch_to_page("auth")
     
+    def run_maintenance(self):
+        """Archive event cũ trên background thread (bỏ qua nếu lượt trước chưa xong)."""
+        if self.maintenance_worker is not None and self.maintenance_worker.isRunning():
+            return
+        self.maintenance_worker = MaintenanceWorker(self.db)
+        self.maintenance_worker.start()
+
+    def _on_user_updated(self, user: dict):
+        if self.current_user and self.current_user.get("id") == user["id"]:
+            self.current_user = user
+            self.profile_view.set_user(user)
+
     def closeEvent(self, event):
         """Cleanup khi đóng cửa sổ."""
+        self.db_events.detach()
         if hasattr(self, 'auth_view') and self.auth_view:
             self.auth_view.stop_authentication()
+        # unregister không chặn: đợi thread scheduler thoát ở đây
+        wait_inference_scheduler()
+        if hasattr(self, 'dashboard_view') and self.dashboard_view:
+            self.dashboard_view.stop_workers()
+        self.maintenance_timer.stop()
+        if self.maintenance_worker is not None:
+            self.maintenance_worker.wait()
+        # Ghi nốt các event đang chờ trong hàng đợi rồi đóng connection database
+        self.db.flush_events()
+        self.db.close()
         event.accept()
@@ -1,14 +1,27 @@
 """
 Dashboard View - Hiển thị thống kê và logs hệ thống (WITH FAIL TRACKING)
+Nạp từ DB 1 lần khi hiển thị lần đầu; sau đó stats / logs / biểu đồ cập nhật theo delta
+từ EventBus của database (event, user mới / bị xóa), không truy vấn lại mỗi lần chuyển trang.
 """
+import time
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame, 
-    QTableWidget, QTableWidgetItem, QHeaderView, QScrollArea
+    QTableView, QAbstractItemView, QHeaderView, QScrollArea
 )
 from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QColor
 from UI.styles import Theme
-from modules.database import DatabaseManager
+from UI.dashboard.logs_model import EventLogModel
+from UI.dashboard.trend_chart import TrendChart, hourly_window
+from UI.event_bridge import DatabaseEventBridge
+from UI.workers.log_worker import LogWorker
+from modules.database import DatabaseManager, ROLLUP_FORMATS, event_counter_name
+
+# Bộ đếm stats_counters -> khóa trong dict của get_stats
+STAT_KEYS = {
+    "enroll": "total_enrolls",
+    "auth_success": "total_auth_success",
+    "auth_fail": "total_auth_fail",
+}
 
 class StatCard(QFrame):
     """Card hiển thị một thống kê"""
@@ -52,6 +65,9 @@ class StatCard(QFrame):
 
 class DashboardView(QWidget):
     """Dashboard chính - stats + logs + biểu đồ"""
+
+    # Biểu đồ: số giờ gần nhất (1 cột / giờ, đọc từ event_rollups)
+    CHART_HOURS = 168
     
     # NEW: Signal để nhận cập nhật fail count real-time
     fail_count_updated = Signal(int)
@@ -59,6 +75,19 @@ class DashboardView(QWidget):
     def __init__(self):
         super().__init__()
         self.db = DatabaseManager()
+        # Mọi truy vấn logs / rollup của Dashboard chạy trên thread này
+        self.log_worker = LogWorker(self.db)
+        self.log_worker.rollups_loaded.connect(self._on_rollups_loaded)
+        self._chart_buckets: list[str] = []
+        # Thay đổi đã commit được đẩy tới qua bus (slot chạy trên UI thread)
+        self.db_events = DatabaseEventBridge(self.db.bus, self)
+        self.db_events.events_logged.connect(self._on_events_logged)
+        self.db_events.user_added.connect(self._on_user_added)
+        self.db_events.user_deleted.connect(self._on_user_deleted)
+        self._stats: dict | None = None  # None = chưa nạp lần đầu
+        # id event lớn nhất đã có trong biểu đồ; None = đang chờ rollup, event mới giữ tạm ở pending
+        self._chart_mark: int | None = None
+        self._pending_chart_rows = []
         
         # NEW: Tracking live fail count
         self.current_fail_count = 0
@@ -136,26 +165,25 @@ class DashboardView(QWidget):
         logs_title.setStyleSheet(f"color: {Theme.PRIMARY}; font-size: 18px; font-weight: bold;")
         logs_layout.addWidget(logs_title)
         
-        self.logs_table = QTableWidget()
-        self.logs_table.setColumnCount(6)  # NEW: Thêm 1 cột cho fail count
-        self.logs_table.setHorizontalHeaderLabels([
-            "Thời gian", "Loại", "User ID", "Kết quả", "Fails", "Chi tiết"
-        ])
+        # Model/view: chỉ vẽ các hàng đang hiển thị, trang cũ hơn nạp khi cuộn xuống (fetchMore)
+        self.logs_model = EventLogModel(self.log_worker)
+        self.logs_table = QTableView()
+        self.logs_table.setModel(self.logs_model)
         self.logs_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.logs_table.setAlternatingRowColors(True)
-        self.logs_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.logs_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.logs_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.logs_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.logs_table.setStyleSheet(f"""
-            QTableWidget {{
+            QTableView {{
                 background-color: transparent;
                 border: none;
                 color: {Theme.TEXT_WHITE};
                 gridline-color: {Theme.BORDER_COLOR};
             }}
-            QTableWidget::item {{
+            QTableView::item {{
                 padding: 8px;
             }}
-            QTableWidget::item:selected {{
+            QTableView::item:selected {{
                 background-color: rgba(0, 243, 255, 30);
             }}
             QHeaderView::section {{
@@ -181,15 +209,20 @@ class DashboardView(QWidget):
             }}
         """)
         chart_layout = QVBoxLayout(chart_frame)
-        chart_layout.setAlignment(Qt.AlignCenter)
         
-        chart_title = QLabel("📊 Biểu đồ hoạt động")
+        chart_header = QHBoxLayout()
+        chart_title = QLabel("📊 Biểu đồ hoạt động (7 ngày, theo giờ)")
         chart_title.setStyleSheet(f"color: {Theme.PRIMARY}; font-size: 18px; font-weight: bold;")
-        chart_layout.addWidget(chart_title, alignment=Qt.AlignTop | Qt.AlignLeft)
+        chart_header.addWidget(chart_title)
+        chart_header.addStretch()
+        self.chart_summary = QLabel("")
+        self.chart_summary.setStyleSheet(f"color: {Theme.TEXT_GRAY}; font-size: 13px;")
+        chart_header.addWidget(self.chart_summary)
+        chart_layout.addLayout(chart_header)
         
-        chart_placeholder = QLabel("(Biểu đồ sẽ được thêm sau)")
-        chart_placeholder.setStyleSheet(f"color: {Theme.TEXT_GRAY}; font-size: 14px;")
-        chart_layout.addWidget(chart_placeholder, alignment=Qt.AlignCenter)
+        self.trend_chart = TrendChart()
+        self.trend_chart.setStyleSheet("border: none; background: transparent;")
+        chart_layout.addWidget(self.trend_chart)
         
         main_layout.addWidget(chart_frame)
     
@@ -235,67 +268,123 @@ class DashboardView(QWidget):
         self.update_live_fail_count(0)
     
     def refresh_data(self):
-        """Load lại dữ liệu từ DB"""
-        # Load stats
-        stats = self.db.get_stats()
+        """Load lại dữ liệu từ DB (lần hiển thị đầu); sau đó view tự cập nhật theo event từ bus"""
+        # Load stats (kèm id event lớn nhất đã đếm để không cộng trùng event từ bus)
+        self._stats = self.db.get_stats()
+        self._render_stats()
+        
+        if not self.log_worker.isRunning():
+            self.log_worker.start()
+        
+        # Load logs: chỉ nạp event mới hơn hàng đầu tiên (truy vấn chạy trên LogWorker)
+        self.logs_model.refresh()
+        
+        # Biểu đồ: rollup theo giờ (worker gộp event mới vào rollup rồi đọc vài trăm bucket)
+        self._chart_mark = None
+        self._pending_chart_rows = []
+        self._chart_buckets, end = hourly_window(self.CHART_HOURS)
+        self.log_worker.request_rollups(self._chart_buckets[0], end, "hour")
+
+    def _render_stats(self):
+        stats = self._stats
         self.card_users.set_value(str(stats["total_users"]))
         self.card_enrolls.set_value(str(stats["total_enrolls"]))
         self.card_auth_success.set_value(str(stats["total_auth_success"]))
         self.card_auth_fail.set_value(str(stats["total_auth_fail"]))
         self.card_today.set_value(str(stats["auth_today"]))
-        
-        # Load logs
-        events = self.db.get_events(limit=30)
-        self.logs_table.setRowCount(len(events))
-        
-        for row, event in enumerate(events):
-            # Thời gian
-            self.logs_table.setItem(row, 0, QTableWidgetItem(str(event["created_at"] or "")))
-            
-            # Loại
-            event_type = event["event_type"]
-            type_item = QTableWidgetItem(event_type)
-            if event_type == "auth":
-                type_item.setForeground(QColor(Theme.SECONDARY_GREEN))
-            elif event_type == "auth_fail":
-                type_item.setForeground(QColor(Theme.SECONDARY_RED))
-            elif event_type == "enroll":
-                type_item.setForeground(QColor(Theme.PRIMARY))
-            self.logs_table.setItem(row, 1, type_item)
-            
-            # User ID
-            self.logs_table.setItem(row, 2, QTableWidgetItem(event["user_id"] or "-"))
-            
-            # Kết quả
-            result = event["result"]
-            result_item = QTableWidgetItem(result)
-            if result == "success":
-                result_item.setForeground(QColor(Theme.SECONDARY_GREEN))
-            else:
-                result_item.setForeground(QColor(Theme.SECONDARY_RED))
-            self.logs_table.setItem(row, 3, result_item)
-            
-            # NEW: Fail count (extract từ details nếu có)
-            details = event["details"] or ""
-            fail_count = "-"
-            if "fail_count:" in details.lower():
-                # Parse fail_count từ details string
-                try:
-                    fail_part = [p for p in details.split(",") if "fail_count" in p.lower()]
-                    if fail_part:
-                        fail_count = fail_part[0].split(":")[-1].strip()
-                except:
-                    pass
-            
-            fail_item = QTableWidgetItem(fail_count)
-            if fail_count != "-" and int(fail_count.split("/")[0]) >= 2:
-                fail_item.setForeground(QColor(Theme.SECONDARY_RED))
-            self.logs_table.setItem(row, 4, fail_item)
-            
-            # Chi tiết
-            self.logs_table.setItem(row, 5, QTableWidgetItem(details))
+
+    def _roll_day(self):
+        """Sang ngày UTC mới: "Hôm nay" bắt đầu lại từ 0."""
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        if self._stats["day"] != today:
+            self._stats["day"] = today
+            self._stats["auth_today"] = 0
+
+    def _roll_chart_window(self):
+        """Sang giờ mới: dời cửa sổ biểu đồ 1 bucket, giữ nguyên số liệu các giờ cũ (không đọc DB)."""
+        if self._chart_mark is None:
+            return  # Đang chờ rollup của cửa sổ hiện tại
+        if time.strftime(ROLLUP_FORMATS["hour"], time.gmtime()) != self._chart_buckets[-1]:
+            self._chart_buckets, _ = hourly_window(self.CHART_HOURS)
+            self.trend_chart.set_data(self._chart_buckets, self.trend_chart.points)
+            self._update_chart_summary()
+
+    def _on_events_logged(self, rows):
+        """Event vừa ghi (từ bus): cộng vào stats, chèn vào bảng logs và bucket biểu đồ."""
+        if self._stats is None:
+            return  # Lần nạp đầu sẽ đọc cả các event này
+        fresh = [row for row in rows if row.id > self._stats["last_event_id"]]
+        if fresh:
+            self._roll_day()
+            for row in fresh:
+                name = event_counter_name(row)
+                if name is None:
+                    continue
+                self._stats[STAT_KEYS[name]] += 1
+                if name == "auth_success" and (row.created_at or "")[:10] == self._stats["day"]:
+                    self._stats["auth_today"] += 1
+            self._stats["last_event_id"] = fresh[-1].id
+            self._render_stats()
+        
+        self.logs_model.add_live_rows(rows)
+        
+        if self._chart_mark is None:
+            self._pending_chart_rows.extend(rows)
+            return
+        chart_rows = [row for row in rows if row.id > self._chart_mark]
+        if chart_rows:
+            self._roll_chart_window()
+            self._chart_mark = chart_rows[-1].id
+            if self.trend_chart.add_events(chart_rows):
+                self._update_chart_summary()
+
+    def _on_user_added(self, user):
+        if self._stats is not None:
+            self._stats["total_users"] += 1
+            self._render_stats()
+
+    def _on_user_deleted(self, user_id):
+        if self._stats is not None:
+            self._stats["total_users"] -= 1
+            self._render_stats()
+
+    def _on_rollups_loaded(self, request, points, mark):
+        if request[0] != self._chart_buckets[0]:
+            return  # Kết quả của cửa sổ cũ
+        pending, self._pending_chart_rows = self._pending_chart_rows, []
+        if points is None:
+            self._chart_mark = 0  # Giữ biểu đồ cũ, vẫn cộng tiếp event mới
+            return
+        self.trend_chart.set_data(self._chart_buckets, points)
+        self._chart_mark = mark
+        self.trend_chart.add_events([row for row in pending if row.id > mark])
+        self._update_chart_summary()
+
+    def _update_chart_summary(self):
+        points = self.trend_chart.points
+        success = sum(p.auth_success for p in points)
+        fail = sum(p.auth_fail for p in points)
+        spoof = sum(p.spoof for p in points)
+        attempts = success + fail
+        if attempts:
+            self.chart_summary.setText(
+                f"Fail: {100 * fail / attempts:.1f}%   Giả mạo: {100 * spoof / attempts:.1f}%"
+            )
+        else:
+            self.chart_summary.setText("Chưa có lượt xác thực")
+
+    def stop_workers(self):
+        """Dừng LogWorker và ngừng nhận event từ bus (gọi khi đóng ứng dụng)."""
+        self.db_events.detach()
+        if self.log_worker.isRunning():
+            self.log_worker.stop()
     
     def showEvent(self, event):
-        """Refresh data khi view được hiển thị"""
+        """Lần đầu: nạp từ DB. Các lần sau dữ liệu đã được cập nhật theo bus, chỉ dời ngày / giờ"""
         super().showEvent(event)
-        self.refresh_data()
+        if self._stats is None:
+            self.refresh_data()
+        else:
+            self._roll_day()
+            self._render_stats()
+            self._roll_chart_window()
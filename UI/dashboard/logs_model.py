@@ -0,0 +1,143 @@
+"""
+Model cho bảng logs của Dashboard (QAbstractTableModel).
+View chỉ hỏi dữ liệu của các ô đang hiển thị; trang cũ hơn được nạp khi cuộn tới cuối (fetchMore),
+refresh chỉ nạp event mới hơn id lớn nhất đã thấy. Mọi truy vấn chạy trên LogWorker.
+Event mới ghi trong process được đẩy vào qua add_live_rows() (EventBus), không cần truy vấn lại.
+"""
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PySide6.QtGui import QColor
+
+from UI.styles import Theme
+from UI.workers.log_worker import LogWorker
+from modules.database import EventRow
+
+HEADERS = ["Thời gian", "Loại", "User ID", "Kết quả", "Fails", "Chi tiết"]
+
+TYPE_COLORS = {
+    "auth": Theme.SECONDARY_GREEN,
+    "auth_fail": Theme.SECONDARY_RED,
+    "enroll": Theme.PRIMARY,
+}
+
+
+class EventLogModel(QAbstractTableModel):
+    """Events mới nhất ở trên; fail_count đọc từ cột có kiểu của events."""
+
+    def __init__(self, worker: LogWorker, parent=None):
+        super().__init__(parent)
+        self.page_size = worker.page_size
+        self._rows: list[EventRow] = []
+        self._exhausted = False
+        self._fetching_older = False
+        self._fetching_newer = False
+        self._loaded = False
+        self.worker = worker
+        self.worker.older_loaded.connect(self._on_older_loaded)
+        self.worker.newer_loaded.connect(self._on_newer_loaded)
+
+    # ---------- Nạp dữ liệu ----------
+
+    def refresh(self):
+        """Lần đầu: nạp trang mới nhất. Các lần sau: chỉ nạp event mới hơn hàng đầu tiên."""
+        if not self._loaded:
+            if not self._fetching_older:
+                self._fetching_older = True
+                self.worker.request_older(None)
+        elif not self._fetching_newer:
+            self._fetching_newer = True
+            self.worker.request_newer(self._rows[0].id if self._rows else 0)
+
+    def add_live_rows(self, rows: list[EventRow]):
+        """
+        Chèn event vừa ghi (từ bus, id tăng dần) lên đầu bảng.
+        Hàng không nối tiếp hàng đầu (có event từ process khác ở giữa) -> nạp bù bằng refresh().
+        """
+        if not self._loaded:
+            return  # Trang đầu tiên đang nạp sẽ gồm các event này
+        top = self._rows[0].id if self._rows else 0
+        rows = [row for row in rows if row.id > top]
+        if not rows:
+            return
+        if self._rows and rows[0].id != top + 1:
+            self.refresh()
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self._rows[0:0] = reversed(rows)
+        self.endInsertRows()
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        if parent.isValid():
+            return False
+        return self._loaded and not self._exhausted and not self._fetching_older
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.canFetchMore():
+            return
+        self._fetching_older = True
+        self.worker.request_older(self._rows[-1].id)
+
+    def _on_older_loaded(self, before_id, rows):
+        self._fetching_older = False
+        if rows is None:
+            return
+        expected = self._rows[-1].id if self._rows else None
+        if before_id != expected:
+            return  # Kết quả cũ không còn khớp với đuôi bảng hiện tại
+        self._loaded = True
+        if len(rows) < self.page_size:
+            self._exhausted = True
+        if rows:
+            start = len(self._rows)
+            self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+            self._rows.extend(rows)
+            self.endInsertRows()
+
+    def _on_newer_loaded(self, after_id, rows):
+        self._fetching_newer = False
+        if not rows:
+            return
+        if after_id != (self._rows[0].id if self._rows else 0):
+            return
+        # Worker trả cũ nhất trước -> đảo lại để mới nhất ở trên
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self._rows[0:0] = reversed(rows)
+        self.endInsertRows()
+
+    # ---------- QAbstractTableModel ----------
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        event = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return str(event.created_at or "")
+            if column == 1:
+                return event.event_type
+            if column == 2:
+                return event.user_id or "-"
+            if column == 3:
+                return event.result
+            if column == 4:
+                return "-" if event.fail_count is None else str(event.fail_count)
+            return event.details or ""
+        if role == Qt.ForegroundRole:
+            if column == 1 and event.event_type in TYPE_COLORS:
+                return QColor(TYPE_COLORS[event.event_type])
+            if column == 3:
+                return QColor(Theme.SECONDARY_GREEN if event.result == "success" else Theme.SECONDARY_RED)
+            if column == 4 and event.fail_count is not None and event.fail_count >= 2:
+                return QColor(Theme.SECONDARY_RED)
+        return None
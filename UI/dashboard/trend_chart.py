@@ -0,0 +1,114 @@
+"""
+Biểu đồ xu hướng của Dashboard: cột chồng xác thực OK / fail theo giờ, phần giả mạo tô riêng.
+Vẽ trực tiếp từ các bucket rollup (vài trăm điểm), không đọc bảng events;
+event mới từ EventBus được cộng thẳng vào bucket (add_events).
+"""
+from datetime import datetime, timedelta, timezone
+
+from PySide6.QtWidgets import QWidget
+from PySide6.QtCore import Qt, QRectF
+from PySide6.QtGui import QPainter, QColor, QPen
+
+from UI.styles import Theme
+from modules.database import ROLLUP_FORMATS, EventRow, RollupPoint
+
+SPOOF_COLOR = "#FFD700"
+
+
+def hourly_window(hours: int) -> tuple[list[str], str]:
+    """
+    Tên bucket theo giờ (UTC, giống event_rollups) của `hours` giờ gần nhất, cũ nhất trước,
+    kèm mốc kết thúc (đầu giờ kế tiếp) để truy vấn [bucket đầu, mốc kết thúc).
+    """
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    start = now - timedelta(hours=hours - 1)
+    fmt = ROLLUP_FORMATS["hour"]
+    buckets = [(start + timedelta(hours=i)).strftime(fmt) for i in range(hours)]
+    return buckets, (now + timedelta(hours=1)).strftime(fmt)
+
+
+class TrendChart(QWidget):
+    """Cột chồng theo bucket: xanh = xác thực OK, đỏ = fail, vàng = phần fail do giả mạo."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(100)
+        self._buckets: list[str] = []
+        self._points: dict[str, RollupPoint] = {}
+        self._bucket_set: set[str] = set()
+
+    @property
+    def buckets(self) -> list[str]:
+        return self._buckets
+
+    @property
+    def points(self) -> list[RollupPoint]:
+        """Các bucket đang vẽ có dữ liệu."""
+        return [point for point in self._points.values() if point.bucket in self._bucket_set]
+
+    def set_data(self, buckets: list[str], points: list[RollupPoint]):
+        """Bucket không có trong points được vẽ là 0."""
+        self._buckets = buckets
+        self._bucket_set = set(buckets)
+        self._points = {point.bucket: point for point in points if point.bucket in self._bucket_set}
+        self.update()
+
+    def add_events(self, rows: list[EventRow]) -> bool:
+        """
+        Cộng event vào bucket theo giờ của created_at (cùng quy tắc đếm với update_rollups).
+        mean_distance không được cập nhật (biểu đồ không vẽ). Trả về True nếu có bucket thay đổi.
+        """
+        changed = False
+        for row in rows:
+            bucket = f"{(row.created_at or '')[:13]}:00:00"
+            if not self._buckets or bucket not in self._bucket_set:
+                continue
+            point = self._points.get(bucket) or RollupPoint(bucket, 0, 0, 0, 0, None)
+            fail = row.event_type == "auth_fail"
+            self._points[bucket] = point._replace(
+                auth_success=point.auth_success + (row.event_type == "auth" and row.result == "success"),
+                auth_fail=point.auth_fail + fail,
+                spoof=point.spoof + (fail and row.spoof_reason is not None),
+                enroll=point.enroll + (row.event_type == "enroll"),
+            )
+            changed = True
+        if changed:
+            self.update()
+        return changed
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = QRectF(self.rect()).adjusted(4, 4, -4, -18)
+        if not self._buckets or rect.width() <= 0 or rect.height() <= 0:
+            return
+
+        peak = max((p.auth_success + p.auth_fail for p in self._points.values()), default=0)
+        scale = rect.height() / peak if peak else 0.0
+        slot = rect.width() / len(self._buckets)
+        bar = max(1.0, slot * 0.7)
+
+        painter.setPen(QPen(QColor(Theme.TEXT_GRAY), 1))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+        painter.drawText(QRectF(rect.left(), rect.top(), 120, 14), Qt.AlignLeft, f"max {peak}/giờ")
+
+        painter.setPen(Qt.NoPen)
+        for i, bucket in enumerate(self._buckets):
+            x = rect.left() + i * slot + (slot - bar) / 2
+            point = self._points.get(bucket)
+            if point is not None:
+                y = rect.bottom()
+                for value, color in ((point.auth_success, Theme.SECONDARY_GREEN),
+                                     (point.auth_fail - point.spoof, Theme.SECONDARY_RED),
+                                     (point.spoof, SPOOF_COLOR)):
+                    height = value * scale
+                    if height > 0:
+                        painter.setBrush(QColor(color))
+                        painter.drawRect(QRectF(x, y - height, bar, height))
+                        y -= height
+            # Nhãn ngày ở bucket 00:00
+            if bucket[11:13] == "00":
+                painter.setPen(QPen(QColor(Theme.TEXT_GRAY), 1))
+                painter.drawText(QRectF(x - 20, rect.bottom() + 2, 60, 14), Qt.AlignLeft, bucket[5:10])
+                painter.setPen(Qt.NoPen)
+        painter.end()
@@ -9,6 +9,7 @@ from PySide6.QtWidgets import QWidget
 
 from UI.styles import Theme
 from modules.camera import CameraThread
+from modules.frame_ring import FrameRef
 from modules.ai.face_analyzer import DistanceStatus, PoseType
 from UI.workers.enroll_worker import FaceProcessingThread
 from .capture_ui import CaptureStepUI
@@ -41,7 +42,8 @@ class CaptureStep(CaptureStepUI, QWidget):
         super().__init__()
         self.current_step_index = 0
         self.captured_data: list[tuple[PoseType, np.ndarray, np.ndarray]] = []
-        self.latest_frame: np.ndarray | None = None
+        self.latest_frame: np.ndarray | None = None  # View chỉ đọc của slot ring (giữ bằng _latest_ref)
+        self._latest_ref: FrameRef | None = None
         self.last_yaw: float | None = None
         self._distance_ok_stable = 0
 
@@ -52,6 +54,8 @@ class CaptureStep(CaptureStepUI, QWidget):
         self.processor_thread.start()
 
         self.last_ai_result = {}
+        # False sau stop(): kết quả AI đến muộn (signal đã xếp hàng) bị bỏ và trả slot
+        self._capturing = False
         self._build_ui()
 
     def _on_models_loaded(self, success: bool, msg: str):
@@ -64,6 +68,7 @@ class CaptureStep(CaptureStepUI, QWidget):
 
     def start_capture(self, user_id: str = "temp"):
         self.user_id = user_id
+        self._capturing = True
         self.current_step_index = 0
         self.captured_data.clear()
         self._reset_checklist()
@@ -97,6 +102,17 @@ class CaptureStep(CaptureStepUI, QWidget):
             self.camera_thread.stop()
             self.camera_thread.wait(1000)  # Doi toi da 1s
             self.camera_thread = None
+        self._capturing = False
+        self._hold_latest_frame(None)
+        # Trả slot của frame đang chờ phân tích và của kết quả AI cuối (không giữ ring sau khi dừng)
+        self.processor_thread.drop_pending_frame()
+        self._drop_ai_result()
+
+    def _drop_ai_result(self):
+        ref = self.last_ai_result.get("frame_ref")
+        self.last_ai_result = {}
+        if ref is not None:
+            ref.release()
 
     def reset_ui(self):
         self.stop()
@@ -107,18 +123,34 @@ class CaptureStep(CaptureStepUI, QWidget):
         self.instruction_label.setText("Chuẩn bị...")
         self.distance_label.clear()
 
-    @Slot(np.ndarray)
-    def _on_frame(self, frame: np.ndarray):
-        self.latest_frame = frame.copy()
+    @Slot(object)
+    def _on_frame(self, ref: FrameRef):
+        self._hold_latest_frame(ref)
         if self.current_step_index >= len(self.POSE_SEQUENCE):
             return
         if self.processor_thread.is_models_loaded:
             current_pose = self.POSE_SEQUENCE[self.current_step_index]
-            self.processor_thread.update_frame(frame, current_pose)
-        self._draw_ui_overlay(frame)
+            self.processor_thread.update_frame(ref, current_pose)
+        self._draw_ui_overlay(ref.array)
+
+    def _hold_latest_frame(self, ref: FrameRef | None):
+        """Giữ slot của frame mới nhất thay vì copy; slot của frame trước được trả lại ring."""
+        old = self._latest_ref
+        self._latest_ref = ref.retain() if ref is not None else None
+        self.latest_frame = ref.array if ref is not None else None
+        if old is not None:
+            old.release()
 
     def _on_ai_result(self, result: dict):
+        if not self._capturing:
+            # Kết quả của frame phân tích trước khi stop()
+            result["frame_ref"].release()
+            return
+        # Kết quả mới giữ slot của frame đã phân tích; trả slot của kết quả trước
+        previous = self.last_ai_result.get("frame_ref")
         self.last_ai_result = result
+        if previous is not None:
+            previous.release()
 
         distance_status = result["distance_status"]
         pose_instruction = result["pose_instruction"]
@@ -192,7 +224,8 @@ class CaptureStep(CaptureStepUI, QWidget):
             self.distance_label.setText("❌ Lỗi hộp khuôn mặt (ngoài biên)")
             return
 
-        cropped = frame_analyzed[y1:y2, x1:x2]
+        # Copy vùng mặt: frame_analyzed là slot của ring, sẽ được ghi lại khi kết quả này bị thay
+        cropped = frame_analyzed[y1:y2, x1:x2].copy()
         if cropped.size == 0:
             self.distance_label.setText("❌ Lỗi cắt ảnh")
             return
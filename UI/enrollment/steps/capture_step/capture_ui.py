@@ -183,7 +183,11 @@ class CaptureStepUI:
             self._display_frame(frame)
             return
 
-        display_frame = frame.copy()
+        # Vẽ lên buffer dùng lại (frame từ ring là chỉ đọc), không cấp phát mỗi frame
+        display_frame = getattr(self, "_display_buffer", None)
+        if display_frame is None or display_frame.shape != frame.shape:
+            display_frame = self._display_buffer = np.empty_like(frame)
+        np.copyto(display_frame, frame)
         dist_status = self.last_ai_result.get("distance_status", DistanceStatus.NO_FACE)
         pose_ok = self.last_ai_result.get("pose_ok", False)
 
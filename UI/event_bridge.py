@@ -0,0 +1,33 @@
+"""
+Cầu nối EventBus (modules/event_bus.py) -> Qt signal.
+Bus gọi callback trên thread ghi (EventWriter, EnrollWorker, ...); signal phát từ thread đó
+được Qt xếp hàng (queued connection) sang thread của receiver, nên slot của view luôn chạy trên UI thread.
+"""
+from PySide6.QtCore import QObject, Signal
+
+from modules.event_bus import EventBus
+
+
+class DatabaseEventBridge(QObject):
+    """Mỗi view tạo 1 bridge và gọi detach() khi dừng để bus không giữ tham chiếu tới object Qt đã hủy."""
+
+    events_logged = Signal(object)  # list[EventRow] theo id tăng dần
+    user_added = Signal(dict)
+    user_updated = Signal(dict)
+    user_deleted = Signal(str)
+
+    def __init__(self, bus: EventBus, parent=None):
+        super().__init__(parent)
+        self.bus = bus
+        self._handlers = {
+            "events": self.events_logged.emit,
+            "user_added": self.user_added.emit,
+            "user_updated": self.user_updated.emit,
+            "user_deleted": self.user_deleted.emit,
+        }
+        for topic, handler in self._handlers.items():
+            bus.subscribe(topic, handler)
+
+    def detach(self):
+        for topic, handler in self._handlers.items():
+            self.bus.unsubscribe(topic, handler)
@@ -123,8 +123,10 @@ class ProfileView(QWidget):
         """Cập nhật thông tin user hiển thị"""
         if not user_data:
             return
+        if user_data == self.current_user:
+            return  # Đang hiển thị đúng user này, không đọc lại avatar
         
-        self.current_user = user_data
+        self.current_user = dict(user_data)
         
         fullname = user_data.get("fullname", "Unknown")
         self.name_label.setText(fullname)
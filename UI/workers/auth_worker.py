@@ -1,109 +1,197 @@
-from PySide6.QtCore import QThread, Signal
+from PySide6.QtCore import QObject, Signal
 import numpy as np
+import threading
 import time
-from modules.ai.face_analyzer import FaceAnalyzer, PoseType
-from modules.authenticator import Authenticator
+import uuid
+from collections import deque
+from modules.ai.face_analyzer import FaceAnalyzer, PoseType, create_face_mesh
+from modules.authenticator import get_shared_authenticator
 from modules.ai.liveness_detector import LivenessDetector
+from modules.frame_ring import FrameRef
+from UI.workers.inference_scheduler import InferenceScheduler, get_inference_scheduler
 
+# Số frame gần nhất giữ lại để thống kê độ trễ capture -> kết quả
+LATENCY_WINDOW = 120
 
-class AuthWorker(QThread):
+
+class AuthWorker(QObject):
+    """
+    1 luồng xác thực (1 camera / 1 cổng). Không có thread riêng: InferenceScheduler dùng chung
+    (model nạp 1 lần) gọi process_pending() khi tới lượt luồng này; signal được Qt chuyển sang UI thread.
+    Luồng chỉ giữ frame chờ mới nhất và trạng thái phiên (liveness, session, fail_count).
+    """
     result_ready = Signal(dict)
-    auth_result = Signal(bool, str, float)
+    auth_result = Signal(bool, str, float, float, dict)  # success, user_id, distance, margin, info (session/latency)
     model_ready = Signal()
     timeout_warning = Signal(str)  # NEW: Signal để thông báo timeout
     
-    def __init__(self, parent=None):
+    def __init__(self, scheduler: InferenceScheduler | None = None, parent=None):
         super().__init__(parent)
       
+        self.scheduler = scheduler or get_inference_scheduler()
         self.face_analyzer = None
         self.authenticator = None
         self.liveness_detector = None
-        self._running = True
-        self._pending_frame = None
-        self._models_loaded = False
+        self._pending_frame: FrameRef | None = None  # Frame mới nhất chờ xử lý (đang giữ ref của slot)
+        self._pending_since: float | None = None
+        self._frame_lock = threading.Lock()
+        self.ready = False
+        self._stopped = False
+        self.has_face = False  # Kết quả gần nhất có mặt người (scheduler ưu tiên luồng này)
         self.last_auth_time = 0
+        self.last_face_time = 0
+        # (chờ trong hàng đợi, capture -> kết quả) ms của LATENCY_WINDOW frame gần nhất
+        self._latencies: deque[tuple[float, float]] = deque(maxlen=LATENCY_WINDOW)
         
         self.auth_start_time = None  
+        self.session_id = None  # Mã phiên xác thực (ghi kèm events)
         self.timeout_threshold = 30.0  
         self.fail_count = 0  
         self.max_fails = 3  
 
-    def process_frame(self, frame: np.ndarray):
-        self._pending_frame = frame
+    def start(self):
+        """Đăng ký với scheduler; model_ready phát khi luồng đã được gắn model."""
+        print("[AuthWorker] Registering with inference scheduler")
+        self.scheduler.register(self)
 
-    def run(self):
-        print("[AuthWorker] Starting - Loading models...")
-        
-        try:
-            self.face_analyzer = FaceAnalyzer()
-            self.face_analyzer._ensure_models()
-            self.authenticator = Authenticator()
-            self.liveness_detector = LivenessDetector()
-            self._models_loaded = True
-            self.model_ready.emit()
-        except Exception as e:
-            print(f"[AuthWorker] Failed to load models: {e}")
+    def attach_models(self, face_mesh=None):
+        """
+        Scheduler gọi (trên thread của nó) 1 lần: model dùng chung + FaceMesh / LivenessDetector riêng của luồng.
+        face_mesh: FaceMesh static_image_mode dùng chung (nhiều luồng), None = luồng tạo FaceMesh tracking riêng
+        cho FaceAnalyzer và liveness (tracking không được nhận frame xen kẽ từ camera khác).
+        """
+        self.face_analyzer = FaceAnalyzer(face_mesh=face_mesh or create_face_mesh())
+        self.face_analyzer._ensure_models()
+        self.authenticator = get_shared_authenticator()
+        self.liveness_detector = LivenessDetector(face_mesh=face_mesh)
+        self.ready = True
+        self.model_ready.emit()
+
+    def process_frame(self, frame: FrameRef):
+        """Giữ frame mới nhất (retain, không copy); frame chờ trước đó chưa xử lý được trả lại ring."""
+        ref = frame.retain()
+        with self._frame_lock:
+            old, self._pending_frame = self._pending_frame, ref
+            if old is None:
+                self._pending_since = time.monotonic()
+        if old is not None:
+            old.release()
+        self.scheduler.notify()
+
+    def pending_since(self) -> float | None:
+        """Thời điểm (monotonic) frame chờ xuất hiện, None nếu không có frame chờ."""
+        return self._pending_since
+
+    def _take_pending_frame(self) -> tuple[FrameRef | None, float | None]:
+        """(frame chờ, thời điểm luồng bắt đầu có frame chờ)."""
+        with self._frame_lock:
+            ref, self._pending_frame = self._pending_frame, None
+            since, self._pending_since = self._pending_since, None
+        return ref, since
+
+    def process_pending(self):
+        """Xử lý frame chờ (chạy trên thread của scheduler)."""
+        ref, enqueued_at = self._take_pending_frame()
+        if ref is None:
             return
+        if self._stopped:
+            # stop() không chờ scheduler: frame lấy ra sau khi luồng đã dừng thì bỏ
+            ref.release()
+            return
+        queue_ms = 1000.0 * (time.monotonic() - enqueued_at)
+        # View chỉ đọc của slot, slot không bị ghi đè tới khi release()
+        frame = ref.array
         
-        while self._running:
-            if self._pending_frame is not None and self._models_loaded:
-                frame = self._pending_frame.copy()
-                self._pending_frame = None
+        try:
+            self._check_authentication_timeout()
+            
+            # 1. Phân tích frame
+            result = self.face_analyzer.analyze_frame(frame, PoseType.FRONTAL)
+            self.has_face = bool(result["has_face"])
+            
+            if result["has_face"]:
+                if self.auth_start_time is None:
+                    self.auth_start_time = time.time()
+                    self.session_id = uuid.uuid4().hex
+                    print(f"[AuthWorker] Authentication session started at {self.auth_start_time}")
+                
+                # 2. Xử lý Landmarks & Pose
+                current_landmarks = result.get("landmarks") or result.get("kps")
+                current_pose = result.get("yaw", 0)
                 
-                try:
-                    self._check_authentication_timeout()
-                    
-                    # 1. Phân tích frame
-                    result = self.face_analyzer.analyze_frame(frame, PoseType.FRONTAL)
-                    
-                    if result["has_face"]:
-                        if self.auth_start_time is None:
-                            self.auth_start_time = time.time()
-                            print(f"[AuthWorker] Authentication session started at {self.auth_start_time}")
-                        
-                        # 2. Xử lý Landmarks & Pose
-                        current_landmarks = result.get("landmarks") or result.get("kps")
-                        current_pose = result.get("yaw", 0)
-                        if current_pose is not None:
-                            print(f"[DEBUG] Pose Data detected: {current_pose}")
-                        else:
-                            print("[DEBUG] Pose Data is MISSING from analyzer result!")
-                        
-                        # 3. Gọi Liveness Detector
-                        is_real, score, liveness_dict = self.liveness_detector.check_liveness(
-                            frame=frame,
-                            face_box=result["face_box"],
-                            landmarks=current_landmarks,
-                            head_pose=current_pose
-                        )
-                        # Khong dung dem timeout khi pass liveness, nhung van giu auth_start_time de hien thi timer
-                        # 4. Cập nhật kết quả tổng hợp
-                        result.update({
-                            "is_real": is_real,
-                            "liveness_score": score,
-                            "liveness_status": liveness_dict["status"],
-                            "pose_instruction": liveness_dict["instruction"],
-                            "moves_completed": liveness_dict.get("moves_completed", []),
-                            "completed_challenges": liveness_dict.get("completed_challenges", []),
-                            "fail_count": self.fail_count,  # NEW: Thêm fail_count vào result
-                            "time_elapsed": time.time() - self.auth_start_time if self.auth_start_time else 0  # NEW
-                        })
-
-                        self.last_face_time = time.time()
-                    else: 
-                        if time.time() - getattr(self, 'last_face_time', 0) > 1.5:
-                            self.liveness_detector.reset()
-                            # NEW: Reset timeout khi không có mặt lâu
-                            if self.auth_start_time and time.time() - self.auth_start_time > 3.0:
-                                print("[AuthWorker] No face for too long, resetting session")
-                                self.auth_start_time = None
-                    
-                    self.result_ready.emit(result)
-                    
-                except Exception as e:
-                    print(f"[AuthWorker] Error processing frame: {e}")
+                # 3. Gọi Liveness Detector
+                is_real, score, liveness_dict = self.liveness_detector.check_liveness(
+                    frame=frame,
+                    face_box=result["face_box"],
+                    landmarks=current_landmarks,
+                    head_pose=current_pose,
+                    timestamp=ref.timestamp
+                )
+                # Khong dung dem timeout khi pass liveness, nhung van giu auth_start_time de hien thi timer
+                # 4. Cập nhật kết quả tổng hợp
+                result.update({
+                    "is_real": is_real,
+                    "liveness_score": score,
+                    "liveness_status": liveness_dict["status"],
+                    "pose_instruction": liveness_dict["instruction"],
+                    "moves_completed": liveness_dict.get("moves_completed", []),
+                    "completed_challenges": liveness_dict.get("completed_challenges", []),
+                    "fail_count": self.fail_count,  # NEW: Thêm fail_count vào result
+                    "session_id": self.session_id,
+                    "spoof_reason": self._spoof_reason(liveness_dict),
+                    "time_elapsed": time.time() - self.auth_start_time if self.auth_start_time else 0  # NEW
+                })
+
+                self.last_face_time = time.time()
+            else: 
+                if time.time() - getattr(self, 'last_face_time', 0) > 1.5:
+                    self.liveness_detector.reset()
+                    # NEW: Reset timeout khi không có mặt lâu
+                    if self.auth_start_time and time.time() - self.auth_start_time > 3.0:
+                        print("[AuthWorker] No face for too long, resetting session")
+                        self.auth_start_time = None
+            
+            latency_ms = ref.latency_ms()
+            self._latencies.append((queue_ms, latency_ms))
+            result.update({
+                "frame_seq": ref.seq,
+                "frame_timestamp": ref.timestamp,
+                "queue_ms": queue_ms,
+                "latency_ms": latency_ms,
+            })
+            self.result_ready.emit(result)
             
-            self.msleep(20)
+        except Exception as e:
+            print(f"[AuthWorker] Error processing frame: {e}")
+        finally:
+            ref.release()
+
+    def get_latency_stats(self) -> dict:
+        """
+        Độ trễ trên LATENCY_WINDOW frame gần nhất: chờ scheduler (queue) và capture -> kết quả (latency).
+
+        Returns:
+            dict: {"frames", "queue_ms", "latency_ms", "latency_p95_ms", "latency_max_ms"}
+        """
+        samples = np.array(self._latencies, dtype=np.float64).reshape(-1, 2)
+        if not len(samples):
+            return {"frames": 0, "queue_ms": 0.0, "latency_ms": 0.0, "latency_p95_ms": 0.0, "latency_max_ms": 0.0}
+        return {
+            "frames": len(samples),
+            "queue_ms": float(samples[:, 0].mean()),
+            "latency_ms": float(samples[:, 1].mean()),
+            "latency_p95_ms": float(np.percentile(samples[:, 1], 95)),
+            "latency_max_ms": float(samples[:, 1].max()),
+        }
+
+    @staticmethod
+    def _spoof_reason(liveness_dict: dict) -> str | None:
+        """Lý do giả mạo (strong reason hoặc các soft reason) khi liveness báo SPOOF."""
+        if not str(liveness_dict.get("status", "")).startswith("SPOOF"):
+            return None
+        if liveness_dict.get("strong_reason"):
+            return liveness_dict["strong_reason"]
+        return ",".join(liveness_dict.get("soft_reasons", [])[:3]) or None
 
     def _check_authentication_timeout(self):
         """NEW: Kiểm tra timeout trong quá trình xác thực"""
@@ -133,9 +221,19 @@ class AuthWorker(QThread):
             
             print("[AuthWorker] Session reset due to timeout")
 
-    def authenticate(self, embedding: np.ndarray):
+    def authenticate(self, embedding: np.ndarray, pose: str | None = None):
         if embedding is not None:
-            success, user_id, distance = self.authenticator.authenticate(embedding)
+            # So khớp top-k theo user: quyết định accept/reject dựa trên distance + margin top1-top2.
+            # Biết pose hiện tại -> quét nhóm pose tương ứng trước.
+            # Enrollment mới được InferenceScheduler sync() vào gallery trên thread của nó (không chặn UI)
+            start = time.perf_counter()
+            match = self.authenticator.authenticate_topk(embedding, k=2, pose=pose)
+            success = match["success"]
+            info = {
+                "session_id": self.session_id,
+                "fail_count": self.fail_count,
+                "latency_ms": 1000.0 * (time.perf_counter() - start),
+            }
             
             # NEW: Nếu xác thực thành công, reset fail_count
             if success:
@@ -143,7 +241,7 @@ class AuthWorker(QThread):
                 self.fail_count = 0
                 self.auth_start_time = None  # Reset session
             
-            self.auth_result.emit(success, user_id, distance)
+            self.auth_result.emit(success, match["user_id"], match["distance"], match["margin"], info)
 
     def reset_session(self):
         """NEW: Public method để reset session từ bên ngoài"""
@@ -157,6 +255,12 @@ class AuthWorker(QThread):
         self.fail_count = 0
 
     def stop(self):
-        self._running = False
-        self.wait()
-        print("[AuthWorker] Stopped")
+        """Bỏ đăng ký với scheduler (không chờ lượt xử lý đang chạy) và trả frame chờ về ring."""
+        self._stopped = True
+        self.scheduler.unregister(self)
+        ref, _ = self._take_pending_frame()
+        if ref is not None:
+            ref.release()
+        stats = self.get_latency_stats()
+        print(f"[AuthWorker] Stopped: {stats['frames']} frames, latency {stats['latency_ms']:.1f}ms "
+              f"(p95 {stats['latency_p95_ms']:.1f}ms, queue {stats['queue_ms']:.1f}ms)")
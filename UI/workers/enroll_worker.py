@@ -6,6 +6,7 @@ Tách riêng để đơn giản hóa UI và giữ file ngắn hơn.
 from PySide6.QtCore import QThread, QMutex, QWaitCondition, Signal
 
 from modules.ai.face_analyzer import FaceAnalyzer, DistanceStatus, PoseType
+from modules.frame_ring import FrameRef
 
 
 class FaceProcessingThread(QThread):
@@ -20,7 +21,7 @@ class FaceProcessingThread(QThread):
         super().__init__()
         self.face_analyzer: FaceAnalyzer | None = None
         self.running = True
-        self.latest_frame = None
+        self.latest_frame: FrameRef | None = None  # Ref tới slot ring của frame chờ xử lý
         self.target_pose: PoseType | None = None
         self.frame_mutex = QMutex()
         self.condition = QWaitCondition()
@@ -39,17 +40,20 @@ class FaceProcessingThread(QThread):
             print(f"Error loading models: {exc}")
             self.model_loaded.emit(False, str(exc))
 
-    def update_frame(self, frame, target_pose: PoseType):
-        """Nhận frame mới và pose mục tiêu cần kiểm tra."""
+    def update_frame(self, frame: FrameRef, target_pose: PoseType):
+        """Nhận frame mới (giữ slot, không copy) và pose mục tiêu cần kiểm tra."""
         if not self.is_models_loaded:
             return
         self._frame_counter += 1
         if self._frame_counter % self.PROCESS_EVERY_N_FRAMES != 0:
             return
+        ref = frame.retain()
         self.frame_mutex.lock()
-        self.latest_frame = frame.copy()
+        old, self.latest_frame = self.latest_frame, ref
         self.target_pose = target_pose
         self.frame_mutex.unlock()
+        if old is not None:
+            old.release()
         self.condition.wakeOne()
 
     def run(self):
@@ -62,7 +66,7 @@ class FaceProcessingThread(QThread):
                 self.frame_mutex.unlock()
                 continue
 
-            frame = self.latest_frame
+            ref = self.latest_frame
             target_pose = self.target_pose
             self.latest_frame = None
             self.frame_mutex.unlock()
@@ -70,24 +74,36 @@ class FaceProcessingThread(QThread):
             if self.is_models_loaded and self.face_analyzer is not None:
                 try:
                     # Gọi hàm phân tích tối ưu (1 pass)
-                    result = self.face_analyzer.analyze_frame(frame, target_pose)
+                    result = self.face_analyzer.analyze_frame(ref.array, target_pose)
                     
-                    # Đính kèm frame gốc vào result để đảm bảo đồng bộ khi chụp
-                    # (Lưu ý: việc truyền frame qua signal có thể copy data, nhưng cần thiết để khớp)
-                    result["frame"] = frame 
+                    # Đính kèm frame gốc vào result để đảm bảo đồng bộ khi chụp.
+                    # Signal chỉ truyền tham chiếu; ref chuyển cho người nhận (release khi thay kết quả)
+                    result["frame"] = ref.array
+                    result["frame_ref"] = ref
+                    result["frame_seq"] = ref.seq
+                    result["frame_timestamp"] = ref.timestamp
+                    result["latency_ms"] = ref.latency_ms()
                     
                     self.result_ready.emit(result)
+                    continue
                 except Exception as exc:  # pragma: no cover
                     print(f"Processing error: {exc}")
+            ref.release()
 
     def stop(self):
         self.running = False
-        self.frame_mutex.lock()
-        self.latest_frame = None  # Clear để tránh memory leak
-        self.frame_mutex.unlock()
+        self.drop_pending_frame()
         self.condition.wakeOne()
         self.wait()
 
+    def drop_pending_frame(self):
+        """Bỏ frame đang chờ phân tích và trả slot cho ring (camera dừng, không giữ frame)."""
+        self.frame_mutex.lock()
+        ref, self.latest_frame = self.latest_frame, None
+        self.frame_mutex.unlock()
+        if ref is not None:
+            ref.release()
+
     def reset_pose_state(self):
         """Reset baseline pose khi bắt đầu sequence mới."""
         if self.face_analyzer is not None:
@@ -0,0 +1,196 @@
+"""
+Inference Scheduler - 1 thread AI dùng chung cho N luồng camera (N cổng xác thực).
+- Model (InsightFace, authenticator) chỉ nạp 1 lần; FaceMesh tracking mỗi luồng 1 instance
+  (hoặc 1 FaceMesh static_image_mode dùng chung khi nhiều luồng)
+- Mỗi luồng (AuthWorker) chỉ giữ frame chờ mới nhất + trạng thái phiên (liveness, session, fail_count)
+- Mỗi lượt chọn 1 luồng có frame chờ: ưu tiên luồng đang có mặt người, xoay vòng giữa các luồng
+  cùng mức ưu tiên; luồng chờ quá MAX_WAIT được phục vụ trước để luồng không có mặt vẫn phát hiện người mới
+- Gallery dùng chung được sync() (enrollment / xóa mới) trên thread này mỗi SYNC_INTERVAL, không trên UI thread
+"""
+import threading
+import time
+
+import mediapipe as mp
+from PySide6.QtCore import QThread
+
+from modules.ai.face_analyzer import FaceAnalyzer
+from modules.authenticator import get_shared_authenticator
+
+# Luồng có frame chờ lâu hơn mức này (giây) được ưu tiên bất kể có mặt người hay không
+MAX_WAIT = 0.5
+# Chu kỳ (giây) áp dụng thay đổi gallery từ database vào Authenticator dùng chung
+SYNC_INTERVAL = 1.0
+
+_scheduler: "InferenceScheduler | None" = None
+_scheduler_lock = threading.Lock()
+
+
+def get_inference_scheduler() -> "InferenceScheduler":
+    """Scheduler dùng chung của process (tạo lần đầu khi gọi)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler()
+        return _scheduler
+
+
+def wait_inference_scheduler():
+    """Đóng app: đợi thread scheduler thoát (sau khi mọi luồng đã unregister) để không còn thread chạy."""
+    with _scheduler_lock:
+        scheduler = _scheduler
+    if scheduler is not None:
+        scheduler.wait()
+
+
+class InferenceScheduler(QThread):
+    """
+    Thread chạy khi còn luồng đăng ký, tự dừng khi luồng cuối unregister (model vẫn giữ trong bộ nhớ).
+    Luồng đăng ký là object có: ready, has_face, pending_since(), process_pending(), attach_models(face_mesh).
+    """
+
+    def __init__(self, share_face_mesh: bool = True, parent=None):
+        """
+        Args:
+            share_face_mesh: True = khi đã có từ 2 luồng đăng ký, luồng được gắn model dùng chung 1 FaceMesh
+                liveness (static_image_mode, đỡ bộ nhớ khi nhiều cổng); False = luôn mỗi luồng 1 FaceMesh.
+                Luồng đơn (kiosk 1 cổng) luôn có FaceMesh tracking riêng (nhanh hơn mỗi frame)
+        """
+        super().__init__(parent)
+        self.share_face_mesh = share_face_mesh
+        self._streams: list = []
+        self._cond = threading.Condition()
+        self._active = False
+        self._next = 0
+        self._models_loaded = False
+        self.face_mesh = None
+        self.authenticator = None
+        self._last_sync = 0.0
+        self.stats = {"processed": 0, "idle_waits": 0}
+
+    def register(self, stream):
+        """Thêm luồng; luồng nhận model qua attach_models() trên thread scheduler."""
+        with self._cond:
+            if stream in self._streams:
+                return
+            self._streams.append(stream)
+            restart = not self._active
+            self._active = True
+            self._cond.notify()
+        if restart:
+            # Lần chạy trước (nếu có) đã quyết định thoát: đợi thoát hẳn rồi chạy lại
+            self.wait()
+            self.start()
+
+    def unregister(self, stream):
+        """
+        Bỏ luồng và báo scheduler rồi trả về ngay (không chặn UI thread): lượt xử lý đang chạy của luồng
+        (nếu có) vẫn chạy xong trên thread scheduler. Luồng cuối bỏ đi thì thread tự thoát;
+        khi đóng app gọi wait_inference_scheduler() để đợi.
+        """
+        with self._cond:
+            if stream in self._streams:
+                self._streams.remove(stream)
+            self._cond.notify()
+
+    def notify(self):
+        """Luồng gọi khi có frame mới."""
+        with self._cond:
+            self._cond.notify()
+
+    def _load_models(self) -> bool:
+        if self._models_loaded:
+            return True
+        print("[InferenceScheduler] Loading models...")
+        try:
+            FaceAnalyzer()._ensure_models()
+            self.authenticator = get_shared_authenticator()
+        except Exception as e:
+            print(f"[InferenceScheduler] Failed to load models: {e}")
+            return False
+        self._last_sync = time.monotonic()
+        self._models_loaded = True
+        return True
+
+    def _face_mesh_for(self, n_streams: int):
+        """
+        FaceMesh cho luồng sắp gắn model (FaceAnalyzer + liveness): None = luồng tự tạo FaceMesh tracking riêng.
+        Chỉ instance static_image_mode mới dùng chung được: tracking nhận frame xen kẽ từ nhiều camera
+        sẽ lấy landmark của camera này làm điểm khởi đầu cho camera khác.
+        """
+        if not self.share_face_mesh or n_streams < 2:
+            return None
+        if self.face_mesh is None:
+            # Static mode: không giữ tracking giữa các frame nên dùng chung được cho nhiều luồng
+            self.face_mesh = mp.solutions.face_mesh.FaceMesh(
+                static_image_mode=True,
+                max_num_faces=1,
+                refine_landmarks=True,
+                min_detection_confidence=0.5
+            )
+        return self.face_mesh
+
+    def _sync_gallery(self):
+        """Áp dụng enrollment / xóa mới vào gallery dùng chung (thread scheduler, không chặn UI)."""
+        self._last_sync = time.monotonic()
+        try:
+            self.authenticator.sync()
+        except Exception as e:
+            print(f"[InferenceScheduler] Gallery sync failed: {e}")
+
+    def _pick(self):
+        """Luồng được xử lý tiếp theo (gọi khi giữ _cond) hoặc None nếu không luồng nào có frame chờ."""
+        now = time.monotonic()
+        count = len(self._streams)
+        best, best_key = None, None
+        for offset in range(count):
+            position = (self._next + offset) % count
+            stream = self._streams[position]
+            since = stream.pending_since()
+            if since is None:
+                continue
+            key = (now - since <= MAX_WAIT, not stream.has_face, offset)
+            if best_key is None or key < best_key:
+                best, best_key = position, key
+        if best is None:
+            return None
+        self._next = (best + 1) % count
+        return self._streams[best]
+
+    def run(self):
+        if not self._load_models():
+            with self._cond:
+                self._active = False
+            return
+        print("[InferenceScheduler] Started")
+
+        while True:
+            with self._cond:
+                while True:
+                    if not self._streams:
+                        self._active = False
+                        print(f"[InferenceScheduler] Stopped (processed {self.stats['processed']} frames)")
+                        return
+                    # Luồng mới: gắn model trước khi nhận frame
+                    fresh = [s for s in self._streams if not s.ready]
+                    stream = fresh[0] if fresh else self._pick()
+                    if stream is not None:
+                        break
+                    self.stats["idle_waits"] += 1
+                    self._cond.wait()
+                n_streams = len(self._streams)
+
+            try:
+                if not stream.ready:
+                    stream.attach_models(self._face_mesh_for(n_streams))
+                else:
+                    if time.monotonic() - self._last_sync >= SYNC_INTERVAL:
+                        self._sync_gallery()
+                    stream.process_pending()
+                    self.stats["processed"] += 1
+            except Exception as e:
+                print(f"[InferenceScheduler] Error processing stream: {e}")
+            finally:
+                with self._cond:
+                    if not stream.ready and stream in self._streams:
+                        # Gắn model lỗi: bỏ luồng thay vì thử lại mãi
+                        self._streams.remove(stream)
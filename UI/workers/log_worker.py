@@ -0,0 +1,71 @@
+"""
+Thread đọc bảng events cho Dashboard: truy vấn DB chạy ngoài UI thread,
+kết quả trả về qua signal (queued connection) cho EventLogModel / TrendChart.
+"""
+import queue
+import sqlite3
+
+from PySide6.QtCore import QThread, Signal
+
+from modules.database import DatabaseManager, PAGE_SIZE
+
+
+class LogWorker(QThread):
+    """Xử lý lần lượt các yêu cầu đọc trang cũ hơn / event mới hơn."""
+
+    older_loaded = Signal(object, object)  # before_id của yêu cầu, list[EventRow] (None nếu lỗi)
+    newer_loaded = Signal(object, object)  # after_id của yêu cầu, list[EventRow] cũ nhất trước (None nếu lỗi)
+    # (start, end, granularity) của yêu cầu, list[RollupPoint], id event lớn nhất đã gộp (0 nếu lỗi)
+    rollups_loaded = Signal(object, object, int)
+
+    def __init__(self, db: DatabaseManager, page_size: int = PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.page_size = page_size
+        self._requests: queue.Queue = queue.Queue()
+        self._running = True
+
+    def request_older(self, before_id: int | None):
+        """Yêu cầu 1 trang events có id < before_id (None = trang mới nhất)."""
+        self._requests.put(("older", before_id))
+
+    def request_newer(self, after_id: int):
+        """Yêu cầu mọi event có id > after_id."""
+        self._requests.put(("newer", after_id))
+
+    def request_rollups(self, start: str, end: str, granularity: str = "hour"):
+        """Yêu cầu các bucket rollup trong [start, end) (gộp event mới trước khi đọc)."""
+        self._requests.put(("rollups", (start, end, granularity)))
+
+    def run(self):
+        while self._running:
+            request = self._requests.get()
+            if request is None:
+                break
+            kind, key = request
+            try:
+                if kind == "older":
+                    self.older_loaded.emit(key, self.db.get_events_page(key, self.page_size))
+                elif kind == "rollups":
+                    self.rollups_loaded.emit(key, *self.db.get_rollup_snapshot(*key))
+                else:
+                    rows, after_id = [], key
+                    while True:
+                        page = self.db.get_events_after(after_id, self.page_size)
+                        rows.extend(page)
+                        if len(page) < self.page_size:
+                            break
+                        after_id = page[-1].id
+                    self.newer_loaded.emit(key, rows)
+            except sqlite3.Error as e:
+                print(f"[LogWorker] Query failed: {e}")
+                if kind == "rollups":
+                    self.rollups_loaded.emit(key, None, 0)
+                else:
+                    (self.older_loaded if kind == "older" else self.newer_loaded).emit(key, None)
+
+    def stop(self):
+        self._running = False
+        self._requests.put(None)
+        self.wait()
+        print("[LogWorker] Stopped")
@@ -0,0 +1,36 @@
+"""
+Thread bảo trì database chạy định kỳ: chuyển event cũ sang file archive theo tháng
+và incremental vacuum, để database chính luôn nhỏ dù kiosk chạy bao lâu.
+Nhật ký thay đổi embedding cũng được prune tới watermark mà Authenticator đã sync qua,
+và index xấp xỉ (IVF) được train lại ở đây thay vì trong sync() trên thread xác thực.
+"""
+import sqlite3
+
+from PySide6.QtCore import QThread, Signal
+
+from modules.authenticator import retrain_shared_index, synced_change_seq
+from modules.database import DatabaseManager, RETENTION_DAYS
+
+
+class MaintenanceWorker(QThread):
+    """Chạy 1 lượt archive_events() + prune_embedding_changes() + retrain index rồi kết thúc."""
+
+    archived = Signal(int)  # số event đã chuyển sang archive
+
+    def __init__(self, db: DatabaseManager, retention_days: int = RETENTION_DAYS, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.retention_days = retention_days
+
+    def run(self):
+        try:
+            moved = self.db.archive_events(self.retention_days)
+        except sqlite3.Error as e:
+            print(f"[MaintenanceWorker] Archive failed: {e}")
+            moved = 0
+        try:
+            self.db.prune_embedding_changes(synced_change_seq(self.db))
+        except sqlite3.Error as e:
+            print(f"[MaintenanceWorker] Prune failed: {e}")
+        retrain_shared_index(self.db)
+        self.archived.emit(moved)
@@ -1,3 +1,4 @@
+import argparse
 import sys
 import os
 
@@ -6,9 +7,20 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from PySide6.QtWidgets import QApplication
 from UI.base_ui import BaseWindow
+from modules.camera import set_default_source
 
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Face Recognition")
+    parser.add_argument("--source", help="Nguồn frame thay webcam: file video, thư mục ảnh hoặc phiên đã ghi")
+    parser.add_argument("--fast", action="store_true", help="Phát nguồn nhanh nhất có thể thay vì theo nhịp gốc")
+    parser.add_argument("--loop", action="store_true", help="Phát lại nguồn từ đầu khi hết (soak test)")
+    args, qt_args = parser.parse_known_args()
+    if args.loop and (not args.source or args.source.isdigit()):
+        parser.error("--loop chỉ dùng với --source là file video, thư mục ảnh hoặc phiên đã ghi (không phải webcam)")
+    if args.source:
+        set_default_source(args.source, realtime=not args.fast, loop=args.loop)
+
+    app = QApplication([sys.argv[0], *qt_args])
     
     window = BaseWindow()
     window.show()
@@ -6,7 +6,7 @@ Pose-logic đã được tách sang modules/pose_logic.py.
 import os
 from enum import Enum
 import numpy as np
-from modules.ai.pose_logic import check_pose_logic
+from modules.ai.pose_logic import check_pose_logic, classify_pose
 
 _mp_face_mesh = None
 _insightface_app = None
@@ -46,27 +46,37 @@ FACE_AREA_MIN_RATIO_BY_POSE = {
 }
 
 
+def create_face_mesh():
+    """FaceMesh tracking mới (landmark frame sau dựa trên frame trước: mỗi nguồn camera cần 1 instance riêng)."""
+    import mediapipe as mp
+
+    return mp.solutions.face_mesh.FaceMesh(
+        static_image_mode=False,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5,
+    )
+
+
 def _get_face_mesh():
-    """Lazy load MediaPipe FaceMesh."""
+    """Lazy load MediaPipe FaceMesh dùng chung của process (enrollment, 1 nguồn camera)."""
     global _mp_face_mesh
     if _mp_face_mesh is None:
-        import mediapipe as mp
-
-        _mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
-            static_image_mode=False,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5,
-        )
+        _mp_face_mesh = create_face_mesh()
     return _mp_face_mesh
 
 
 class FaceAnalyzer:
     """Phân tích khuôn mặt: detect, pose, embedding."""
 
-    def __init__(self, use_gpu: bool = True, model_name: str = "buffalo_l"):
-        self.face_mesh = None
+    def __init__(self, use_gpu: bool = True, model_name: str = "buffalo_l", face_mesh=None):
+        """
+        Args:
+            face_mesh: FaceMesh riêng của nguồn camera này (create_face_mesh() hoặc instance static_image_mode
+                dùng chung giữa nhiều luồng). None = FaceMesh tracking dùng chung của process
+        """
+        self.face_mesh = face_mesh
         self.insightface = None
         self._last_face_box = None
 
@@ -74,6 +84,8 @@ class FaceAnalyzer:
         self._last_pose_ok = False
         self._last_instruction = ""
         self._stable_frames = 0
+        # (h_ratio, v_ratio) của lần kiểm tra pose gần nhất
+        self._last_ratios = None
 
         self.use_gpu = use_gpu
         self.model_name = model_name
@@ -95,6 +107,8 @@ class FaceAnalyzer:
             "pose_ok": bool,
             "pose_instruction": str,
             "yaw": float | None,
+            "pose_ratio": tuple[float, float] | None,  # (h_ratio, v_ratio)
+            "live_pose": str | None,                   # nhóm pose hiện tại (classify_pose)
             "embedding": np.ndarray | None,
             "face_crop": np.ndarray | None
         }
@@ -111,6 +125,8 @@ class FaceAnalyzer:
                 "pose_ok": False,
                 "pose_instruction": "Không tìm thấy khuôn mặt",
                 "yaw": None,
+                "pose_ratio": None,
+                "live_pose": None,
                 "embedding": None,
                 "face_crop": None,
             }
@@ -135,6 +151,7 @@ class FaceAnalyzer:
         pose_ok = False
         instruction = ""
         yaw = None
+        self._last_ratios = None
 
         if dist_status == DistanceStatus.OK:
             pose_ok, instruction, yaw = self._check_pose_logic(frame, target_pose)
@@ -152,6 +169,8 @@ class FaceAnalyzer:
             "pose_ok": pose_ok,
             "pose_instruction": instruction,
             "yaw": yaw,
+            "pose_ratio": self._last_ratios,
+            "live_pose": classify_pose(*self._last_ratios) if self._last_ratios else None,
             "embedding": embedding,
             "face_crop": None
         }
@@ -164,6 +183,7 @@ class FaceAnalyzer:
             new_last_pose_ok,
             new_last_instruction,
             new_stable_frames,
+            self._last_ratios,
         ) = check_pose_logic(
             frame=frame,
             face_mesh=self.face_mesh,
@@ -6,7 +6,11 @@ import random
 from modules.ai.pose_logic import calculate_pose_ratio, RATIO_THRESHOLDS
 
 class LivenessDetector:
-    def __init__(self):
+    def __init__(self, face_mesh=None):
+        """
+        face_mesh: FaceMesh dùng chung do bên ngoài tạo (InferenceScheduler, static_image_mode cho nhiều luồng).
+        None = tạo FaceMesh riêng ở chế độ tracking (1 luồng camera).
+        """
         self.laplacian_base_threshold = 20.0
         self.laplacian_adaptive = True
         self.brightness_compensation = True
@@ -35,7 +39,7 @@ class LivenessDetector:
         self.has_dynamic_movement = False
         self.video_replay_flag = False
 
-        self.mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
+        self.mp_face_mesh = face_mesh or mp.solutions.face_mesh.FaceMesh(
             max_num_faces=1,
             refine_landmarks=True,
             min_detection_confidence=0.5
@@ -49,7 +53,7 @@ class LivenessDetector:
 
         self.challenge_list = random.sample(["BLINK", "TURN_LEFT", "TURN_RIGHT", "BLINK_TWICE"], k=3)
         self.current_challenge_index = 0
-        self.challenge_time = 0
+        self.challenge_time = None  # Timestamp bắt đầu challenge hiện tại (None = chưa bắt đầu)
         self.challenge_window = 4.0
         self.completed_challenges = []
         self.required_blink_count = 1
@@ -65,8 +69,11 @@ class LivenessDetector:
         self.brightness_buffer = []
         self.nose_y_buffer = []
         self.ear_buffer = []
+        # Timestamp của từng mẫu trong brightness_buffer / nose_y_buffer (FFT lấy mẫu lại theo khoảng cách thật)
+        self.brightness_times = []
+        self.nose_y_times = []
         self.buffer_size = 30
-        self.frame_rate = 30.0
+        self.frame_rate = 30.0  # FPS đo từ timestamp của buffer (giá trị đầu khi chưa đủ mẫu)
         self.tremor_min_freq = 8.0
         self.tremor_max_freq = 12.0
         self.tremor_amp_thresh = 0.1
@@ -114,7 +121,7 @@ class LivenessDetector:
             
         return high_freq_energy > moire_thresh
 
-    def detect_flash(self, current_brightness):
+    def detect_flash(self, current_brightness, timestamp):
         if self.prev_brightness is None:
             self.prev_brightness = current_brightness
             return False
@@ -123,7 +130,7 @@ class LivenessDetector:
         is_flash = brightness_change > self.brightness_change_threshold
         
         if is_flash:
-            self.flash_history.append(time.time())
+            self.flash_history.append(timestamp)
             if len(self.flash_history) > 10:
                 self.flash_history.pop(0)
             self.flash_cooldown = 10 # dùng frame để tránh phát hiện liên tục
@@ -376,7 +383,7 @@ class LivenessDetector:
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         current_brightness = np.mean(gray)
         
-        is_flash = self.detect_flash(current_brightness)
+        is_flash = self.detect_flash(current_brightness, timestamp)
         if is_flash:
             print("[FLASH] Phát hiện thay đổi sáng đột ngột")
             
@@ -400,11 +407,14 @@ class LivenessDetector:
                 
         brightness = np.mean(gray)
         self.brightness_buffer.append(brightness)
+        self.brightness_times.append(timestamp)
         if len(self.brightness_buffer) > self.buffer_size:
             self.brightness_buffer.pop(0)
+            self.brightness_times.pop(0)
             
         if len(self.brightness_buffer) == self.buffer_size and not skip_soft_checks:
-            signal = np.array(self.brightness_buffer) - np.mean(self.brightness_buffer)
+            signal, self.frame_rate = self._resample(self.brightness_buffer, self.brightness_times)
+            signal = signal - np.mean(signal)
             fft = np.abs(np.fft.rfft(signal))
             
             if np.max(fft) > 35.0:
@@ -429,16 +439,19 @@ class LivenessDetector:
         if mesh_coords is not None:
             nose_y = mesh_coords[1].y * h
             self.nose_y_buffer.append(nose_y)
+            self.nose_y_times.append(timestamp)
             if len(self.nose_y_buffer) > self.buffer_size:
                 self.nose_y_buffer.pop(0)
+                self.nose_y_times.pop(0)
 
         self.prev_gray = gray.copy()
 
         if mesh_coords is not None and not skip_soft_checks:
             if len(self.nose_y_buffer) == self.buffer_size:
-                signal = np.array(self.nose_y_buffer) - np.mean(self.nose_y_buffer)
+                signal, nose_rate = self._resample(self.nose_y_buffer, self.nose_y_times)
+                signal = signal - np.mean(signal)
                 fft = np.abs(np.fft.rfft(signal))
-                freqs = np.fft.rfftfreq(self.buffer_size, 1 / self.frame_rate)
+                freqs = np.fft.rfftfreq(self.buffer_size, 1 / nose_rate)
                 peak_idx = np.argmax(fft[1:]) + 1
                 peak_freq = freqs[peak_idx]
                 peak_amplitude = fft[peak_idx]
@@ -456,7 +469,27 @@ class LivenessDetector:
         if not skip_soft_checks:
             self.check_temporal_entropy()
 
-    def check_liveness(self, frame, face_box, landmarks=None, head_pose=None, timestamp=time.time()):
+    def _resample(self, values, times):
+        """
+        Lấy mẫu lại chuỗi (values, times) lên lưới đều cùng số mẫu -> (signal, FPS thật).
+        Frame bị bỏ / giao không đều (latest-frame, scheduler nhiều luồng) không làm lệch tần số của FFT.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        duration = times[-1] - times[0]
+        if duration <= 0:
+            return values, self.frame_rate
+        rate = (len(times) - 1) / duration
+        grid = times[0] + np.arange(len(times)) / rate
+        return np.interp(grid, times, values), rate
+
+    def check_liveness(self, frame, face_box, landmarks=None, head_pose=None, timestamp=None):
+        """
+        timestamp: thời điểm capture của frame (giây, đơn điệu - FrameRef.timestamp).
+        None = time.monotonic() lúc gọi (không chính xác khi frame xếp hàng trước khi xử lý).
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
         instruction = "Vui lòng nhìn thẳng vào camera"
         is_really_real = False
         status = "PROCESSING"
@@ -598,7 +631,7 @@ class LivenessDetector:
         elif not self.strong_spoof_detected and status == "PROCESSING":
             if self.current_challenge_index < len(self.challenge_list):
                 current_challenge = self.challenge_list[self.current_challenge_index]
-                if self.challenge_time == 0:
+                if self.challenge_time is None:
                     self.challenge_time = timestamp
                     print(f"[CHALLENGE {self.current_challenge_index+1}/{len(self.challenge_list)}] Bắt đầu: {current_challenge}")
                 
@@ -608,7 +641,7 @@ class LivenessDetector:
                     self.strong_spoof_detected = True
                     self.strong_spoof_reason = "CHALLENGE_TIMEOUT"
                     self.current_challenge_index = 0
-                    self.challenge_time = 0
+                    self.challenge_time = None
                     self.blink_count = 0
                     instruction = "Phản ứng quá chậm"
                     print("[SPOOF STRONG] CHALLENGE_TIMEOUT - quá chậm")
@@ -658,7 +691,7 @@ class LivenessDetector:
                             print(f"[SUCCESS] Challenge '{current_challenge}' HOÀN THÀNH trong {time_diff:.1f}s")
                             self.completed_challenges.append(current_challenge)
                             self.current_challenge_index += 1
-                            self.challenge_time = 0
+                            self.challenge_time = None
                             self.blink_count = 0
                             self.challenge_stable_frames = 0  # Reset stability counter
                             self.moves_completed = []  # Reset tất cả moves, không phân biệt TURN hay BLINK
@@ -703,7 +736,7 @@ class LivenessDetector:
         self.ear_calibrated = False
         self.challenge_list = random.sample(["BLINK", "TURN_LEFT", "TURN_RIGHT", "BLINK_TWICE"], k=3)
         self.current_challenge_index = 0
-        self.challenge_time = 0
+        self.challenge_time = None
         self.challenge_window = 4.0
         self.completed_challenges = []
         self.required_blink_count = 1
@@ -715,6 +748,8 @@ class LivenessDetector:
         self.brightness_buffer = []
         self.nose_y_buffer = []
         self.ear_buffer = []
+        self.brightness_times = []
+        self.nose_y_times = []
         self.brightness_history = []
         self.lighting_quality = "UNKNOWN"
         self.strong_spoof_detected = False
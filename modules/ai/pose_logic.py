@@ -57,6 +57,24 @@ def calculate_pose_ratio(landmarks, width: int, height: int) -> tuple[float | No
         return None, None
 
 
+def classify_pose(h_ratio: float | None, v_ratio: float | None) -> str | None:
+    """
+    Xếp pose hiện tại vào nhóm pose lúc enrollment ("frontal", "left", "right", "up", "down")
+    theo cùng RATIO_THRESHOLDS. Quay ngang được ưu tiên hơn ngẩng/cúi.
+    """
+    if h_ratio is None or v_ratio is None:
+        return None
+    if h_ratio > RATIO_THRESHOLDS["left"]["h_min"]:
+        return "left"
+    if h_ratio < RATIO_THRESHOLDS["right"]["h_max"]:
+        return "right"
+    if v_ratio < RATIO_THRESHOLDS["up"]["v_max"]:
+        return "up"
+    if v_ratio > RATIO_THRESHOLDS["down"]["v_min"]:
+        return "down"
+    return "frontal"
+
+
 def check_pose_logic(
     frame: np.ndarray,
     face_mesh,
@@ -65,24 +83,26 @@ def check_pose_logic(
     last_pose_ok: bool,
     last_instruction: str,
     stable_frames: int,
-) -> tuple[bool, str, float | None, bool, str, int]:
+) -> tuple[bool, str, float | None, bool, str, int, tuple[float, float] | None]:
     """
     Kiểm tra pose theo geometric ratio + ổn định.
     Trả về:
-    (pose_ok, msg, debug_value, new_last_pose_ok, new_last_instruction, new_stable_frames)
+    (pose_ok, msg, debug_value, new_last_pose_ok, new_last_instruction, new_stable_frames, ratios)
+    với ratios = (h_ratio, v_ratio) hoặc None nếu không tính được
     """
     rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     results = face_mesh.process(rgb)
 
     if not results.multi_face_landmarks:
-        return False, "Không phát hiện được khuôn mặt (MP)", None, False, "", 0
+        return False, "Không phát hiện được khuôn mặt (MP)", None, False, "", 0, None
 
     landmarks = results.multi_face_landmarks[0].landmark
     h, w = frame.shape[:2]
 
     h_ratio, v_ratio = calculate_pose_ratio(landmarks, w, h)
     if h_ratio is None or v_ratio is None:
-        return False, "Lỗi tính toán tỉ lệ khuôn mặt", None, last_pose_ok, last_instruction, stable_frames
+        return False, "Lỗi tính toán tỉ lệ khuôn mặt", None, last_pose_ok, last_instruction, stable_frames, None
+    ratios = (h_ratio, v_ratio)
 
     hysteresis = 0.05 if last_pose_ok else 0.0
     pose_ok = False
@@ -143,12 +163,12 @@ def check_pose_logic(
     # --- Stability giống logic cũ ---
     if pose_ok:
         stable_frames += 1
-        return True, "Tuyệt vời! Giữ nguyên.", debug_value, True, last_instruction, stable_frames
+        return True, "Tuyệt vời! Giữ nguyên.", debug_value, True, last_instruction, stable_frames, ratios
 
     if last_pose_ok:
         stable_frames += 1
         if stable_frames < 6:
-            return True, "Giữ nguyên.", debug_value, True, last_instruction, stable_frames
+            return True, "Giữ nguyên.", debug_value, True, last_instruction, stable_frames, ratios
         last_pose_ok = False
         stable_frames = 0
 
@@ -158,9 +178,9 @@ def check_pose_logic(
     if last_instruction and msg != last_instruction:
         stable_frames += 1
         if stable_frames < 8:
-            return False, last_instruction, debug_value, last_pose_ok, last_instruction, stable_frames
+            return False, last_instruction, debug_value, last_pose_ok, last_instruction, stable_frames, ratios
         stable_frames = 0
 
     last_instruction = msg
-    return False, msg, debug_value, last_pose_ok, last_instruction, stable_frames
+    return False, msg, debug_value, last_pose_ok, last_instruction, stable_frames, ratios
 
@@ -1,87 +1,919 @@
 """
 Module Authenticator - So khớp embedding để xác thực người dùng.
 Sử dụng Cosine Distance để tìm người dùng khớp nhất trong database.
+
+Gallery được giữ dưới dạng 1 ma trận float32 liền khối (N, D) đã chuẩn hóa L2 bên trong
+1 vector index (modules/vector_index.py), kèm mảng mã user song song theo từng hàng.
+Với kiểu lưu float16/int8, mọi lượt quét (LRU, nhóm pose, centroid, toàn gallery) chạy trên bản lượng tử,
+chỉ ứng viên tốt nhất được chấm lại bằng float32 (memmap store, hoặc BLOB SQLite khi không có store).
+Index mặc định là brute force (chính xác); gallery lớn có thể dùng IVF hoặc HNSW.
+Mỗi user có nhiều hàng (5 pose), điểm theo user được gộp bằng group-reduce vectorized.
+Sau lần load đầu, gallery chỉ cập nhật delta theo watermark (id embedding + seq nhật ký thay đổi).
+Khi khởi động, ma trận được memory-map từ sidecar store (modules/embedding_store.py) thay vì
+giải mã từng BLOB trong SQLite; hệ điều hành chỉ nạp trang khi truy vấn chạm tới.
 """
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
 import numpy as np
 from modules.database import DatabaseManager
+from modules.embedding_store import normalize_rows, pose_code
+from modules.vector_index import create_index
+
+# Kích thước embedding của InsightFace (buffalo_l / buffalo_s)
+EMBEDDING_DIM = 512
+# Số phần tử tối đa của ma trận similarity tạm trong authenticate_batch (~64 MB float32)
+BATCH_SIMILARITY_BUDGET = 16 * 2**20
+# Số hàng gallery đọc mỗi lần khi tính lại centroid (giới hạn bộ nhớ tạm khi phải giải lượng tử)
+CENTROID_CHUNK = 4096
 
 
 class Authenticator:
     """Xác thực người dùng bằng face recognition."""
-    
-    def __init__(self, threshold: float = 0.4, db_manager: DatabaseManager = None):
+
+    def __init__(self, threshold: float = 0.4, db_manager: DatabaseManager = None,
+                 min_margin: float = 0.05, index_type: str = "flat",
+                 index_params: dict | None = None, index_path: Path | None = None,
+                 use_store: bool = True, storage: str | None = None,
+                 coarse_users: int | None = None, pose_fallback_margin: float | None = None,
+                 recent_users: int = 256, recent_margin: float = 0.15):
         """
         Args:
             threshold: Ngưỡng Cosine distance (< threshold = match)
             db_manager: Database manager instance
+            min_margin: Khoảng cách tối thiểu giữa top1 và top2 (theo user) để chấp nhận
+            index_type: Loại vector index: "flat" (chính xác), "ivf", "hnsw"
+            index_params: Tham số riêng của index (vd. {"nlist": 1024, "nprobe": 16})
+            index_path: File lưu cấu trúc index (mặc định data/faces.index.npz cạnh faces.db)
+            use_store: Load gallery từ sidecar store memory-map (False = đọc thẳng SQLite)
+            storage: Kiểu lưu của index flat ("float32", "float16", "int8"; mặc định theo db_manager).
+                float16/int8 quét bản lượng tử rồi chấm lại top ứng viên bằng float32
+            coarse_users: Bật tìm 2 giai đoạn: xếp hạng user theo centroid rồi chỉ chấm lại
+                toàn bộ pose của `coarse_users` user đầu (None = quét mọi hàng)
+            pose_fallback_margin: Khi biết pose hiện tại, chỉ quét nhóm pose đó; nếu margin top1-top2
+                trong nhóm nhỏ hơn ngưỡng này thì quét thêm các nhóm còn lại (mặc định 2 x min_margin)
+            recent_users: Số user xác thực gần đây được so khớp trước (LRU, 0 = tắt)
+            recent_margin: Trả kết quả sớm từ LRU khi distance < threshold - recent_margin và margin
+                so với cận trên điểm (theo centroid) của mọi user ngoài LRU vẫn >= min_margin
         """
         self.threshold = threshold
+        self.min_margin = min_margin
         self.db = db_manager or DatabaseManager()
-        self._embeddings_cache = []
+        index_params = dict(index_params or {})
+        if index_type == "flat":
+            index_params.setdefault("storage", storage or self.db.embedding_storage)
+        self.index = create_index(index_type, EMBEDDING_DIM, **index_params)
+        self.index_path = Path(index_path) if index_path else self.db.db_path.with_suffix(".index.npz")
+        self.use_store = use_store
+        self._store_backed = False
+        self._store_generation = None
+        self.coarse_users = coarse_users
+        self.pose_fallback_margin = 2 * min_margin if pose_fallback_margin is None else pose_fallback_margin
+        # Centroid (trung bình pose đã chuẩn hóa) của từng user, label = mã user; cùng kiểu lưu với gallery
+        centroid_storage = getattr(self.index, "storage", "float32")
+        self._centroids = create_index("flat", EMBEDDING_DIM, storage=centroid_storage,
+                                       keep_vectors=centroid_storage == "float32")
+        # Bán kính từng user: min cosine giữa centroid và các pose (cận trên điểm user cho fast path LRU)
+        self._centroid_radius = np.empty(0, dtype=np.float32)
+        self._centroids_dirty = True
+        # Số phép so sánh cộng dồn theo giai đoạn (giám sát chi phí tìm kiếm)
+        self.search_stats = {"queries": 0, "coarse_comparisons": 0, "fine_comparisons": 0}
+        # LRU user_id xác thực thành công gần đây (cuối = mới nhất) + thống kê fast path
+        self.recent_users = recent_users
+        self.recent_margin = recent_margin
+        self._recent: OrderedDict[str, None] = OrderedDict()
+        self.recency_stats = {"lookups": 0, "hits": 0, "early_exits": 0}
+        # Mã user (int32) tương ứng từng hàng trong index.vectors
+        self._row_user_codes = np.empty(0, dtype=np.int32)
+        # Bảng mã -> user_id và số hàng (pose) của từng user
+        self._user_ids = np.empty(0, dtype=object)
+        self._user_row_counts = np.empty(0, dtype=np.int64)
+        self._user_index: dict[str, int] = {}
+        # Mã pose (int8, theo POSE_BUCKETS) từng hàng và vị trí hàng theo nhóm pose (tính lười)
+        self._row_pose_codes = np.empty(0, dtype=np.int8)
+        self._pose_rows = None
+        # Thứ tự hàng gom theo user (group-reduce theo batch, tìm 2 giai đoạn), tính lại khi gallery đổi
+        self._user_order = None
+        self._user_starts = None
+        # Watermark: id embedding lớn nhất đã load + seq nhật ký xóa/sửa đã áp dụng
+        self._last_row_id = 0
+        self._change_seq = 0
+        # sync() có thể chạy song song với authenticate() từ thread khác
+        self._lock = threading.RLock()
         self._load_embeddings()
-    
+        self._load_recent_users()
+
     def _load_embeddings(self):
-        """Load tất cả embeddings từ database."""
-        self._embeddings_cache = self.db.get_all_embeddings()
-        print(f"Loaded {len(self._embeddings_cache)} embeddings from database")
-    
+        """Load tất cả embeddings (ưu tiên memory-map store, dự phòng SQLite) và dựng gallery + index."""
+        store = self.db.open_embedding_store() if self.use_store else None
+        self._store_backed = store is not None
+        if store is not None:
+            # Vector + id dùng thẳng memmap (không copy), chỉ mã user được copy để nối thêm
+            self._change_seq = store["change_seq"]
+            self._store_generation = store["generation"]
+            row_ids, matrix = store["ids"], store["vectors"]
+            user_ids = np.empty(len(store["user_ids"]), dtype=object)
+            user_ids[:] = store["user_ids"]
+            codes = np.array(store["codes"], dtype=np.int32)
+            poses = np.array(store["poses"], dtype=np.int8)
+            quantized = (store["quantized"], store["scales"])
+        else:
+            row_ids, matrix, user_ids, codes, poses = self._read_gallery_from_db()
+            quantized = None
+
+        if hasattr(self.index, "keep_vectors"):
+            # Bản float32 chỉ giữ khi là memmap (không tốn RAM) hoặc chính là kiểu lưu;
+            # còn lại chỉ giữ bản lượng tử, ứng viên được chấm lại từ BLOB SQLite
+            self.index.keep_vectors = self._store_backed or self.index.storage == "float32"
+            self.index.rerank_source = None if self.index.keep_vectors else self._fetch_rows
+        self._build_index(matrix, row_ids, quantized)
+        # Index giữ thứ tự id tăng dần giống database -> mã user dùng chung vị trí hàng
+        self._user_ids = user_ids
+        self._row_user_codes = codes.astype(np.int32)
+        self._row_pose_codes = poses
+        self._user_row_counts = np.bincount(self._row_user_codes, minlength=len(self._user_ids))
+        self._user_index = {uid: code for code, uid in enumerate(self._user_ids)}
+        self._user_order = None
+        self._pose_rows = None
+        self._centroids_dirty = True
+        self._last_row_id = int(row_ids[-1]) if len(row_ids) else 0
+        source = "store" if self._store_backed else "database"
+        print(f"Loaded {len(self._row_user_codes)} embeddings from {source} ({self.index.kind} index)")
+
+    def _fetch_rows(self, row_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """rerank_source của index lượng tử: vector float32 gốc theo id embedding. Trả về (vectors, found)."""
+        vectors = np.zeros((len(row_ids), EMBEDDING_DIM), dtype=np.float32)
+        found = np.zeros(len(row_ids), dtype=bool)
+        try:
+            rows = self.db.get_embedding_rows_by_ids(row_ids.tolist())
+        except sqlite3.Error as e:
+            print(f"[Authenticator] Không đọc được embedding để chấm lại: {e}")
+            return vectors, found
+        if rows:
+            fetched = np.array([row[0] for row in rows], dtype=np.int64)
+            sorter = np.argsort(row_ids)
+            targets = sorter[np.searchsorted(row_ids, fetched, sorter=sorter)]
+            vectors[targets] = normalize_rows(np.stack([row[2] for row in rows]))
+            found[targets] = True
+        return vectors, found
+
+    def _read_gallery_from_db(self) -> tuple[np.ndarray, ...]:
+        """Đọc và giải mã toàn bộ BLOB trong SQLite. Trả về (row_ids, matrix, user_ids, codes, poses)."""
+        # Đọc seq trước khi đọc hàng: thay đổi xen giữa sẽ được sync() áp dụng lại (idempotent)
+        self._change_seq = self.db.get_embedding_change_seq()
+        rows = self.db.get_embedding_rows()
+        if rows:
+            row_ids = np.array([row[0] for row in rows], dtype=np.int64)
+            matrix = normalize_rows(np.stack([row[2] for row in rows]))
+            user_ids, codes = np.unique(
+                np.array([row[1] for row in rows], dtype=object), return_inverse=True
+            )
+        else:
+            row_ids = np.empty(0, dtype=np.int64)
+            matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+            user_ids, codes = np.empty(0, dtype=object), np.empty(0, dtype=np.int32)
+        poses = np.array([pose_code(row[3]) for row in rows], dtype=np.int8)
+        return row_ids, matrix, user_ids, codes, poses
+
+    def _load_recent_users(self):
+        """Khởi tạo LRU từ các event 'auth' thành công gần nhất."""
+        if not self.recent_users:
+            return
+        try:
+            user_ids = self.db.get_recent_auth_users(self.recent_users)
+        except Exception as e:
+            print(f"[Authenticator] Không đọc được lịch sử xác thực: {e}")
+            return
+        # Cũ nhất trước để người mới nhất nằm cuối LRU
+        for user_id in reversed(user_ids):
+            self._recent[user_id] = None
+
+    def remember_user(self, user_id: str):
+        """Đưa user vừa xác thực thành công lên đầu LRU."""
+        if not self.recent_users or user_id is None:
+            return
+        with self._lock:
+            self._recent[user_id] = None
+            self._recent.move_to_end(user_id)
+            while len(self._recent) > self.recent_users:
+                self._recent.popitem(last=False)
+
+    def get_recency_stats(self) -> dict:
+        """Tỉ lệ hit (user khớp nằm trong LRU) và early-exit (không cần quét toàn gallery)."""
+        with self._lock:
+            stats = dict(self.recency_stats)
+        lookups = max(stats["lookups"], 1)
+        stats["hit_rate"] = stats["hits"] / lookups
+        stats["early_exit_rate"] = stats["early_exits"] / lookups
+        return stats
+
+    def _build_index(self, matrix: np.ndarray, row_ids: np.ndarray, quantized: tuple | None = None):
+        """
+        Dựng index; index xấp xỉ được khôi phục từ file và cập nhật tăng dần nếu có thể.
+        `quantized` = (codes, scales) từ store, dùng lại cho index flat cùng kiểu lưu.
+        """
+        if not self.index.persistent:
+            if (quantized is not None and quantized[0] is not None
+                    and getattr(self.index, "storage", None) == self.db.embedding_storage):
+                self.index.build(matrix, row_ids, codes=quantized[0], scales=quantized[1])
+            else:
+                self.index.build(matrix, row_ids)
+            return
+        if not self.index.restore(self.index_path, matrix, row_ids):
+            print(f"[Authenticator] Rebuilding {self.index.kind} index ({len(row_ids)} rows)")
+            self.index.build(matrix, row_ids)
+        self.save_index()
+
+    def save_index(self):
+        """Lưu cấu trúc index xấp xỉ cạnh database (index flat không cần lưu)."""
+        if not self.index.persistent:
+            return
+        try:
+            self.index.save(self.index_path)
+        except OSError as e:
+            print(f"[Authenticator] Không lưu được index: {e}")
+
+    def retrain_index(self) -> bool:
+        """
+        Train lại index xấp xỉ khi đã đến hạn (IVF: gallery lớn gấp retrain_ratio lần lúc train).
+        k-means chạy ngoài khóa trên bản chụp, authenticate() / sync() vẫn dùng tâm cụm cũ;
+        chỉ bước đổi tâm cụm giữ khóa. Gọi từ luồng bảo trì, không từ đường xác thực.
+        """
+        if not getattr(self.index, "retrain_due", False):
+            return False
+        with self._lock:
+            snapshot = self.index.retrain_snapshot()
+        trained = self.index.train_centroids(snapshot)
+        with self._lock:
+            if not self.index.swap_centroids(trained):
+                return False
+            print(f"[Authenticator] Retrained {self.index.kind} index ({len(self.index)} rows)")
+            self.save_index()
+        return True
+
     def reload_embeddings(self):
-        """Reload embeddings (gọi sau khi có enrollment mới)."""
-        self._load_embeddings()
-    
+        """Cập nhật embeddings sau khi có enrollment mới (chỉ áp dụng delta, xem sync())."""
+        self.sync()
+
+    def sync(self) -> int:
+        """
+        Áp dụng thay đổi từ database vào gallery mà không load lại toàn bộ:
+        - Hàng mới: 1 truy vấn `WHERE id > watermark` trên PRIMARY KEY
+        - Hàng bị xóa (kể cả ON DELETE CASCADE khi xóa user) / bị sửa: đọc từ embedding_changes
+
+        Delta được đọc ngoài khóa nên authenticate() ở thread khác không phải chờ I/O database.
+
+        Returns:
+            Số hàng gallery đã thay đổi
+        """
+        with self._lock:
+            watermark = (self._change_seq, self._last_row_id)
+        changes = self.db.get_embedding_changes(watermark[0])
+        new_rows = self.db.get_embedding_rows(after_id=watermark[1])
+        with self._lock:
+            if (self._change_seq, self._last_row_id) != watermark:
+                # sync() ở thread khác vừa áp dụng delta: lần sau đọc lại từ watermark mới
+                return 0
+            if changes is None:
+                # Nhật ký đã bị prune qua watermark (vd. process khác): không còn delta, load lại toàn bộ
+                print("[Authenticator] Change log pruned past watermark, reloading gallery")
+                self._load_embeddings()
+                return len(self.index)
+            n_changed = 0
+            if changes:
+                self._change_seq = changes[-1][0]
+                deleted = {embedding_id for _, embedding_id, op in changes if op == "delete"}
+                # Hàng mới (id > watermark) đã có vector mới nhất trong new_rows
+                updated = {
+                    embedding_id for _, embedding_id, op in changes
+                    if op == "update" and embedding_id <= self._last_row_id
+                } - deleted
+                if deleted:
+                    n_changed += self._remove_rows(sorted(deleted))
+                if updated:
+                    n_changed += self._update_rows(self.db.get_embedding_rows_by_ids(sorted(updated)))
+            if new_rows:
+                n_changed += self._append_rows(new_rows)
+            if n_changed:
+                print(f"[Authenticator] Synced {n_changed} gallery rows ({len(self.index)} total)")
+            self._switch_store_generation()
+            return n_changed
+
+    def _append_rows(self, rows: list[tuple[int, str, np.ndarray, str]]) -> int:
+        row_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = normalize_rows(np.stack([row[2] for row in rows]))
+
+        n_users_before = len(self._user_ids)
+        codes = np.array(
+            [self._user_index.setdefault(row[1], len(self._user_index)) for row in rows],
+            dtype=np.int32,
+        )
+        if len(self._user_index) > n_users_before:
+            new_users = np.empty(len(self._user_index) - n_users_before, dtype=object)
+            new_users[:] = list(self._user_index)[n_users_before:]
+            self._user_ids = np.concatenate((self._user_ids, new_users))
+            self._user_row_counts = np.concatenate(
+                (self._user_row_counts, np.zeros(len(new_users), dtype=np.int64))
+            )
+
+        if not self._attach_store(row_ids):
+            self.index.add(matrix, row_ids)
+        self._row_user_codes = np.concatenate((self._row_user_codes, codes))
+        self._row_pose_codes = np.concatenate(
+            (self._row_pose_codes, np.array([pose_code(row[3]) for row in rows], dtype=np.int8))
+        )
+        np.add.at(self._user_row_counts, codes, 1)
+        self._user_order = None
+        self._pose_rows = None
+        self._refresh_centroids(np.unique(codes))
+        self._last_row_id = max(self._last_row_id, int(row_ids[-1]))
+        return len(rows)
+
+    def _attach_store(self, row_ids: np.ndarray) -> bool:
+        """
+        Nếu store đã được DatabaseManager nối đúng các hàng mới, trỏ index sang memmap mới
+        thay vì copy vector (chỉ khi gallery chưa bị xóa/sửa kể từ lúc load).
+        """
+        if not self._store_backed:
+            return False
+        store = self.db.embedding_store.open(load_users=False)
+        if (store is None or store["change_seq"] != self._change_seq
+                or store["count"] != len(self.index) + len(row_ids)
+                or store["ids"][-1] != row_ids[-1]):
+            return False
+        return self._attach_index(store)
+
+    def _attach_index(self, store: dict) -> bool:
+        if getattr(self.index, "storage", None) == self.db.embedding_storage:
+            attached = self.index.attach(store["vectors"], store["ids"], store["quantized"], store["scales"])
+        else:
+            attached = self.index.attach(store["vectors"], store["ids"])
+        if attached:
+            self._store_generation = store["generation"]
+        return attached
+
+    def _switch_store_generation(self):
+        """
+        Store vừa được dựng lại sang thế hệ mới (process khác hoặc lần mở sau): nếu thế hệ mới
+        chứa đúng các hàng gallery đang có, trỏ index sang memmap mới để nhả file thế hệ cũ.
+        """
+        if not self._store_backed:
+            return
+        store = self.db.embedding_store
+        header = store.read_header()
+        if (header is None or header["generation"] == self._store_generation
+                or header["change_seq"] != self._change_seq or header["count"] != len(self.index)):
+            return
+        opened = store.open(load_users=False)
+        if opened is None or not np.array_equal(opened["ids"], self.index.labels):
+            return
+        if self._attach_index(opened):
+            print(f"[Authenticator] Switched to embedding store generation {self._store_generation}")
+            store.remove_stale_generations()
+
+    def _remove_rows(self, embedding_ids: list[int]) -> int:
+        keep = self.index.remove(np.array(embedding_ids, dtype=np.int64))
+        n_removed = int((~keep).sum())
+        if n_removed == 0:
+            return 0
+        self._row_user_codes = self._row_user_codes[keep]
+        self._row_pose_codes = self._row_pose_codes[keep]
+        self._pose_rows = None
+        counts = np.bincount(self._row_user_codes, minlength=len(self._user_ids))
+        live = counts > 0
+        if not live.all():
+            # Bỏ user không còn hàng nào (đã bị xóa) và đánh lại mã liên tục
+            remap = (np.cumsum(live) - 1).astype(np.int32)
+            self._row_user_codes = remap[self._row_user_codes]
+            self._user_ids = self._user_ids[live]
+            counts = counts[live]
+            self._user_index = {uid: code for code, uid in enumerate(self._user_ids)}
+        self._user_row_counts = counts
+        self._user_order = None
+        # Mã user có thể đã bị đánh lại -> tính lại toàn bộ centroid khi cần
+        self._centroids_dirty = True
+        return n_removed
+
+    def _update_rows(self, rows: list[tuple[int, str, np.ndarray, str]]) -> int:
+        if not rows:
+            return 0
+        row_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = normalize_rows(np.stack([row[2] for row in rows]))
+        n_updated = self.index.update(matrix, row_ids)
+        positions, found = self.index.positions_of(row_ids)
+        poses = np.array([pose_code(row[3]) for row in rows], dtype=np.int8)
+        self._row_pose_codes[positions[found]] = poses[found]
+        self._pose_rows = None
+        self._refresh_centroids(np.unique(self._row_user_codes[positions[found]]))
+        return n_updated
+
+    def _user_groups(self) -> tuple[np.ndarray | None, np.ndarray]:
+        """
+        Trả về (order, starts): hàng của user c là order[starts[c] : starts[c] + count[c]].
+        order = None khi các hàng đã gom liền theo user (enrollment ghi các pose liền nhau).
+        """
+        if self._user_order is None:
+            codes = self._row_user_codes
+            self._user_order = (slice(None) if np.all(codes[1:] >= codes[:-1])
+                                else np.argsort(codes, kind="stable"))
+            self._user_starts = np.concatenate(([0], np.cumsum(self._user_row_counts)[:-1])).astype(np.int64)
+        order = None if isinstance(self._user_order, slice) else self._user_order
+        return order, self._user_starts
+
+    def _ensure_centroids(self):
+        """Tính lại toàn bộ centroid nếu gallery đã bị xóa hàng / load lại."""
+        if not self._centroids_dirty:
+            return
+        n_users = len(self._user_ids)
+        sums = np.zeros((n_users, EMBEDDING_DIM), dtype=np.float32)
+        radius = np.ones(n_users, dtype=np.float32)
+        if n_users:
+            order, _ = self._user_groups()
+            rows = np.arange(len(self.index)) if order is None else order
+            codes = self._row_user_codes[rows]
+            # Theo chunk: không cần cả gallery float32 cùng lúc (index lượng tử phải giải lượng tử)
+            for start in range(0, len(rows), CENTROID_CHUNK):
+                chunk_codes = codes[start:start + CENTROID_CHUNK]
+                segments = np.flatnonzero(np.r_[True, chunk_codes[1:] != chunk_codes[:-1]])
+                vectors = self.index.row_vectors(rows[start:start + CENTROID_CHUNK])
+                sums[chunk_codes[segments]] += np.add.reduceat(vectors, segments, axis=0)
+            centroids = normalize_rows(sums)
+            # Lượt 2: cosine từng pose với centroid của user -> min theo user
+            for start in range(0, len(rows), CENTROID_CHUNK):
+                chunk_codes = codes[start:start + CENTROID_CHUNK]
+                segments = np.flatnonzero(np.r_[True, chunk_codes[1:] != chunk_codes[:-1]])
+                vectors = self.index.row_vectors(rows[start:start + CENTROID_CHUNK])
+                cosines = np.einsum("ij,ij->i", vectors, centroids[chunk_codes])
+                users = chunk_codes[segments]
+                radius[users] = np.minimum(radius[users], np.minimum.reduceat(cosines, segments))
+        else:
+            centroids = sums
+        self._centroids.build(centroids, np.arange(n_users, dtype=np.int64))
+        self._centroid_radius = radius
+        self._centroids_dirty = False
+
+    def _refresh_centroids(self, user_codes: np.ndarray):
+        """Cập nhật centroid của các user có pose vừa thêm/sửa (user mới được nối vào cuối)."""
+        if self._centroids_dirty or len(user_codes) == 0:
+            return
+        rows = np.flatnonzero(np.isin(self._row_user_codes, user_codes))
+        groups = np.searchsorted(user_codes, self._row_user_codes[rows])
+        vectors = self.index.row_vectors(rows)
+        sums = np.zeros((len(user_codes), EMBEDDING_DIM), dtype=np.float32)
+        np.add.at(sums, groups, vectors)
+        centroids = normalize_rows(sums)
+        radius = np.ones(len(user_codes), dtype=np.float32)
+        np.minimum.at(radius, groups, np.einsum("ij,ij->i", vectors, centroids[groups]))
+        existing = user_codes < len(self._centroids)
+        self._centroids.update(centroids[existing], user_codes[existing])
+        self._centroids.add(centroids[~existing], user_codes[~existing])
+        n_users = len(self._user_ids)
+        if len(self._centroid_radius) < n_users:
+            self._centroid_radius = np.concatenate(
+                (self._centroid_radius, np.ones(n_users - len(self._centroid_radius), dtype=np.float32))
+            )
+        self._centroid_radius[user_codes] = radius
+
+    def _coarse_rows(self, query: np.ndarray, min_users: int = 1) -> np.ndarray:
+        """
+        Giai đoạn 1: xếp hạng user theo centroid, trả về vị trí mọi hàng (pose) của
+        top `coarse_users` user (ít nhất `min_users` để đủ top-k / margin).
+        """
+        self._ensure_centroids()
+        n_users = len(self._user_ids)
+        candidates, _ = self._centroids.search(query, min(max(self.coarse_users, min_users), n_users))
+        return self._rows_of_users(candidates)
+
+    def _rows_of_users(self, user_codes: np.ndarray) -> np.ndarray:
+        """Vị trí mọi hàng (pose) của các user `user_codes`."""
+        order, starts = self._user_groups()
+        counts = self._user_row_counts[user_codes]
+        # Nối các đoạn [start, start + count) của từng user (vectorized)
+        offsets = np.repeat(starts[user_codes] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return offsets if order is None else order[offsets]
+
+    def _recent_match(self, query: np.ndarray, reduce: str, k: int = 2) -> tuple[tuple | None, int, int]:
+        """
+        Fast path: so khớp các user trong LRU, rồi chặn trên điểm mọi user còn lại bằng centroid.
+
+        Returns:
+            (match, n_rows, n_centroids): match = (user_codes, top, distances, margin) nếu top1 đủ xa dưới
+            ngưỡng (distance < threshold - recent_margin) và margin so với cận dưới distance của mọi user khác
+            (trong và ngoài LRU) >= min_margin, ngược lại None; n_rows / n_centroids = số hàng / centroid
+            đã so khớp. Margin trả về là cận dưới đó (không phải margin thật của toàn gallery).
+        """
+        if not self._recent:
+            return None, 0, 0
+        self.recency_stats["lookups"] += 1
+        codes = [self._user_index[uid] for uid in self._recent if uid in self._user_index]
+        if not codes:
+            return None, 0, 0
+        positions = self._rows_of_users(np.array(codes, dtype=np.int64))
+        similarities = self.index.score_rows(query, positions)
+        user_codes, user_scores = self._reduce_by_user(similarities, reduce, positions)
+        top, distances, margin = self._rank_users(user_scores, k)
+        if distances[0] >= self.threshold - self.recent_margin or margin < self.min_margin:
+            return None, len(positions), 0
+        # Margin trong LRU chưa đủ: user ngoài LRU có thể gần hơn top2 -> so với cận trên toàn cục
+        bound = self._outside_bound(query, user_codes)
+        margin = min(margin, float(1.0 - bound - distances[0]))
+        n_centroids = len(self._user_ids)
+        if margin < self.min_margin:
+            return None, len(positions), n_centroids
+        self.recency_stats["hits"] += 1
+        self.recency_stats["early_exits"] += 1
+        return (user_codes, top, distances, margin), len(positions), n_centroids
+
+    def _outside_bound(self, query: np.ndarray, user_codes: np.ndarray) -> float:
+        """
+        Cận trên similarity (max theo pose) của query với mọi user ngoài `user_codes`, từ centroid c và
+        bán kính r (min cos(c, pose)): góc(q, pose) >= góc(q, c) - góc(c, pose) nên
+        sim <= cos(max(0, góc(q, c) - arccos(r))). Cộng thêm sai số lượng tử của centroid và gallery.
+        Trả về -1 nếu không còn user nào ngoài `user_codes`.
+        """
+        self._ensure_centroids()
+        outside = np.ones(len(self._user_ids), dtype=bool)
+        outside[user_codes] = False
+        if not outside.any():
+            return -1.0
+        gallery_error = self.index.score_error()
+        centroid_scores = self._centroids.score_rows(query)[outside] + self._centroids.score_error()
+        query_angles = np.arccos(np.clip(centroid_scores, -1.0, 1.0))
+        radius_angles = np.arccos(np.clip(self._centroid_radius[outside] - gallery_error, -1.0, 1.0))
+        closest = float(np.maximum(query_angles - radius_angles, 0.0).min())
+        return min(1.0, float(np.cos(closest)) + gallery_error)
+
+    def _count_recent_hit(self, user_id: str | None):
+        """Full scan khớp 1 user đã có trong LRU -> vẫn tính là hit (nhưng không early-exit)."""
+        if user_id is not None and user_id in self._recent:
+            self.recency_stats["hits"] += 1
+
+    def _pose_bucket(self, pose: str | None) -> np.ndarray | None:
+        """Vị trí các hàng enrollment thuộc nhóm pose `pose` (None nếu pose không rõ)."""
+        code = pose_code(pose)
+        if code < 0:
+            return None
+        if self._pose_rows is None:
+            order = np.argsort(self._row_pose_codes, kind="stable")
+            bounds = np.searchsorted(self._row_pose_codes[order], np.arange(-1, 6))
+            self._pose_rows = {c: order[bounds[c + 1]:bounds[c + 2]] for c in range(5)}
+        return self._pose_rows.get(code)
+
+    def _rank_users(self, user_scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray, float]:
+        """Top-k (ít nhất 2 để tính margin) bằng argpartition. Trả về (top, distances, margin)."""
+        n_top = min(max(k, 2), len(user_scores))
+        top = np.argpartition(-user_scores, n_top - 1)[:n_top]
+        top = top[np.argsort(-user_scores[top])]
+        distances = (1.0 - user_scores[top]).astype(np.float32)
+        # Chỉ có 1 user -> không có đối thủ, margin tối đa
+        margin = float(distances[1] - distances[0]) if n_top > 1 else 1.0
+        return top, distances, margin
+
+    def _record_comparisons(self, coarse: int, fine: int) -> dict:
+        self.search_stats["queries"] += 1
+        self.search_stats["coarse_comparisons"] += coarse
+        self.search_stats["fine_comparisons"] += fine
+        return {"coarse": coarse, "fine": fine}
+
+    def _normalize_query(self, query_embedding: np.ndarray) -> np.ndarray:
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        return query / (np.linalg.norm(query) + 1e-8)
+
+    def _reduce_by_user(self, similarities: np.ndarray, reduce: str,
+                        positions: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Gộp similarity theo hàng thành similarity theo user (group-reduce, không dùng dict).
+
+        Args:
+            similarities: Similarity của các hàng (toàn gallery hoặc chỉ các hàng ứng viên)
+            reduce: "max" (pose gần nhất) hoặc "mean" (trung bình các pose)
+            positions: Vị trí các hàng ứng viên; None = toàn bộ gallery
+
+        Returns:
+            (user_codes, scores): mã user và similarity đã gộp
+        """
+        if positions is None:
+            user_codes = np.arange(len(self._user_ids))
+            inverse = self._row_user_codes
+            counts = self._user_row_counts
+        else:
+            # Index xấp xỉ: chỉ gộp trên các pose đã được truy xuất
+            user_codes, inverse = np.unique(self._row_user_codes[positions], return_inverse=True)
+            counts = np.bincount(inverse, minlength=len(user_codes))
+
+        if reduce == "mean":
+            sums = np.bincount(inverse, weights=similarities, minlength=len(user_codes))
+            return user_codes, sums / np.maximum(counts, 1)
+        if reduce == "max":
+            scores = np.full(len(user_codes), -np.inf, dtype=np.float32)
+            np.maximum.at(scores, inverse, similarities)
+            return user_codes, scores
+        raise ValueError(f"reduce không hợp lệ: {reduce}")
+
     def authenticate(self, query_embedding: np.ndarray) -> tuple[bool, str | None, float]:
         """
         Xác thực embedding với database.
-        
+
         Args:
             query_embedding: Embedding của khuôn mặt cần xác thực
-            
+
         Returns:
-            (success, user_id, distance): 
+            (success, user_id, distance):
                 - success: True nếu tìm thấy match
                 - user_id: ID người dùng được nhận diện (None nếu không match)
                 - distance: Khoảng cách nhỏ nhất tìm được
         """
-        if len(self._embeddings_cache) == 0:
-            return False, None, 1.0
-        
-        min_distance = float('inf')
-        matched_user_id = None
-        
-        # So sánh với tất cả embeddings trong database
-        for user_id, db_embedding in self._embeddings_cache:
-            distance = self._cosine_distance(query_embedding, db_embedding)
-            if distance < min_distance:
-                min_distance = distance
-                matched_user_id = user_id
-        
-        # Kiểm tra ngưỡng
-        success = min_distance < self.threshold
-        
+        with self._lock:
+            if len(self.index) == 0:
+                return False, None, 1.0
+
+            query = self._normalize_query(query_embedding)
+            recent, recent_rows, recent_centroids = self._recent_match(query, "max", k=1)
+            if recent is not None:
+                self._record_comparisons(recent_centroids, recent_rows)
+                user_codes, top, distances, _ = recent
+                matched_user_id = self._user_ids[user_codes[top[0]]]
+                self.remember_user(matched_user_id)
+                return True, matched_user_id, float(distances[0])
+
+            if self.coarse_users:
+                # 2 giai đoạn: centroid -> toàn bộ pose của top `coarse_users` user
+                positions = self._coarse_rows(query)
+                similarities = self.index.score_rows(query, positions)
+                self._record_comparisons(recent_centroids + len(self._user_ids), recent_rows + len(positions))
+                best = int(np.argmax(similarities))
+                positions, similarities = positions[best:best + 1], similarities[best:best + 1]
+            else:
+                # Brute force: 1 phép GEMV trên toàn gallery; index xấp xỉ: chỉ quét ứng viên
+                positions, similarities = self.index.search(query, 1)
+                self._record_comparisons(recent_centroids,
+                                         recent_rows + (len(self.index) if self.index.exact else len(positions)))
+                if len(positions) == 0:
+                    # Index xấp xỉ không trả ứng viên nào (vd. cụm IVF được quét đều rỗng)
+                    return False, None, 1.0
+
+            min_distance = float(1.0 - similarities[0])
+            matched_user_id = self._user_ids[self._row_user_codes[positions[0]]]
+
+            # Kiểm tra ngưỡng
+            success = min_distance < self.threshold
+            if success:
+                self._count_recent_hit(matched_user_id)
+                self.remember_user(matched_user_id)
+
         return success, matched_user_id if success else None, min_distance
-    
+
+    def authenticate_topk(self, query_embedding: np.ndarray, k: int = 3, reduce: str = "max",
+                          pose: str | None = None) -> dict:
+        """
+        Xác thực và trả về top-k user (đã gộp điểm các pose của cùng 1 user).
+
+        Args:
+            query_embedding: Embedding của khuôn mặt cần xác thực
+            k: Số user ứng viên trả về
+            reduce: Cách gộp điểm các pose của 1 user ("max" hoặc "mean")
+            pose: Pose hiện tại ("frontal", "left", ... xem classify_pose); nếu có, quét nhóm pose
+                gần nhất trước và chỉ quét các nhóm còn lại khi margin < pose_fallback_margin
+
+        Returns:
+            dict:
+            {
+                "success": bool,         # distance < threshold và margin >= min_margin
+                "user_id": str | None,   # top1 nếu success
+                "distance": float,       # distance của top1
+                "margin": float,         # distance(top2) - distance(top1)
+                "user_ids": list[str],   # top-k user, gần nhất trước
+                "distances": np.ndarray, # distance tương ứng
+                "comparisons": dict,     # số phép so sánh {"coarse": centroid, "fine": hàng pose}
+                "pose": str | None,      # nhóm pose đã quyết định kết quả (None = toàn gallery)
+                "recent": bool           # kết quả lấy sớm từ LRU (margin = cận dưới so với mọi user khác)
+            }
+        """
+        with self._lock:
+            if len(self.index) == 0:
+                return self._no_match({"coarse": 0, "fine": 0})
+
+            query = self._normalize_query(query_embedding)
+            k = max(1, k)
+            # Fast path LRU, sau đó nhóm pose, cuối cùng toàn gallery
+            ranked, scanned_rows, scanned_centroids = self._recent_match(query, reduce, k)
+            from_recent = ranked is not None
+            if from_recent:
+                user_codes = ranked[0]
+                ranked = ranked[1:]
+            bucket = self._pose_bucket(pose) if pose is not None and not from_recent else None
+            if bucket is not None and len(bucket):
+                # Nhóm pose gần nhất: mỗi user thường chỉ có 1 hàng trong nhóm
+                scanned_rows += len(bucket)
+                user_codes, user_scores = self._reduce_by_user(self.index.score_rows(query, bucket), reduce, bucket)
+                if len(user_scores) >= min(2, len(self._user_ids)):
+                    ranked = self._rank_users(user_scores, k)
+                    if ranked[2] < self.pose_fallback_margin:
+                        ranked = None
+
+            if ranked is not None:
+                comparisons = self._record_comparisons(scanned_centroids, scanned_rows)
+            elif self.coarse_users:
+                positions = self._coarse_rows(query, max(k, 2))
+                similarities = self.index.score_rows(query, positions)
+                comparisons = self._record_comparisons(scanned_centroids + len(self._user_ids),
+                                                       scanned_rows + len(positions))
+                user_codes, user_scores = self._reduce_by_user(similarities, reduce, positions)
+            elif self.index.exact:
+                comparisons = self._record_comparisons(scanned_centroids, scanned_rows + len(self.index))
+                user_codes, user_scores = self._reduce_by_user(self.index.score_rows(query), reduce)
+            else:
+                # Lấy đủ hàng ứng viên để phủ k user (mỗi user có tới max_rows pose)
+                max_rows = int(self._user_row_counts.max())
+                positions, similarities = self.index.search(query, max(k, 2) * max_rows * 2)
+                comparisons = self._record_comparisons(scanned_centroids, scanned_rows + len(positions))
+                user_codes, user_scores = self._reduce_by_user(similarities, reduce, positions)
+
+            if ranked is None and len(user_scores) == 0:
+                # Index xấp xỉ không trả ứng viên nào
+                return self._no_match(comparisons)
+            matched_pose = pose if ranked is not None and not from_recent else None
+            top, distances, margin = ranked if ranked is not None else self._rank_users(user_scores, k)
+            best_distance = float(distances[0])
+            success = best_distance < self.threshold and margin >= self.min_margin
+            matched_user_id = self._user_ids[user_codes[top[0]]] if success else None
+            if success:
+                if not from_recent:
+                    self._count_recent_hit(matched_user_id)
+                self.remember_user(matched_user_id)
+
+            return {
+                "success": success,
+                "user_id": matched_user_id,
+                "distance": best_distance,
+                "margin": margin,
+                "user_ids": self._user_ids[user_codes[top[:k]]].tolist(),
+                "distances": distances[:k],
+                "comparisons": comparisons,
+                "pose": matched_pose,
+                "recent": from_recent,
+            }
+
+    @staticmethod
+    def _no_match(comparisons: dict) -> dict:
+        """Kết quả authenticate_topk khi không có ứng viên nào (gallery rỗng / index không trả hàng)."""
+        return {
+            "success": False,
+            "user_id": None,
+            "distance": 1.0,
+            "margin": 0.0,
+            "user_ids": [],
+            "distances": np.empty(0, dtype=np.float32),
+            "comparisons": comparisons,
+            "pose": None,
+            "recent": False,
+        }
+
+    def authenticate_batch(self, queries: np.ndarray, k: int = 3, reduce: str = "max",
+                           chunk_size: int | None = None) -> dict:
+        """
+        Xác thực M truy vấn cùng lúc (nhiều khuôn mặt trong 1 frame, snapshot lưu trữ, batch job).
+        Index chính xác: mỗi chunk truy vấn là 1 phép GEMM (chunk, D) x (D, N) rồi group-reduce theo user.
+        Index xấp xỉ / lượng tử hóa / tìm 2 giai đoạn: gọi authenticate_topk() cho từng truy vấn.
+
+        Args:
+            queries: Ma trận (M, D) embedding
+            k: Số user ứng viên trả về cho mỗi truy vấn
+            reduce: Cách gộp điểm các pose của 1 user ("max" hoặc "mean")
+            chunk_size: Số truy vấn mỗi GEMM (None = tự chọn theo BATCH_SIMILARITY_BUDGET)
+
+        Returns:
+            dict mảng theo truy vấn (cùng quy ước với authenticate_topk):
+            {
+                "success": np.ndarray (M,) bool,
+                "user_ids": np.ndarray (M, k) object,    # None nếu gallery có ít hơn k user
+                "distances": np.ndarray (M, k) float32,  # 1.0 ở ô không có user
+                "margin": np.ndarray (M,) float32
+            }
+        """
+        queries = normalize_rows(np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+        k = max(1, k)
+        n_queries = len(queries)
+        user_ids = np.full((n_queries, k), None, dtype=object)
+        distances = np.ones((n_queries, k), dtype=np.float32)
+        margin = np.zeros(n_queries, dtype=np.float32)
+
+        with self._lock:
+            n_users = len(self._user_ids)
+            if n_queries and n_users and (self.coarse_users or not self.index.exact):
+                for i, query in enumerate(queries):
+                    result = self.authenticate_topk(query, k, reduce)
+                    n_found = len(result["user_ids"])
+                    user_ids[i, :n_found] = result["user_ids"]
+                    distances[i, :n_found] = result["distances"]
+                    margin[i] = result["margin"]
+            elif n_queries and n_users:
+                vectors = self.index.vectors
+                chunk_size = chunk_size or max(1, BATCH_SIMILARITY_BUDGET // len(vectors))
+                n_top = min(max(k, 2), n_users)
+                n_keep = min(k, n_top)
+                self.search_stats["queries"] += n_queries
+                self.search_stats["fine_comparisons"] += n_queries * len(vectors)
+                for start in range(0, n_queries, chunk_size):
+                    end = min(start + chunk_size, n_queries)
+                    user_scores = self._reduce_batch(queries[start:end] @ vectors.T, reduce)
+                    top = np.argpartition(-user_scores, n_top - 1, axis=1)[:, :n_top]
+                    top_scores = np.take_along_axis(user_scores, top, axis=1)
+                    order = np.argsort(-top_scores, axis=1, kind="stable")
+                    top = np.take_along_axis(top, order, axis=1)
+                    top_distances = 1.0 - np.take_along_axis(top_scores, order, axis=1)
+
+                    user_ids[start:end, :n_keep] = self._user_ids[top[:, :n_keep]]
+                    distances[start:end, :n_keep] = top_distances[:, :n_keep]
+                    # Chỉ có 1 user trong gallery -> không có đối thủ, margin tối đa
+                    margin[start:end] = top_distances[:, 1] - top_distances[:, 0] if n_top > 1 else 1.0
+
+        return {
+            "success": (distances[:, 0] < self.threshold) & (margin >= self.min_margin),
+            "user_ids": user_ids,
+            "distances": distances,
+            "margin": margin,
+        }
+
+    def _reduce_batch(self, similarities: np.ndarray, reduce: str) -> np.ndarray:
+        """Group-reduce ma trận similarity (M, N) thành (M, U) bằng reduceat trên các đoạn hàng của user."""
+        order, starts = self._user_groups()
+        grouped = similarities if order is None else similarities[:, order]
+        if reduce == "max":
+            return np.maximum.reduceat(grouped, starts, axis=1)
+        if reduce == "mean":
+            return np.add.reduceat(grouped, starts, axis=1) / self._user_row_counts
+        raise ValueError(f"reduce không hợp lệ: {reduce}")
+
     @staticmethod
     def _cosine_distance(emb1: np.ndarray, emb2: np.ndarray) -> float:
         """Tính Cosine distance giữa 2 embeddings."""
         # Normalize vectors
         emb1_norm = emb1 / (np.linalg.norm(emb1) + 1e-8)
         emb2_norm = emb2 / (np.linalg.norm(emb2) + 1e-8)
-        
+
         # Cosine similarity
         similarity = np.dot(emb1_norm, emb2_norm)
-        
+
         # Convert to distance (0 = identical, 1 = opposite)
         distance = 1.0 - similarity
-        
+
         return distance
-    
+
     def get_user_info(self, user_id: str) -> dict | None:
         """Lấy thông tin chi tiết của user."""
         return self.db.get_user(user_id)
 
 
+_shared_authenticators: dict[str, Authenticator] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_authenticator(db_manager: DatabaseManager = None, **kwargs) -> Authenticator:
+    """
+    Trả về 1 Authenticator dùng chung trong process (theo đường dẫn database),
+    tránh mỗi AuthWorker load lại toàn bộ gallery. Gallery được sync() delta trước khi trả về.
+    `kwargs` chỉ có tác dụng ở lần tạo đầu tiên.
+    """
+    db = db_manager or DatabaseManager()
+    key = str(Path(db.db_path).resolve())
+    with _shared_lock:
+        authenticator = _shared_authenticators.get(key)
+        if authenticator is None:
+            authenticator = Authenticator(db_manager=db, **kwargs)
+            _shared_authenticators[key] = authenticator
+            return authenticator
+    authenticator.sync()
+    return authenticator
+
+
+def _shared_for(db_manager: DatabaseManager) -> Authenticator | None:
+    with _shared_lock:
+        return _shared_authenticators.get(str(Path(db_manager.db_path).resolve()))
+
+
+def synced_change_seq(db_manager: DatabaseManager) -> int:
+    """
+    Watermark nhật ký thay đổi nhỏ nhất mà các Authenticator dùng chung của database này đã sync qua
+    (0 nếu chưa có): các hàng embedding_changes có seq <= giá trị này có thể prune.
+    """
+    authenticator = _shared_for(db_manager)
+    if authenticator is None:
+        return 0
+    with authenticator._lock:
+        return authenticator._change_seq
+
+
+def retrain_shared_index(db_manager: DatabaseManager) -> bool:
+    """Train lại index của Authenticator dùng chung (nếu có và đã đến hạn), xem Authenticator.retrain_index()."""
+    authenticator = _shared_for(db_manager)
+    return authenticator is not None and authenticator.retrain_index()
+
+
 # Test standalone
 if __name__ == "__main__":
     auth = Authenticator()
     print(f"Authenticator initialized with threshold={auth.threshold}")
-    print(f"Total users in database: {len(set([uid for uid, _ in auth._embeddings_cache]))}")
+    print(f"Total users in database: {len(auth._user_ids)}")
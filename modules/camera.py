@@ -1,73 +1,224 @@
 """
 Module Camera Thread để đọc video từ webcam trong background.
 Sử dụng QThread để không block UI.
+
+Chế độ mặc định (latest_frame): grab() liên tục theo FPS thật của thiết bị để driver không giữ frame cũ,
+chỉ retrieve() + flip khi consumer đã xử lý xong frame trước -> consumer luôn nhận frame mới nhất.
+Nguồn không live (video / ảnh / phiên đã ghi) thì chờ consumer thay vì bỏ frame: mọi frame đều được giao,
+kết quả benchmark / phát lại regression không phụ thuộc thời điểm.
+Frame được decode vào 1 buffer dùng lại rồi flip thẳng vào slot của FrameRing; signal mang FrameRef
+(view chỉ đọc, không copy), slot được trả về ring khi mọi người giữ đã release().
+Nguồn frame là FrameSource (webcam mặc định; file video / thư mục ảnh / phiên đã ghi qua set_default_source()).
 """
+import threading
+import time
+from collections import deque
+
 import cv2
 import numpy as np
-from PySide6.QtCore import QThread, Signal
-import os
+from PySide6.QtCore import Qt, QThread, Signal
+
+from modules.frame_ring import FrameRef, FrameRing
+from modules.frame_source import CameraSource, FrameSource, open_frame_source
+
+# Số khoảng cách giữa 2 lần grab giữ lại để tính FPS / jitter
+JITTER_WINDOW = 120
+
+# Nguồn cho các CameraThread tạo không kèm source: (spec, realtime, loop) hoặc None = webcam
+_default_source: tuple | None = None
+
+
+def set_default_source(spec, realtime: bool = True, loop: bool = False):
+    """
+    Cho toàn ứng dụng đọc từ nguồn khác webcam (vd. `python main.py --source data/sessions/a`).
+    Mỗi CameraThread mở 1 FrameSource mới từ spec này. spec=None quay lại webcam.
+    """
+    global _default_source
+    _default_source = None if spec is None else (spec, realtime, loop)
 
 
 class CameraThread(QThread):
     """Thread đọc frame từ camera liên tục."""
-    
-    # Signal phát ra mỗi khi có frame mới
-    frame_captured = Signal(np.ndarray)
+
+    # Signal phát ra mỗi khi có frame mới: FrameRef (ref.array là frame BGR đã flip, chỉ đọc;
+    # ref.seq / ref.timestamp / ref.captured_at theo frame).
+    # Ref thuộc về CameraThread và được trả sau khi các slot chạy xong: ai giữ frame lâu hơn phải ref.retain()
+    frame_captured = Signal(object)
     # Signal khi camera bị lỗi
     error_occurred = Signal(str)
-    
-    def __init__(self, camera_id: int = 0, parent=None):
+
+    def __init__(self, camera_id: int = 0, latest_frame: bool = True, shared_frames: bool = False,
+                 source: FrameSource | None = None, parent=None):
+        """
+        Args:
+            camera_id: Chỉ số camera (khi không có source và không đặt set_default_source)
+            latest_frame: True = grab/retrieve, chỉ giao frame mới nhất khi consumer sẵn sàng;
+                False = read() mỗi frame rồi nghỉ 30ms (cách cũ, cho driver không hỗ trợ grab tốt)
+            shared_frames: True = FrameRing đặt trong shared_memory (process khác attach theo ring.name)
+            source: Nguồn frame chưa open() (CameraSource / VideoFileSource / ImageSequenceSource /
+                RecordedSessionSource)
+        """
         super().__init__(parent)
         self.camera_id = camera_id
+        self.latest_frame = latest_frame
         self._running = False
-        self._cap = None
+        self.source = source
+        self._cap: FrameSource | None = None
+        # Set khi slot của consumer đã chạy xong với frame trước (xem _on_frame_delivered)
+        self._consumer_ready = threading.Event()
+        self._intervals: deque[float] = deque(maxlen=JITTER_WINDOW)
+        self._last_grab = 0.0
+        self.stats = {"grabbed": 0, "delivered": 0, "skipped": 0}
+        self.shared_frames = shared_frames
+        # Tạo khi biết shape của frame đầu tiên
+        self.ring: FrameRing | None = None
+        self._scratch: np.ndarray | None = None
 
     def run(self):
         """Vòng lặp chính đọc frame từ camera."""
-        # Ưu tiên backend DirectShow trên Windows để giảm độ trễ
-        if os.name == "nt":
-            self._cap = cv2.VideoCapture(self.camera_id, cv2.CAP_DSHOW)
+        if self.source is not None:
+            self._cap = self.source
+        elif _default_source is not None:
+            try:
+                self._cap = open_frame_source(*_default_source)
+            except ValueError as e:
+                self.error_occurred.emit(str(e))
+                return
         else:
-            self._cap = cv2.VideoCapture(self.camera_id)
-        
-        if not self._cap.isOpened():
+            self._cap = CameraSource(self.camera_id)
+
+        if not self._cap.open():
             self.error_occurred.emit("Không thể mở camera")
             return
-        
-        # Thiết lập camera
-        try:
-            # Giảm buffer để tránh lag khung hình
-            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        except Exception:
-            pass
-        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self._cap.set(cv2.CAP_PROP_FPS, 30)
-        
+
         self._running = True
-        print(f"[CameraThread] Started capturing from camera {self.camera_id}")
+        print(f"[CameraThread] Started capturing from {self._cap}"
+              f" ({'latest-frame' if self.latest_frame else 'read + sleep'})")
+        # Kết nối sau các consumer (đã connect trước start()) -> slot này chạy sau slot của họ trên UI thread
+        self.frame_captured.connect(self._on_frame_delivered, Qt.QueuedConnection)
+        try:
+            if self.latest_frame:
+                self._run_latest_frame()
+            else:
+                self._run_read_sleep()
+        finally:
+            self.frame_captured.disconnect(self._on_frame_delivered)
+
+        self._cap.release()
+        stats = self.get_capture_stats()
+        print(f"[CameraThread] Stopped: {stats['fps']:.1f} FPS, jitter {stats['jitter_ms']:.1f}ms, "
+              f"delivered {stats['delivered']}/{stats['grabbed']}")
+
+    def _run_latest_frame(self):
+        """grab() chặn tới frame kế tiếp nên vòng lặp chạy đúng FPS thiết bị, không cần sleep."""
+        self._consumer_ready.set()
         while self._running:
-            ret, frame = self._cap.read()
+            if not self._cap.grab():
+                self._on_source_end()
+                break
+            self._record_grab()
+            if not self._cap.live:
+                # Nguồn phát lại: chờ consumer để frame nào được phân tích không phụ thuộc thời điểm
+                if not self._wait_consumer():
+                    break
+            elif not self._consumer_ready.is_set():
+                # Consumer còn bận: bỏ frame này (đã lấy khỏi buffer driver), không decode / flip
+                self.stats["skipped"] += 1
+                continue
+            ret, self._scratch = self._cap.retrieve(self._scratch)
+            if not ret:
+                self.error_occurred.emit("Không đọc được frame từ camera")
+                break
+            if self._deliver(self._scratch):
+                self._consumer_ready.clear()
+
+    def _wait_consumer(self) -> bool:
+        """Chờ consumer xử lý xong frame trước (kiểm tra stop() mỗi 100ms); False nếu thread bị dừng."""
+        while not self._consumer_ready.wait(0.1):
+            if not self._running:
+                return False
+        return True
+
+    def _run_read_sleep(self):
+        while self._running:
+            ret, self._scratch = self._cap.read(self._scratch)
             if ret:
-                # Flip horizontal để giống gương
-                frame = cv2.flip(frame, 1)
-                self.frame_captured.emit(frame)
+                self._record_grab()
+                self._deliver(self._scratch)
             else:
-                self.error_occurred.emit("Không đọc được frame từ camera")
+                self._on_source_end()
                 break
-            
+
             # Giảm tải CPU một chút
             self.msleep(30)
-        
-        self._cap.release()
+
+    def _on_source_end(self):
+        if self._cap.exhausted and not self._cap.live:
+            print(f"[CameraThread] Source finished: {self._cap}")
+        else:
+            self.error_occurred.emit("Không đọc được frame từ camera")
+
+    def _deliver(self, decoded: np.ndarray) -> bool:
+        """Flip frame vừa decode vào 1 slot trống của ring rồi emit; False nếu mọi slot đang được giữ."""
+        if self.ring is None or self.ring.shape != decoded.shape:
+            self.ring = FrameRing(decoded.shape, decoded.dtype, shared=self.shared_frames)
+        slot = self.ring.acquire()
+        while slot is None and not self._cap.live and self._running:
+            # Nguồn phát lại: chờ worker trả slot thay vì bỏ frame
+            self.msleep(1)
+            slot = self.ring.acquire()
+        if slot is None:
+            self.stats["skipped"] += 1
+            return False
+        index, target = slot
+        # Flip horizontal để giống gương (ghi thẳng vào slot, không cấp phát)
+        cv2.flip(decoded, 1, dst=target)
+        self.stats["delivered"] += 1
+        # Timestamp lúc grab theo dòng thời gian của nguồn (đơn điệu, kể cả khi phát lại file nhanh / lặp)
+        self.frame_captured.emit(self.ring.publish(index, self._cap.timestamp))
+        return True
+
+    def _on_frame_delivered(self, ref: FrameRef):
+        """Chạy trên thread của consumer, ngay sau slot xử lý frame của họ: trả ref của CameraThread."""
+        ref.release()
+        self._consumer_ready.set()
+
+    def _record_grab(self):
+        now = time.monotonic()
+        if self.stats["grabbed"]:
+            self._intervals.append(now - self._last_grab)
+        self._last_grab = now
+        self.stats["grabbed"] += 1
+
+    def get_capture_stats(self) -> dict:
+        """
+        FPS capture thật và jitter (độ lệch chuẩn khoảng cách giữa 2 frame) trên JITTER_WINDOW frame gần nhất.
+
+        Returns:
+            dict: {"fps", "jitter_ms", "max_interval_ms", "grabbed", "delivered", "skipped"}
+        """
+        intervals = np.array(self._intervals, dtype=np.float64)
+        mean = float(intervals.mean()) if len(intervals) else 0.0
+        return {
+            "fps": 1.0 / mean if mean > 0 else 0.0,
+            "jitter_ms": float(intervals.std() * 1000) if len(intervals) else 0.0,
+            "max_interval_ms": float(intervals.max() * 1000) if len(intervals) else 0.0,
+            **self.stats,
+        }
 
     def stop(self):
         """Dừng thread camera."""
         self._running = False
         self.wait()
         # Đảm bảo release camera nếu thread crash hoặc stop bất thường
-        if self._cap and self._cap.isOpened():
+        if self._cap:
             self._cap.release()
+        if self.ring is not None and self.ring.name is not None:
+            try:
+                self.ring.close()
+            except BufferError:
+                # Worker còn giữ view của slot: để garbage collector đóng sau
+                print("[CameraThread] Frame ring vẫn còn được tham chiếu, chưa đóng shared memory")
 
     def is_running(self) -> bool:
         """Kiểm tra thread có đang chạy không."""
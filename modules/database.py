@@ -2,34 +2,670 @@
 Module quản lý Database cho hệ thống Face Recognition.
 Sử dụng SQLite để lưu trữ thông tin người dùng và embedding khuôn mặt.
 """
+import atexit
+import queue
 import sqlite3
+import threading
+import time
 import numpy as np
 from pathlib import Path
 from datetime import datetime
+from collections import OrderedDict
+from typing import Iterator, NamedTuple
 import os
 
+from modules.embedding_store import EmbeddingStore
+from modules.event_bus import EventBus
+
 # Đường dẫn mặc định cho database
 DB_PATH = Path(__file__).parent.parent / "data" / "faces.db"
 FACES_DIR = Path(__file__).parent.parent / "data" / "faces"
 
+# Số hàng mỗi trang mặc định của các API phân trang keyset (iter_events / iter_users)
+PAGE_SIZE = 500
+
+
+class EventRow(NamedTuple):
+    """1 hàng của bảng events (API phân trang)."""
+    id: int
+    event_type: str
+    user_id: str | None
+    result: str
+    score: float | None
+    details: str | None
+    created_at: str
+    fail_count: int | None = None
+    liveness_status: str | None = None
+    spoof_reason: str | None = None
+    distance: float | None = None
+    latency_ms: float | None = None
+    session_id: str | None = None
+
+
+# Cột có kiểu của events (migration 4), theo thứ tự trong EventRow
+EVENT_FIELDS = ("fail_count", "liveness_status", "spoof_reason", "distance", "latency_ms", "session_id")
+EVENT_COLUMNS_SQL = ", ".join(EventRow._fields)
+
+
+class RollupPoint(NamedTuple):
+    """1 bucket (giờ / ngày) của event_rollups."""
+    bucket: str
+    auth_success: int
+    auth_fail: int
+    spoof: int
+    enroll: int
+    mean_distance: float | None
+
+    @property
+    def failure_rate(self) -> float:
+        attempts = self.auth_success + self.auth_fail
+        return self.auth_fail / attempts if attempts else 0.0
+
+    @property
+    def spoof_rate(self) -> float:
+        attempts = self.auth_success + self.auth_fail
+        return self.spoof / attempts if attempts else 0.0
+
+
+class AttendanceRow(NamedTuple):
+    """Lần xác thực thành công đầu / cuối của 1 user trong 1 ngày (UTC)."""
+    user_id: str
+    day: str
+    first_seen: str
+    last_seen: str
+    auth_count: int
+
+
+class UserRow(NamedTuple):
+    """1 hàng của bảng users (API phân trang)."""
+    id: str
+    fullname: str
+    email: str | None
+    phone: str | None
+    dob: str | None
+    avatar_path: str | None
+    created_at: str
+
+
+# Rollup: định dạng bucket theo độ chi tiết, số event tối đa gộp trong 1 transaction
+ROLLUP_FORMATS = {"hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d"}
+ROLLUP_BATCH = 50_000
+
+# Retention: event cũ hơn RETENTION_DAYS ngày được chuyển sang file archive theo tháng
+# (data/archive/events_YYYY_MM.db), mỗi transaction tối đa ARCHIVE_BATCH hàng
+RETENTION_DAYS = 90
+ARCHIVE_BATCH = 5000
+ARCHIVE_EVENTS_SQL = """
+    CREATE TABLE IF NOT EXISTS archive.events (
+        id INTEGER PRIMARY KEY,
+        event_type TEXT NOT NULL,
+        user_id TEXT,
+        result TEXT NOT NULL,
+        score REAL,
+        details TEXT,
+        created_at TIMESTAMP,
+        fail_count INTEGER,
+        liveness_status TEXT,
+        spoof_reason TEXT,
+        distance REAL,
+        latency_ms REAL,
+        session_id TEXT
+    )
+"""
+
+# Chờ khóa ghi tối đa (ms) thay vì lỗi "database is locked" ngay
+BUSY_TIMEOUT_MS = 5000
+# Số prepared statement được sqlite3 cache trên mỗi connection
+CACHED_STATEMENTS = 256
+
+# Event writer nền: ghi 1 transaction mỗi EVENT_BATCH_SIZE event hoặc mỗi EVENT_FLUSH_INTERVAL giây
+EVENT_BATCH_SIZE = 256
+EVENT_FLUSH_INTERVAL = 0.05
+EVENT_QUEUE_SIZE = 10000
+# Hàng đợi đầy: add_event chờ tối đa bấy nhiêu giây rồi bỏ event (đếm vào stats["dropped"])
+EVENT_PUT_TIMEOUT = 0.5
+
+# Số user giữ trong cache của get_user (dùng chung theo file database)
+USER_CACHE_SIZE = 1024
+# Chu kỳ (giây) get_user kiểm tra mốc change_markers['users'] (thay đổi từ process khác hiện ra sau tối đa bấy nhiêu)
+USER_CACHE_CHECK_INTERVAL = 2.0
+# Cột của users sửa được qua update_user()
+USER_FIELDS = ("fullname", "email", "phone", "dob", "avatar_path")
+
+
+class ConnectionPool:
+    """
+    Pool connection SQLite theo thread cho 1 file database, dùng chung giữa mọi DatabaseManager.
+    Mỗi thread giữ 1 connection lâu dài (sqlite3 không cho dùng 1 connection đồng thời từ nhiều thread),
+    cấu hình WAL + busy_timeout + synchronous=NORMAL: reader không chặn writer và ngược lại.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # Schema chỉ cần khởi tạo 1 lần cho mỗi file trong process
+        self.initialized = False
+        # DatabaseManager.close() đã đóng pool (writer dừng): manager còn giữ pool này lấy pool mới
+        self.closed = False
+        # Thay đổi đã commit được publish lên bus, view cập nhật theo delta thay vì truy vấn lại
+        self.bus = EventBus()
+        self.event_writer = EventWriter(self)
+        # Cache get_user: ghi / xóa user trong process cập nhật cache trước khi publish
+        self.user_cache: OrderedDict[str, dict] = OrderedDict()
+        self.user_cache_lock = threading.Lock()
+        # Giá trị change_markers['users'] mà nội dung cache ứng với (process khác ghi -> seq tăng -> bỏ cache)
+        self.user_cache_seq = -1
+        # time.monotonic() lần cuối đọc mốc (đọc lại sau USER_CACHE_CHECK_INTERVAL)
+        self.user_cache_checked_at = float("-inf")
+
+    def connection(self) -> sqlite3.Connection:
+        """Connection của thread hiện tại (tạo lần đầu khi cần)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            cached_statements=CACHED_STATEMENTS,
+            check_same_thread=False,  # chỉ để close_all() đóng được từ thread khác
+        )
+        try:
+            # Chỉ có tác dụng với database mới (phải đặt trước WAL): bật incremental vacuum từ đầu
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = NORMAL;")
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+            # Bật foreign keys để ON DELETE CASCADE có hiệu lực
+            conn.execute("PRAGMA foreign_keys = ON;")
+        except sqlite3.Error as e:
+            print(f"[DatabaseManager] Không cấu hình được connection: {e}")
+        return conn
+
+    def close_all(self):
+        """Đóng mọi connection (khi thoát ứng dụng); thread nào dùng tiếp sẽ mở connection mới."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class EventWriter:
+    """
+    Ghi bảng events bất đồng bộ: add_event() chỉ đưa event vào hàng đợi có giới hạn,
+    1 thread nền gom event và ghi bằng executemany trong 1 transaction
+    (mỗi EVENT_BATCH_SIZE event hoặc sau EVENT_FLUSH_INTERVAL giây kể từ event đầu của batch).
+    Chỉ thread nền ghi, nên id event luôn theo đúng thứ tự put().
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+    INSERT_SQL = f"""INSERT INTO events ({", ".join(EventRow._fields[1:])})
+                     VALUES ({", ".join("?" * (len(EventRow._fields) - 1))})"""
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = EVENT_BATCH_SIZE,
+                 flush_interval: float = EVENT_FLUSH_INTERVAL, max_pending: int = EVENT_QUEUE_SIZE,
+                 put_timeout: float = EVENT_PUT_TIMEOUT):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread: threading.Thread | None = None
+        # Giữ trong suốt put() để close() không chen giữa lúc kiểm tra và lúc đưa vào hàng đợi
+        self._lock = threading.Lock()
+        self._closed = False
+        self._atexit_registered = False
+        # stats được cập nhật từ thread gọi (overflow/dropped) và thread nền (written/batches/errors)
+        self._stats_lock = threading.Lock()
+        self.stats = {"written": 0, "batches": 0, "overflow": 0, "dropped": 0, "errors": 0}
+
+    def put(self, row: tuple) -> bool:
+        """
+        Đưa 1 hàng (các cột của EventRow trừ id, cùng thứ tự) vào hàng đợi.
+        Hàng đợi đầy -> chờ tối đa put_timeout giây; vẫn đầy thì bỏ event (stats["dropped"]).
+        Sau close() không nhận event nữa. Trả về True nếu đã nhận.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self._ensure_started()
+            try:
+                self._queue.put_nowait(row)
+                return True
+            except queue.Full:
+                self._count("overflow")
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                dropped = self._count("dropped")
+        if dropped == 1 or dropped % 100 == 0:
+            print(f"[EventWriter] Hàng đợi event đầy, đã bỏ {dropped} event")
+        return False
+
+    def get_stats(self) -> dict:
+        """Bản copy số liệu: written, batches, overflow (phải chờ hàng đợi), dropped, errors."""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def flush(self):
+        """Chờ tới khi mọi event đã đưa vào hàng đợi được ghi xuống database."""
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+        if not running:
+            return
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def close(self):
+        """Ghi nốt hàng đợi rồi dừng thread nền; event put() sau đó bị bỏ qua."""
+        with self._lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join()
+
+    def _ensure_started(self):
+        """Chạy thread nền nếu chưa chạy (gọi khi giữ _lock)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="EventWriter", daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            # Thread daemon: đảm bảo hàng đợi được ghi hết khi process thoát bình thường
+            atexit.register(self.close)
+            self._atexit_registered = True
+
+    def _count(self, name: str, amount: int = 1) -> int:
+        with self._stats_lock:
+            self.stats[name] += amount
+            return self.stats[name]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, taken, stop = [], 1, False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stop = True
+                    break
+                if item is self._FLUSH:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                    taken += 1
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            # task_done cho mọi item đã lấy (kể cả marker FLUSH/STOP) -> flush() mới thoát được join()
+            for _ in range(taken):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, rows: list[tuple]) -> bool:
+        try:
+            with self.pool.connection() as conn:
+                conn.executemany(self.INSERT_SQL, rows)
+                # Cả batch chèn trong 1 transaction đang giữ khóa ghi -> id liên tiếp, kết thúc ở last_id
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            self._count("written", len(rows))
+            self._count("batches")
+        except sqlite3.Error as e:
+            self._count("errors")
+            print(f"[EventWriter] Không ghi được {len(rows)} event: {e}")
+            return False
+        if self.pool.bus.has_subscribers("events"):
+            first_id = last_id - len(rows) + 1
+            self.pool.bus.publish("events", [EventRow(first_id + i, *row) for i, row in enumerate(rows)])
+        return True
+
+
+# Bộ đếm thống kê (bảng stats_counters, day = '' là tổng toàn thời gian, 'YYYY-MM-DD' là theo ngày UTC).
+# Tên bộ đếm của 1 event; event không thuộc danh sách (vd. logout) không được đếm.
+_EVENT_COUNTER_SQL = "CASE NEW.event_type WHEN 'auth' THEN 'auth_success' ELSE NEW.event_type END"
+_EVENT_COUNTED_SQL = "(NEW.event_type IN ('enroll', 'auth_fail') OR (NEW.event_type = 'auth' AND NEW.result = 'success'))"
+
+
+def event_counter_name(event: EventRow) -> str | None:
+    """Bộ đếm stats_counters mà 1 event được cộng vào (khớp trigger ở trên); None nếu không đếm."""
+    if event.event_type in ("enroll", "auth_fail"):
+        return event.event_type
+    if event.event_type == "auth" and event.result == "success":
+        return "auth_success"
+    return None
+
+
+_COUNTER_BUMP_SQL = """INSERT INTO stats_counters (name, day, value) VALUES ({name}, {day}, {delta})
+                  ON CONFLICT(name, day) DO UPDATE SET value = value + {delta};"""
+
+
+def _stats_triggers() -> list[str]:
+    """Trigger giữ stats_counters khớp với users/events trong cùng transaction với câu lệnh ghi."""
+    bump = _COUNTER_BUMP_SQL
+    old_counter = _EVENT_COUNTER_SQL.replace("NEW.", "OLD.")
+    old_counted = _EVENT_COUNTED_SQL.replace("NEW.", "OLD.")
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+            BEGIN {bump.format(name="'users'", day="''", delta=1)} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_stats_delete AFTER DELETE ON users
+            BEGIN {bump.format(name="'users'", day="''", delta=-1)} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_events_stats_insert AFTER INSERT ON events
+            WHEN {_EVENT_COUNTED_SQL}
+            BEGIN
+                {bump.format(name=_EVENT_COUNTER_SQL, day="''", delta=1)}
+                {bump.format(name=_EVENT_COUNTER_SQL, day="date(NEW.created_at)", delta=1)}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_events_stats_delete AFTER DELETE ON events
+            WHEN {old_counted}
+            BEGIN
+                {bump.format(name=old_counter, day="''", delta=-1)}
+                {bump.format(name=old_counter, day="date(OLD.created_at)", delta=-1)}
+            END""",
+    ]
+
+
+def _archive_aware_delete_trigger() -> str:
+    """
+    Trigger xóa event chỉ trừ bộ đếm với event chưa archive: hàng có id <= mốc 'archive'
+    được chuyển sang file archive chứ không mất, tổng trên Dashboard giữ nguyên.
+    """
+    old_counter = _EVENT_COUNTER_SQL.replace("NEW.", "OLD.")
+    old_counted = _EVENT_COUNTED_SQL.replace("NEW.", "OLD.")
+    return f"""CREATE TRIGGER IF NOT EXISTS trg_events_stats_delete AFTER DELETE ON events
+            WHEN {old_counted}
+                 AND OLD.id > (SELECT last_event_id FROM rollup_state WHERE name = 'archive')
+            BEGIN
+                {_COUNTER_BUMP_SQL.format(name=old_counter, day="''", delta=-1)}
+                {_COUNTER_BUMP_SQL.format(name=old_counter, day="date(OLD.created_at)", delta=-1)}
+            END"""
+
+
+def _change_marker_triggers(table: str) -> list[str]:
+    """Trigger tăng change_markers[table] khi bảng bị thêm / sửa / xóa (kể cả từ process khác)."""
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_marker_{op.lower()} AFTER {op} ON {table}
+            BEGIN
+                UPDATE change_markers SET seq = seq + 1 WHERE name = '{table}';
+            END"""
+        for op in ("INSERT", "UPDATE", "DELETE")
+    ]
+
+
+def _event_counters(cursor: sqlite3.Cursor, table: str, max_id: int) -> list[tuple[str, str, int]]:
+    """Bộ đếm event (name, day, value) - tổng + theo ngày - của 1 bảng events (vd. archive.events), id <= max_id."""
+    counted = _EVENT_COUNTED_SQL.replace("NEW.", "")
+    counter = _EVENT_COUNTER_SQL.replace("NEW.", "")
+    rows = []
+    for day in ("''", "date(created_at)"):
+        rows += cursor.execute(
+            f"""SELECT {counter}, {day}, COUNT(*) FROM {table}
+                WHERE {counted} AND id <= ? GROUP BY 1, 2""",
+            (max_id,)
+        ).fetchall()
+    return rows
+
+
+def _rebuild_stats_counters(cursor: sqlite3.Cursor):
+    """Tính lại toàn bộ stats_counters từ users/events (dùng khi migration và lệnh --rebuild-stats)."""
+    counted = _EVENT_COUNTED_SQL.replace("NEW.", "")
+    counter = _EVENT_COUNTER_SQL.replace("NEW.", "")
+    cursor.execute("DELETE FROM stats_counters")
+    cursor.execute("INSERT INTO stats_counters (name, day, value) SELECT 'users', '', COUNT(*) FROM users")
+    cursor.execute(f"""INSERT INTO stats_counters (name, day, value)
+                       SELECT {counter}, '', COUNT(*) FROM events WHERE {counted} GROUP BY 1""")
+    cursor.execute(f"""INSERT INTO stats_counters (name, day, value)
+                       SELECT {counter}, date(created_at), COUNT(*) FROM events WHERE {counted} GROUP BY 1, 2""")
+
+
+def _parse_fail_count(details: str | None) -> int | None:
+    """Số lần fail trong details dạng "..., fail_count: 2/3, ..." (định dạng cũ); None nếu không có."""
+    for part in (details or "").split(","):
+        if "fail_count" in part.lower():
+            value = part.split(":")[-1].split("/")[0].strip()
+            return int(value) if value.isdigit() else None
+    return None
+
+
+def _backfill_event_columns(cursor: sqlite3.Cursor, batch_size: int = 5000) -> int:
+    """
+    Điền cột fail_count từ chuỗi details của các event cũ, theo từng batch id (keyset).
+    Trả về số hàng đã cập nhật.
+    """
+    updated, last_id = 0, 0
+    while True:
+        rows = cursor.execute(
+            """SELECT id, details FROM events
+               WHERE id > ? AND fail_count IS NULL AND details LIKE '%fail_count%'
+               ORDER BY id LIMIT ?""",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return updated
+        values = [(count, event_id) for event_id, details in rows
+                  if (count := _parse_fail_count(details)) is not None]
+        cursor.executemany("UPDATE events SET fail_count = ? WHERE id = ?", values)
+        updated += len(values)
+        last_id = rows[-1][0]
+
+
+# Migration schema theo thứ tự: (version, mô tả, [câu SQL hoặc hàm nhận cursor]).
+# Chỉ được thêm bước mới vào cuối với version lớn hơn, không sửa bước đã phát hành.
+MIGRATIONS: list[tuple[int, str, list]] = [
+    (1, "Index cho các truy vấn Dashboard / xác thực", [
+        # get_stats: COUNT theo (event_type, result) và khoảng thời gian hôm nay
+        "CREATE INDEX IF NOT EXISTS idx_events_type_result_created ON events(event_type, result, created_at)",
+        # get_events lọc theo loại, mới nhất trước
+        "CREATE INDEX IF NOT EXISTS idx_events_type_created ON events(event_type, created_at)",
+        # get_events không lọc, mới nhất trước
+        "CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at)",
+        # get_recent_auth_users: GROUP BY user_id trên các lần xác thực thành công
+        "CREATE INDEX IF NOT EXISTS idx_events_type_result_user ON events(event_type, result, user_id)",
+        # Tra embedding theo user + ON DELETE CASCADE khi xóa user
+        "CREATE INDEX IF NOT EXISTS idx_face_embeddings_user ON face_embeddings(user_id)",
+    ]),
+    (2, "Bộ đếm thống kê stats_counters cho get_stats", [
+        """CREATE TABLE IF NOT EXISTS stats_counters (
+               name TEXT NOT NULL,
+               day TEXT NOT NULL DEFAULT '',
+               value INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (name, day)
+           ) WITHOUT ROWID""",
+        *_stats_triggers(),
+        _rebuild_stats_counters,
+    ]),
+    (3, "Index cho phân trang keyset events / users", [
+        # get_events_page lọc theo loại / user, đi lùi theo id
+        "CREATE INDEX IF NOT EXISTS idx_events_type_id ON events(event_type, id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_user_id ON events(user_id, id)",
+        # iter_users theo (created_at, id)
+        "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at, id)",
+    ]),
+    (4, "Cột có kiểu cho events (fail_count, liveness, khoảng cách, độ trễ, phiên)", [
+        "ALTER TABLE events ADD COLUMN fail_count INTEGER",
+        "ALTER TABLE events ADD COLUMN liveness_status TEXT",
+        "ALTER TABLE events ADD COLUMN spoof_reason TEXT",
+        "ALTER TABLE events ADD COLUMN distance REAL",
+        "ALTER TABLE events ADD COLUMN latency_ms REAL",
+        "ALTER TABLE events ADD COLUMN session_id TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_events_session ON events(session_id)",
+        _backfill_event_columns,
+    ]),
+    (5, "Bảng rollup theo giờ / ngày và điểm danh user", [
+        """CREATE TABLE IF NOT EXISTS event_rollups (
+               granularity TEXT NOT NULL,
+               bucket TEXT NOT NULL,
+               auth_success INTEGER NOT NULL DEFAULT 0,
+               auth_fail INTEGER NOT NULL DEFAULT 0,
+               spoof INTEGER NOT NULL DEFAULT 0,
+               enroll INTEGER NOT NULL DEFAULT 0,
+               distance_sum REAL NOT NULL DEFAULT 0,
+               distance_count INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (granularity, bucket)
+           ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS user_attendance (
+               user_id TEXT NOT NULL,
+               day TEXT NOT NULL,
+               first_seen TEXT NOT NULL,
+               last_seen TEXT NOT NULL,
+               auth_count INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (user_id, day)
+           ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_user_attendance_day ON user_attendance(day)",
+        # High-water mark: id event lớn nhất đã gộp vào rollup
+        """CREATE TABLE IF NOT EXISTS rollup_state (
+               name TEXT PRIMARY KEY,
+               last_event_id INTEGER NOT NULL DEFAULT 0
+           )""",
+        "INSERT OR IGNORE INTO rollup_state (name, last_event_id) VALUES ('events', 0)",
+    ]),
+    (6, "Retention: mốc archive events, trigger đếm bỏ qua hàng đã archive", [
+        # Mốc archive: id event lớn nhất đã chuyển sang file archive
+        "INSERT OR IGNORE INTO rollup_state (name, last_event_id) VALUES ('archive', 0)",
+        "DROP TRIGGER IF EXISTS trg_events_stats_delete",
+        _archive_aware_delete_trigger(),
+    ]),
+    (7, "Mốc thay đổi bảng users cho cache get_user giữa các process", [
+        """CREATE TABLE IF NOT EXISTS change_markers (
+               name TEXT PRIMARY KEY,
+               seq INTEGER NOT NULL DEFAULT 0
+           ) WITHOUT ROWID""",
+        "INSERT OR IGNORE INTO change_markers (name, seq) VALUES ('users', 0)",
+        *_change_marker_triggers("users"),
+    ]),
+    (8, "Nhật ký xóa/sửa embedding cho sync() delta của Authenticator", [
+        # Database cũ đã có bảng / trigger (tạo trong _init_db trước đây): IF NOT EXISTS giữ nguyên
+        """CREATE TABLE IF NOT EXISTS embedding_changes (
+               seq INTEGER PRIMARY KEY AUTOINCREMENT,
+               embedding_id INTEGER NOT NULL,
+               op TEXT NOT NULL
+           )""",
+        # Kể cả xóa qua ON DELETE CASCADE khi xóa user
+        """CREATE TRIGGER IF NOT EXISTS trg_face_embeddings_delete
+           AFTER DELETE ON face_embeddings
+           BEGIN
+               INSERT INTO embedding_changes (embedding_id, op) VALUES (OLD.id, 'delete');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_face_embeddings_update
+           AFTER UPDATE OF embedding ON face_embeddings
+           BEGIN
+               INSERT INTO embedding_changes (embedding_id, op) VALUES (NEW.id, 'update');
+           END""",
+        # Mốc prune: các hàng seq <= mốc đã bị xóa khỏi nhật ký
+        "INSERT OR IGNORE INTO change_markers (name, seq) VALUES ('embedding_changes_pruned', 0)",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(db_path: Path) -> ConnectionPool:
+    """Pool dùng chung theo đường dẫn database (mọi DatabaseManager cùng file dùng chung connection)."""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+        return pool
+
+
+def _discard_connection_pool(pool: ConnectionPool):
+    """Bỏ pool đã đóng khỏi cache: DatabaseManager mở sau đó trên cùng file nhận pool (và EventWriter) mới."""
+    key = str(pool.db_path.resolve())
+    with _pools_lock:
+        pool.closed = True
+        if _pools.get(key) is pool:
+            del _pools[key]
+
 
 class DatabaseManager:
     """Quản lý kết nối và thao tác với SQLite database."""
 
-    def __init__(self, db_path: Path = DB_PATH):
+    def __init__(self, db_path: Path = DB_PATH, embedding_storage: str = "float32"):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+            embedding_storage: Kiểu lưu gallery trong sidecar store: "float32", "float16", "int8"
+                (BLOB trong SQLite luôn là float32 gốc để chấm lại chính xác)
+        """
         self.db_path = db_path
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self._init_db()
+        self.embedding_storage = embedding_storage
+        # Sidecar store (memory-map) cho Authenticator, SQLite vẫn là nguồn gốc
+        self.embedding_store = EmbeddingStore(self.db_path.parent, name=f"{self.db_path.stem}-embeddings",
+                                              storage=embedding_storage)
+        self.archive_dir = self.db_path.parent / "archive"
+        self._current_pool: ConnectionPool | None = None
+        self._acquire_pool()
+
+    @property
+    def _pool(self) -> ConnectionPool:
+        """Pool của file database; pool đã bị close() (bởi manager khác) thì lấy pool mới."""
+        pool = self._current_pool
+        return pool if not pool.closed else self._acquire_pool()
+
+    def _acquire_pool(self) -> ConnectionPool:
+        pool = get_connection_pool(self.db_path)
+        self._current_pool = pool
+        with _pools_lock:
+            if not pool.initialized:
+                self._init_db()
+                pool.initialized = True
+        return pool
 
     def _get_connection(self) -> sqlite3.Connection:
-        """Tạo kết nối mới đến database."""
-        conn = sqlite3.connect(str(self.db_path))
-        # Bật foreign keys để ON DELETE CASCADE có hiệu lực
-        try:
-            conn.execute("PRAGMA foreign_keys = ON;")
-        except sqlite3.Error:
-            pass
-        return conn
+        """
+        Connection lâu dài của thread hiện tại (từ pool dùng chung).
+        Dùng `with self._get_connection() as conn:` - khối with commit/rollback, không đóng connection.
+        """
+        return self._pool.connection()
+
+    @property
+    def bus(self) -> EventBus:
+        """Bus thay đổi của database này (dùng chung giữa mọi DatabaseManager cùng file)."""
+        return self._pool.bus
+
+    def flush_events(self):
+        """
+        Chờ các event đang xếp hàng được ghi xong. Chỉ gọi khi cần đọc lại đúng event vừa ghi
+        (xuất dữ liệu, bảo trì, trước khi thoát); view Dashboard nhận event mới qua bus "events".
+        """
+        self._pool.event_writer.flush()
+
+    def close(self):
+        """
+        Ghi nốt event đang chờ rồi đóng mọi connection tới database này (gọi khi thoát ứng dụng).
+        Pool bị bỏ khỏi cache: DatabaseManager dùng tiếp file này (kể cả manager đang mở) nhận pool mới.
+        """
+        pool = self._current_pool
+        pool.event_writer.close()
+        pool.close_all()
+        _discard_connection_pool(pool)
 
     def _init_db(self):
         """Khởi tạo các bảng nếu chưa tồn tại."""
@@ -71,7 +707,50 @@ class DatabaseManager:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Phiên bản schema đã áp dụng (migration)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
             conn.commit()
+        self._migrate()
+
+    def get_schema_version(self) -> int:
+        """Version schema hiện tại của database (0 nếu chưa áp dụng migration nào)."""
+        with self._get_connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+    def _migrate(self):
+        """
+        Áp dụng các bước trong MIGRATIONS có version lớn hơn version hiện tại, theo thứ tự.
+        Mỗi bước chạy trong 1 transaction (BEGIN IMMEDIATE) cùng với dòng schema_version của nó,
+        nên database đang chạy được nâng cấp tại chỗ và nhiều process không áp dụng trùng.
+        """
+        conn = self._get_connection()
+        for version, description, steps in MIGRATIONS:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+                if version <= current:
+                    conn.rollback()
+                    continue
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                               (version, description))
+                conn.commit()
+                print(f"[DatabaseManager] Migration {version}: {description}")
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"[DatabaseManager] Migration {version} thất bại: {e}")
+                raise
 
     def add_user(self, user_id: str, fullname: str, email: str = None, 
                  phone: str = None, dob: str = None, avatar_path: str = None) -> bool:
@@ -84,6 +763,7 @@ class DatabaseManager:
                     (user_id, fullname, email, phone, dob, avatar_path)
                 )
                 conn.commit()
+            self._publish_user_added(user_id)
             return True
         except sqlite3.IntegrityError:
             return False
@@ -101,10 +781,54 @@ class DatabaseManager:
                 (user_id, embedding_bytes, pose_type, image_path)
             )
             conn.commit()
-            return cursor.lastrowid
+            embedding_id = cursor.lastrowid
+        self.embedding_store.append([(embedding_id, user_id, embedding_bytes, pose_type)])
+        return embedding_id
 
     def get_user(self, user_id: str) -> dict | None:
-        """Lấy thông tin người dùng theo ID."""
+        """
+        Lấy thông tin người dùng theo ID.
+        Đọc qua cache dùng chung theo file (add/update/enroll/delete trong process cập nhật cache),
+        nên Profile / xác thực không truy vấn lại mỗi lần đăng nhập. Trả về bản copy.
+        Mốc change_markers['users'] chỉ được đọc lại mỗi USER_CACHE_CHECK_INTERVAL giây: bảng users
+        bị sửa ở process khác thì cache được bỏ toàn bộ ở lần kiểm tra kế tiếp.
+        """
+        seq = self._checked_users_seq()
+        cache = self._pool.user_cache
+        with self._pool.user_cache_lock:
+            user = cache.get(user_id)
+            if user is not None:
+                cache.move_to_end(user_id)
+                return dict(user)
+        user = self._load_user(user_id)
+        if user is not None:
+            self._cache_user(user, seq)
+        return user
+
+    def _users_change_seq(self) -> int:
+        with self._get_connection() as conn:
+            return conn.execute("SELECT seq FROM change_markers WHERE name = 'users'").fetchone()[0]
+
+    def _checked_users_seq(self) -> int:
+        """Mốc mà cache đang ứng với; đọc lại từ database (và bỏ cache nếu đã đổi) khi quá chu kỳ kiểm tra."""
+        pool = self._pool
+        now = time.monotonic()
+        with pool.user_cache_lock:
+            if now - pool.user_cache_checked_at < USER_CACHE_CHECK_INTERVAL:
+                return pool.user_cache_seq
+        seq = self._users_change_seq()
+        with pool.user_cache_lock:
+            self._validate_user_cache(seq)
+            pool.user_cache_checked_at = now
+        return seq
+
+    def _validate_user_cache(self, seq: int):
+        """Bỏ cache nếu bảng users đã đổi kể từ lúc cache được nạp (gọi khi giữ user_cache_lock)."""
+        if seq > self._pool.user_cache_seq:
+            self._pool.user_cache.clear()
+            self._pool.user_cache_seq = seq
+
+    def _load_user(self, user_id: str) -> dict | None:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT id, fullname, email, phone, dob, avatar_path, created_at FROM users WHERE id = ?", (user_id,))
@@ -121,6 +845,50 @@ class DatabaseManager:
                 }
         return None
 
+    def _cache_user(self, user: dict, seq: int):
+        """Đưa user (đọc sau khi lấy mốc `seq`) vào cache; bỏ qua nếu cache đã ứng với mốc mới hơn."""
+        cache = self._pool.user_cache
+        with self._pool.user_cache_lock:
+            self._validate_user_cache(seq)
+            if seq != self._pool.user_cache_seq:
+                return
+            cache[user["id"]] = dict(user)
+            cache.move_to_end(user["id"])
+            while len(cache) > USER_CACHE_SIZE:
+                cache.popitem(last=False)
+
+    def update_user(self, user_id: str, **fields) -> bool:
+        """
+        Sửa thông tin user (cột trong USER_FIELDS). Cache được cập nhật và "user_updated" được publish
+        để view đang hiển thị user này (Profile) đổi theo mà không truy vấn lại.
+        """
+        unknown = set(fields) - set(USER_FIELDS)
+        if unknown:
+            raise ValueError(f"Cột user không hợp lệ: {', '.join(sorted(unknown))}")
+        if not fields:
+            return False
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*fields.values(), user_id))
+            conn.commit()
+            updated = cursor.rowcount > 0
+        if updated:
+            self._publish_user("user_updated", user_id)
+        return updated
+
+    def _publish_user_added(self, user_id: str):
+        """Đọc lại hàng vừa commit (lấy created_at), đưa vào cache rồi publish "user_added"."""
+        self._publish_user("user_added", user_id)
+
+    def _publish_user(self, topic: str, user_id: str):
+        """Đọc lại hàng vừa commit, đưa vào cache rồi publish `topic` với dict user."""
+        seq = self._users_change_seq()
+        user = self._load_user(user_id)
+        if user is not None:
+            self._cache_user(user, seq)
+            self._pool.bus.publish(topic, dict(user))
+
     def get_all_embeddings(self) -> list[tuple[str, np.ndarray]]:
         """Lấy tất cả embeddings để so sánh (cho Authentication)."""
         results = []
@@ -133,6 +901,140 @@ class DatabaseManager:
                 results.append((user_id, embedding))
         return results
 
+    def open_embedding_store(self) -> dict | None:
+        """
+        Kiểm tra sidecar store với SQLite rồi memory-map (xem EmbeddingStore.open()).
+        Store thiếu hàng mới được nối tiếp; store lệch (xóa/sửa, thiếu hàng, sai định dạng) được dựng lại.
+        """
+        store = self.embedding_store
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM face_embeddings")
+                count, max_id = cursor.fetchone()
+                change_seq = self._embedding_change_seq(cursor)
+
+                header = store.read_header()
+                if not store.is_consistent(header, max_id, change_seq, count):
+                    caught_up = False
+                    if header is not None and header["change_seq"] == change_seq and header["max_id"] < max_id:
+                        cursor.execute(
+                            "SELECT id, user_id, embedding, pose_type FROM face_embeddings WHERE id > ? ORDER BY id",
+                            (header["max_id"],)
+                        )
+                        # Nối tiếp xong vẫn phải khớp số hàng (hàng thiếu phía dưới max_id cũ -> dựng lại)
+                        caught_up = (store.append(cursor.fetchall())
+                                     and store.is_consistent(store.read_header(), max_id, change_seq, count))
+                    if not caught_up:
+                        cursor.execute("SELECT id, user_id, embedding, pose_type FROM face_embeddings ORDER BY id")
+                        store.rebuild(iter(lambda: cursor.fetchmany(4096), []), change_seq)
+        except (sqlite3.Error, OSError) as e:
+            print(f"[DatabaseManager] Không đồng bộ được embedding store: {e}")
+            return None
+        return store.open()
+
+    def get_embedding_rows(self, after_id: int = 0) -> list[tuple[int, str, np.ndarray, str]]:
+        """
+        Lấy (id, user_id, embedding, pose_type) có id > after_id, theo thứ tự id tăng dần.
+        after_id = 0 lấy toàn bộ; truyền watermark để chỉ lấy các hàng mới (dùng PRIMARY KEY).
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, user_id, embedding, pose_type FROM face_embeddings WHERE id > ? ORDER BY id",
+                (after_id,)
+            )
+            return [
+                (row[0], row[1], np.frombuffer(row[2], dtype=np.float32), row[3])
+                for row in cursor.fetchall()
+            ]
+
+    def get_embedding_rows_by_ids(self, embedding_ids: list[int]) -> list[tuple[int, str, np.ndarray, str]]:
+        """Lấy (id, user_id, embedding, pose_type) theo danh sách id (cho embedding bị sửa)."""
+        if not embedding_ids:
+            return []
+        placeholders = ", ".join("?" * len(embedding_ids))
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, user_id, embedding, pose_type FROM face_embeddings WHERE id IN ({placeholders}) ORDER BY id",
+                list(embedding_ids)
+            )
+            return [
+                (row[0], row[1], np.frombuffer(row[2], dtype=np.float32), row[3])
+                for row in cursor.fetchall()
+            ]
+
+    def get_embedding_changes(self, after_seq: int = 0) -> list[tuple[int, int, str]] | None:
+        """
+        Lấy (seq, embedding_id, op) các thay đổi 'delete'/'update' có seq > after_seq.
+        Trả về None nếu nhật ký đã bị prune qua after_seq (người gọi phải load lại toàn bộ).
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT seq FROM change_markers WHERE name = 'embedding_changes_pruned'")
+            if after_seq < cursor.fetchone()[0]:
+                return None
+            cursor.execute(
+                "SELECT seq, embedding_id, op FROM embedding_changes WHERE seq > ? ORDER BY seq",
+                (after_seq,)
+            )
+            return cursor.fetchall()
+
+    def get_embedding_change_seq(self) -> int:
+        """Seq lớn nhất đã cấp cho nhật ký thay đổi embedding (watermark ban đầu)."""
+        with self._get_connection() as conn:
+            return self._embedding_change_seq(conn.cursor())
+
+    @staticmethod
+    def _embedding_change_seq(cursor: sqlite3.Cursor) -> int:
+        # Đọc từ sqlite_sequence thay vì MAX(seq): vẫn đúng sau khi prune xóa hết nhật ký
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'embedding_changes'")
+        return cursor.fetchone()[0]
+
+    def prune_embedding_changes(self, up_to_seq: int) -> int:
+        """
+        Xóa các hàng nhật ký có seq <= up_to_seq (watermark nhỏ nhất mà các Authenticator đã sync qua)
+        và dời mốc prune. Authenticator có watermark thấp hơn mốc sẽ load lại toàn bộ thay vì mất delta.
+        Trả về số hàng đã xóa.
+        """
+        if up_to_seq <= 0:
+            return 0
+        with self._get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE change_markers SET seq = MAX(seq, ?) WHERE name = 'embedding_changes_pruned'",
+                (up_to_seq,)
+            )
+            pruned = conn.execute("DELETE FROM embedding_changes WHERE seq <= ?", (up_to_seq,)).rowcount
+        if pruned:
+            print(f"[DatabaseManager] Pruned {pruned} embedding changes (seq <= {up_to_seq})")
+        return pruned
+
+    def update_embedding(self, embedding_id: int, embedding: np.ndarray) -> bool:
+        """Thay embedding của 1 hàng (vd. chụp lại 1 pose)."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE face_embeddings SET embedding = ? WHERE id = ?",
+                (embedding.astype(np.float32).tobytes(), embedding_id)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def delete_user(self, user_id: str) -> bool:
+        """Xóa user; embeddings bị xóa theo ON DELETE CASCADE."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            conn.commit()
+            deleted = cursor.rowcount > 0
+        with self._pool.user_cache_lock:
+            self._pool.user_cache.pop(user_id, None)
+        if deleted:
+            self._pool.bus.publish("user_deleted", user_id)
+        return deleted
+
     def user_exists(self, user_id: str) -> bool:
         """Kiểm tra user ID đã tồn tại chưa."""
         with self._get_connection() as conn:
@@ -174,6 +1076,7 @@ class DatabaseManager:
         - Thêm embeddings sau
         """
         try:
+            store_rows = []
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
@@ -181,13 +1084,18 @@ class DatabaseManager:
                     (user_id, fullname, email, phone, dob, avatar_path),
                 )
                 for embedding, pose_type, image_path in embeddings_data:
+                    embedding_bytes = embedding.tobytes()
                     cursor.execute(
                         """INSERT INTO face_embeddings
                            (user_id, embedding, pose_type, image_path)
                            VALUES (?, ?, ?, ?)""",
-                        (user_id, embedding.tobytes(), pose_type, image_path),
+                        (user_id, embedding_bytes, pose_type, image_path),
                     )
+                    store_rows.append((cursor.lastrowid, user_id, embedding_bytes, pose_type))
                 conn.commit()
+            # Nối vào sidecar store sau khi commit (lỗi ở đây chỉ làm store cũ, sẽ rebuild khi mở)
+            self.embedding_store.append(store_rows)
+            self._publish_user_added(user_id)
             return True
         except sqlite3.IntegrityError:
             return False
@@ -198,21 +1106,38 @@ class DatabaseManager:
     # ========== Events (Logs) Methods ==========
     
     def add_event(self, event_type: str, user_id: str = None, result: str = "success", 
-                  score: float = None, details: str = None) -> int:
+                  score: float = None, details: str = None, **fields) -> bool:
         """
-        Ghi một event vào bảng logs.
+        Ghi một event vào bảng logs (bất đồng bộ qua EventWriter, không chặn UI thread).
         event_type: 'enroll', 'auth', 'auth_fail', 'logout'
         result: 'success', 'fail', 'cancelled'
+        fields: cột có kiểu trong EVENT_FIELDS (fail_count, liveness_status, spoof_reason, distance,
+            latency_ms, session_id) - dùng thay cho việc nhét số liệu vào details
+        created_at lấy tại thời điểm gọi (UTC, cùng định dạng CURRENT_TIMESTAMP), không phải lúc ghi.
+
+        Returns:
+            True nếu event đã vào hàng đợi, False nếu bị bỏ (hàng đợi đầy quá EVENT_PUT_TIMEOUT giây).
+            Id event chưa có lúc trả về: cần id thì nghe bus "events" hoặc flush_events() rồi đọc lại.
         """
+        unknown = set(fields) - set(EVENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Cột event không hợp lệ: {', '.join(sorted(unknown))}")
+        created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        row = (event_type, user_id, result, score, details, created_at,
+               *(fields.get(name) for name in EVENT_FIELDS))
+        return self._pool.event_writer.put(row)
+
+    def get_recent_auth_users(self, limit: int = 256) -> list[str]:
+        """Lấy user_id đã xác thực thành công gần đây nhất (không trùng, mới nhất trước)."""
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                """INSERT INTO events (event_type, user_id, result, score, details)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (event_type, user_id, result, score, details)
+                """SELECT user_id, MAX(id) AS last_id FROM events
+                   WHERE event_type = 'auth' AND result = 'success' AND user_id IS NOT NULL
+                   GROUP BY user_id ORDER BY last_id DESC LIMIT ?""",
+                (limit,)
             )
-            conn.commit()
-            return cursor.lastrowid
+            return [row[0] for row in cursor.fetchall()]
 
     def get_events(self, limit: int = 50, event_type: str = None) -> list[dict]:
         """Lấy danh sách events gần nhất (cho Dashboard logs)."""
@@ -220,67 +1145,400 @@ class DatabaseManager:
             cursor = conn.cursor()
             if event_type:
                 cursor.execute(
-                    """SELECT id, event_type, user_id, result, score, details, created_at 
-                       FROM events WHERE event_type = ? ORDER BY created_at DESC LIMIT ?""",
+                    f"""SELECT {EVENT_COLUMNS_SQL}
+                        FROM events WHERE event_type = ? ORDER BY created_at DESC LIMIT ?""",
                     (event_type, limit)
                 )
             else:
                 cursor.execute(
-                    """SELECT id, event_type, user_id, result, score, details, created_at 
-                       FROM events ORDER BY created_at DESC LIMIT ?""",
+                    f"""SELECT {EVENT_COLUMNS_SQL}
+                        FROM events ORDER BY created_at DESC LIMIT ?""",
                     (limit,)
                 )
-            rows = cursor.fetchall()
-            return [
-                {
-                    "id": row[0],
-                    "event_type": row[1],
-                    "user_id": row[2],
-                    "result": row[3],
-                    "score": row[4],
-                    "details": row[5],
-                    "created_at": row[6]
-                }
-                for row in rows
-            ]
+            return [EventRow._make(row)._asdict() for row in cursor.fetchall()]
+
+    def get_events_page(self, before_id: int | None = None, page_size: int = PAGE_SIZE,
+                        event_type: str = None, user_id: str = None,
+                        result: str = None) -> list[EventRow]:
+        """
+        1 trang events mới nhất trước, có id < before_id (keyset, không dùng OFFSET):
+        chi phí mỗi trang như nhau dù đang ở đầu hay cuối bảng.
+        Trang tiếp theo: before_id = id của hàng cuối trang hiện tại.
+        """
+        conditions, params = [], []
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        for column, value in (("event_type", event_type), ("user_id", user_id), ("result", result)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._get_connection() as conn:
+            cursor = conn.execute(
+                f"SELECT {EVENT_COLUMNS_SQL} FROM events {where} ORDER BY id DESC LIMIT ?",
+                (*params, page_size)
+            )
+            return [EventRow._make(row) for row in cursor.fetchall()]
+
+    def get_events_after(self, after_id: int, page_size: int = PAGE_SIZE) -> list[EventRow]:
+        """Các event có id > after_id, cũ nhất trước (lấy phần mới phát sinh kể từ lần đọc trước)."""
+        with self._get_connection() as conn:
+            cursor = conn.execute(
+                f"SELECT {EVENT_COLUMNS_SQL} FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, page_size)
+            )
+            return [EventRow._make(row) for row in cursor.fetchall()]
+
+    def iter_events(self, before_id: int | None = None, page_size: int = PAGE_SIZE,
+                    event_type: str = None, user_id: str = None,
+                    result: str = None) -> Iterator[EventRow]:
+        """
+        Duyệt events (mới nhất trước) theo từng trang, bộ nhớ cố định 1 trang.
+        Mỗi trang là 1 truy vấn riêng, không giữ transaction đọc mở giữa các trang.
+        """
+        while True:
+            page = self.get_events_page(before_id, page_size, event_type, user_id, result)
+            yield from page
+            if len(page) < page_size:
+                return
+            before_id = page[-1].id
+
+    def iter_users(self, after_created_at: str | None = None,
+                   page_size: int = PAGE_SIZE) -> Iterator[UserRow]:
+        """
+        Duyệt users theo thứ tự đăng ký (created_at, id) tăng dần, từng trang keyset.
+        after_created_at: chỉ lấy user đăng ký sau thời điểm này ('YYYY-MM-DD HH:MM:SS').
+        """
+        columns = "id, fullname, email, phone, dob, avatar_path, created_at"
+        last_key = None
+        while True:
+            with self._get_connection() as conn:
+                if last_key is not None:
+                    cursor = conn.execute(
+                        f"""SELECT {columns} FROM users WHERE (created_at, id) > (?, ?)
+                            ORDER BY created_at, id LIMIT ?""",
+                        (*last_key, page_size)
+                    )
+                elif after_created_at is not None:
+                    cursor = conn.execute(
+                        f"SELECT {columns} FROM users WHERE created_at > ? ORDER BY created_at, id LIMIT ?",
+                        (after_created_at, page_size)
+                    )
+                else:
+                    cursor = conn.execute(
+                        f"SELECT {columns} FROM users ORDER BY created_at, id LIMIT ?", (page_size,)
+                    )
+                page = [UserRow._make(row) for row in cursor.fetchall()]
+            yield from page
+            if len(page) < page_size:
+                return
+            last_key = (page[-1].created_at, page[-1].id)
 
     def get_stats(self) -> dict:
-        """Lấy thống kê tổng quan cho Dashboard."""
+        """
+        Lấy thống kê tổng quan cho Dashboard.
+        Đọc từ stats_counters (trigger cập nhật khi ghi users/events): 1 truy vấn theo khóa chính,
+        không phụ thuộc kích thước bảng events.
+        "last_event_id" là id event lớn nhất đã tính trong các số trên (cùng snapshot), "day" là ngày UTC
+        của auth_today: view cộng tiếp các event từ bus có id lớn hơn mà không đếm trùng.
+        """
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Tổng số users
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            # Tổng số enroll events
-            cursor.execute("SELECT COUNT(*) FROM events WHERE event_type = 'enroll'")
-            total_enrolls = cursor.fetchone()[0]
-            
-            # Tổng số auth events (thành công)
-            cursor.execute("SELECT COUNT(*) FROM events WHERE event_type = 'auth' AND result = 'success'")
-            total_auth_success = cursor.fetchone()[0]
-            
-            # Tổng số auth events (thất bại)
-            cursor.execute("SELECT COUNT(*) FROM events WHERE event_type = 'auth_fail'")
-            total_auth_fail = cursor.fetchone()[0]
-            
-            # Auth hôm nay
-            cursor.execute("""
-                SELECT COUNT(*) FROM events 
-                WHERE event_type = 'auth' AND result = 'success'
-                AND date(created_at) = date('now')
-            """)
-            auth_today = cursor.fetchone()[0]
-            
+            cursor.execute(
+                """SELECT name, day, value FROM stats_counters
+                   WHERE name IN ('users', 'enroll', 'auth_success', 'auth_fail') AND day IN ('', date('now'))
+                   UNION ALL
+                   SELECT 'last_event_id', date('now'), COALESCE(MAX(id), 0) FROM events"""
+            )
+            totals, today, last_event_id, current_day = {}, {}, 0, None
+            for name, day, value in cursor.fetchall():
+                if name == "last_event_id":
+                    last_event_id, current_day = value, day
+                else:
+                    (today if day else totals)[name] = value
             return {
-                "total_users": total_users,
-                "total_enrolls": total_enrolls,
-                "total_auth_success": total_auth_success,
-                "total_auth_fail": total_auth_fail,
-                "auth_today": auth_today
+                "total_users": totals.get("users", 0),
+                "total_enrolls": totals.get("enroll", 0),
+                "total_auth_success": totals.get("auth_success", 0),
+                "total_auth_fail": totals.get("auth_fail", 0),
+                "auth_today": today.get("auth_success", 0),
+                "last_event_id": last_event_id,
+                "day": current_day
             }
 
+    def update_rollups(self) -> int:
+        """
+        Gộp các event mới (id > high-water mark) vào event_rollups / user_attendance.
+        Mỗi lần tối đa ROLLUP_BATCH event trong 1 transaction cùng với việc dời high-water mark,
+        nên rollup luôn khớp đúng tập event đã đếm. Trả về số event đã gộp.
+        """
+        conn = self._get_connection()
+        total = 0
+        while True:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                last_id = conn.execute(
+                    "SELECT last_event_id FROM rollup_state WHERE name = 'events'"
+                ).fetchone()[0]
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+                if max_id <= last_id:
+                    return total
+                upto = min(max_id, last_id + ROLLUP_BATCH)
+                for granularity, bucket_format in ROLLUP_FORMATS.items():
+                    conn.execute(
+                        """INSERT INTO event_rollups (granularity, bucket, auth_success, auth_fail, spoof, enroll,
+                                                      distance_sum, distance_count)
+                           SELECT ?, strftime(?, created_at),
+                                  SUM(event_type = 'auth' AND result = 'success'),
+                                  SUM(event_type = 'auth_fail'),
+                                  SUM(event_type = 'auth_fail' AND spoof_reason IS NOT NULL),
+                                  SUM(event_type = 'enroll'),
+                                  COALESCE(SUM(distance), 0), COUNT(distance)
+                           FROM events WHERE id > ? AND id <= ? GROUP BY 2
+                           ON CONFLICT(granularity, bucket) DO UPDATE SET
+                               auth_success = auth_success + excluded.auth_success,
+                               auth_fail = auth_fail + excluded.auth_fail,
+                               spoof = spoof + excluded.spoof,
+                               enroll = enroll + excluded.enroll,
+                               distance_sum = distance_sum + excluded.distance_sum,
+                               distance_count = distance_count + excluded.distance_count""",
+                        (granularity, bucket_format, last_id, upto)
+                    )
+                conn.execute(
+                    """INSERT INTO user_attendance (user_id, day, first_seen, last_seen, auth_count)
+                       SELECT user_id, date(created_at), MIN(created_at), MAX(created_at), COUNT(*)
+                       FROM events
+                       WHERE id > ? AND id <= ? AND event_type = 'auth' AND result = 'success'
+                             AND user_id IS NOT NULL
+                       GROUP BY 1, 2
+                       ON CONFLICT(user_id, day) DO UPDATE SET
+                           first_seen = MIN(first_seen, excluded.first_seen),
+                           last_seen = MAX(last_seen, excluded.last_seen),
+                           auth_count = auth_count + excluded.auth_count""",
+                    (last_id, upto)
+                )
+                conn.execute("UPDATE rollup_state SET last_event_id = ? WHERE name = 'events'", (upto,))
+                total += upto - last_id
+
+    def get_rollups(self, start: str, end: str, granularity: str = "hour") -> list[RollupPoint]:
+        """
+        Các bucket trong [start, end) (UTC, 'YYYY-MM-DD HH:MM:SS'), cũ nhất trước.
+        Bucket không có event nào thì không có hàng. Gộp event mới vào rollup trước khi đọc.
+        """
+        return self.get_rollup_snapshot(start, end, granularity)[0]
+
+    def get_rollup_snapshot(self, start: str, end: str,
+                            granularity: str = "hour") -> tuple[list[RollupPoint], int]:
+        """
+        Như get_rollups, kèm id event lớn nhất đã gộp vào các bucket (đọc cùng 1 snapshot),
+        để view cộng tiếp các event từ bus có id lớn hơn mà không đếm trùng.
+        """
+        if granularity not in ROLLUP_FORMATS:
+            raise ValueError(f"Độ chi tiết không hợp lệ: {granularity} (hỗ trợ: {', '.join(ROLLUP_FORMATS)})")
+        self.update_rollups()
+        with self._get_connection() as conn:
+            # Transaction đọc: 2 truy vấn thấy cùng 1 snapshot WAL
+            conn.execute("BEGIN")
+            mark = conn.execute("SELECT last_event_id FROM rollup_state WHERE name = 'events'").fetchone()[0]
+            cursor = conn.execute(
+                """SELECT bucket, auth_success, auth_fail, spoof, enroll,
+                          CASE WHEN distance_count > 0 THEN distance_sum / distance_count END
+                   FROM event_rollups WHERE granularity = ? AND bucket >= ? AND bucket < ?
+                   ORDER BY bucket""",
+                (granularity, start, end)
+            )
+            return [RollupPoint._make(row) for row in cursor.fetchall()], mark
+
+    def get_attendance(self, start_day: str, end_day: str, user_id: str = None) -> list[AttendanceRow]:
+        """Điểm danh (lần thấy đầu / cuối mỗi ngày) trong [start_day, end_day] ('YYYY-MM-DD')."""
+        self.update_rollups()
+        with self._get_connection() as conn:
+            if user_id:
+                cursor = conn.execute(
+                    """SELECT user_id, day, first_seen, last_seen, auth_count FROM user_attendance
+                       WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day""",
+                    (user_id, start_day, end_day)
+                )
+            else:
+                cursor = conn.execute(
+                    """SELECT user_id, day, first_seen, last_seen, auth_count FROM user_attendance
+                       WHERE day BETWEEN ? AND ? ORDER BY day, first_seen""",
+                    (start_day, end_day)
+                )
+            return [AttendanceRow._make(row) for row in cursor.fetchall()]
+
+    def archive_events(self, retention_days: int = RETENTION_DAYS, batch_size: int = ARCHIVE_BATCH) -> int:
+        """
+        Chuyển event cũ hơn retention_days ngày sang file archive theo tháng, từng batch theo id:
+        ATTACH file tháng -> INSERT ... SELECT -> DELETE trong 1 transaction (tối đa batch_size hàng).
+        Chỉ chuyển event đã gộp vào rollup (rollup / stats_counters giữ nguyên), sau đó incremental vacuum.
+        Trả về số event đã chuyển.
+        """
+        self.update_rollups()
+        conn = self._get_connection()
+        cutoff = conn.execute("SELECT datetime('now', ?)", (f"-{retention_days} days",)).fetchone()[0]
+        moved = 0
+        while True:
+            mark, rolled = conn.execute(
+                """SELECT (SELECT last_event_id FROM rollup_state WHERE name = 'archive'),
+                          (SELECT last_event_id FROM rollup_state WHERE name = 'events')"""
+            ).fetchone()
+            first = conn.execute(
+                "SELECT id, created_at, strftime('%Y_%m', created_at) FROM events WHERE id > ? ORDER BY id LIMIT 1",
+                (mark,)
+            ).fetchone()
+            if first is None or first[0] > rolled or first[1] >= cutoff:
+                break
+            month = first[2]
+            # Đoạn id liên tục sau mốc: tối đa batch_size hàng, cùng tháng, cũ hơn cutoff, đã rollup
+            limit_row = conn.execute(
+                "SELECT id FROM events WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?", (mark, batch_size - 1)
+            ).fetchone()
+            upper = min(rolled, limit_row[0]) if limit_row else rolled
+            stop_id = conn.execute(
+                """SELECT MIN(id) FROM events WHERE id > ? AND id <= ?
+                   AND (created_at >= ? OR strftime('%Y_%m', created_at) != ?)""",
+                (mark, upper, cutoff, month)
+            ).fetchone()[0]
+            upto = stop_id - 1 if stop_id is not None else upper
+
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+            conn.execute("ATTACH DATABASE ? AS archive", (str(self.archive_dir / f"events_{month}.db"),))
+            try:
+                conn.execute(ARCHIVE_EVENTS_SQL)
+                conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_events_created ON events(created_at)")
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    current = conn.execute(
+                        "SELECT last_event_id FROM rollup_state WHERE name = 'archive'"
+                    ).fetchone()[0]
+                    if current != mark:
+                        continue  # Process khác vừa archive, tính lại đoạn
+                    # INSERT OR IGNORE: commit giữa 2 file không nguyên tử, chạy lại sau sự cố vẫn đúng
+                    conn.execute(
+                        f"""INSERT OR IGNORE INTO archive.events ({EVENT_COLUMNS_SQL})
+                            SELECT {EVENT_COLUMNS_SQL} FROM main.events WHERE id > ? AND id <= ?""",
+                        (mark, upto)
+                    )
+                    # Dời mốc trước khi xóa để trigger không trừ stats_counters
+                    conn.execute("UPDATE rollup_state SET last_event_id = ? WHERE name = 'archive'", (upto,))
+                    moved += conn.execute("DELETE FROM main.events WHERE id > ? AND id <= ?", (mark, upto)).rowcount
+            finally:
+                conn.execute("DETACH DATABASE archive")
+        if moved:
+            print(f"[DatabaseManager] Archived {moved} events older than {cutoff}")
+            self._incremental_vacuum(conn)
+        return moved
+
+    def _incremental_vacuum(self, conn: sqlite3.Connection):
+        """
+        Trả các trang trống về hệ điều hành. Database cũ (auto_vacuum=NONE) bị bỏ qua: chuyển đổi cần
+        VACUUM toàn bộ file và khóa ghi suốt thời gian chạy, chỉ làm qua enable_incremental_vacuum().
+        """
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # 2 = INCREMENTAL
+                print("[DatabaseManager] Vacuum bỏ qua: database chưa bật auto_vacuum=INCREMENTAL "
+                      "(chạy 1 lần: python -m modules.database --enable-incremental-vacuum)")
+                return
+            conn.execute("PRAGMA incremental_vacuum")
+        except sqlite3.Error as e:
+            print(f"[DatabaseManager] Vacuum bỏ qua: {e}")
+
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Chuyển database cũ sang auto_vacuum=INCREMENTAL (thao tác quản trị, chạy 1 lần khi ứng dụng đã tắt):
+        VACUUM ghi lại toàn bộ file và chặn mọi writer cho tới khi xong.
+        Trả về True nếu đã chuyển, False nếu database đã ở chế độ INCREMENTAL.
+        """
+        self.flush_events()
+        conn = self._get_connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        print(f"[DatabaseManager] VACUUM {self.db_path} để bật auto_vacuum=INCREMENTAL...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    def iter_events_between(self, start: str, end: str, event_type: str = None,
+                            include_archive: bool = True, page_size: int = PAGE_SIZE) -> Iterator[EventRow]:
+        """
+        Events có created_at trong [start, end) theo thời gian tăng dần, gồm cả file archive theo tháng
+        (mở chỉ đọc, lần lượt từng file) rồi tới database chính. Đọc từng trang keyset (created_at, id).
+        """
+        self.flush_events()
+        if include_archive and self.archive_dir.exists():
+            for path in sorted(self.archive_dir.glob("events_*.db")):
+                month = path.stem[len("events_"):].replace("_", "-")
+                if not start[:7] <= month <= end[:7]:
+                    continue
+                archive = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+                try:
+                    yield from self._iter_event_range(archive, start, end, event_type, page_size)
+                finally:
+                    archive.close()
+        yield from self._iter_event_range(self._get_connection(), start, end, event_type, page_size)
+
+    @staticmethod
+    def _iter_event_range(conn: sqlite3.Connection, start: str, end: str, event_type: str | None,
+                          page_size: int) -> Iterator[EventRow]:
+        type_filter, params = ("AND event_type = ?", [event_type]) if event_type else ("", [])
+        key = (start, -1)
+        while True:
+            rows = conn.execute(
+                f"""SELECT {EVENT_COLUMNS_SQL} FROM events
+                    WHERE (created_at, id) > (?, ?) AND created_at < ? {type_filter}
+                    ORDER BY created_at, id LIMIT ?""",
+                (*key, end, *params, page_size)
+            ).fetchall()
+            page = [EventRow._make(row) for row in rows]
+            yield from page
+            if len(page) < page_size:
+                return
+            key = (page[-1].created_at, page[-1].id)
+
+    def backfill_event_columns(self) -> int:
+        """Điền cột có kiểu (fail_count) cho event cũ chỉ ghi số liệu trong details."""
+        self.flush_events()
+        with self._get_connection() as conn:
+            updated = _backfill_event_columns(conn.cursor())
+        print(f"[DatabaseManager] Backfilled {updated} events")
+        return updated
+
+    def rebuild_stats_counters(self):
+        """
+        Tính lại stats_counters từ toàn bộ lịch sử (khi bộ đếm lệch, vd. sửa tay database).
+        Bộ đếm của các file archive (chỉ hàng id <= mốc 'archive') được cộng trước, rồi thay toàn bộ
+        stats_counters trong 1 transaction: người đọc không bao giờ thấy bộ đếm tính dở.
+        """
+        self.flush_events()
+        conn = self._get_connection()
+        mark_sql = "SELECT last_event_id FROM rollup_state WHERE name = 'archive'"
+        while True:
+            mark = conn.execute(mark_sql).fetchone()[0]
+            archived: dict[tuple[str, str], int] = {}
+            for path in sorted(self.archive_dir.glob("events_*.db")):
+                conn.execute("ATTACH DATABASE ? AS archive", (str(path),))
+                try:
+                    for name, day, value in _event_counters(conn.cursor(), "archive.events", mark):
+                        archived[name, day] = archived.get((name, day), 0) + value
+                finally:
+                    conn.execute("DETACH DATABASE archive")
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                # archive_events() chạy xen giữa -> mốc đã dời, tổng archive không còn khớp: tính lại
+                if conn.execute(mark_sql).fetchone()[0] != mark:
+                    continue
+                cursor = conn.cursor()
+                _rebuild_stats_counters(cursor)
+                cursor.executemany(
+                    """INSERT INTO stats_counters (name, day, value) VALUES (?, ?, ?)
+                       ON CONFLICT(name, day) DO UPDATE SET value = value + excluded.value""",
+                    [(name, day, value) for (name, day), value in archived.items()]
+                )
+            break
+        print("[DatabaseManager] Rebuilt stats counters")
+
     def get_all_users(self) -> list[dict]:
         """Lấy danh sách tất cả users."""
         with self._get_connection() as conn:
@@ -299,3 +1557,32 @@ class DatabaseManager:
                 }
                 for row in rows
             ]
+
+
+# Công cụ bảo trì standalone
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bảo trì database Face Recognition")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--rebuild-stats", action="store_true", help="Tính lại stats_counters từ lịch sử")
+    parser.add_argument("--backfill-events", action="store_true",
+                        help="Điền lại cột có kiểu của events từ chuỗi details")
+    parser.add_argument("--archive", action="store_true", help="Chuyển event cũ sang file archive theo tháng")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="VACUUM 1 lần để database cũ dùng auto_vacuum=INCREMENTAL (tắt ứng dụng trước)")
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.db)
+    if args.rebuild_stats:
+        db.rebuild_stats_counters()
+    if args.backfill_events:
+        db.backfill_event_columns()
+    if args.archive:
+        db.archive_events(args.retention_days)
+    if args.enable_incremental_vacuum:
+        db.enable_incremental_vacuum()
+    print(f"Schema version: {db.get_schema_version()}")
+    print(db.get_stats())
+    db.close()
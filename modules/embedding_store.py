@@ -0,0 +1,299 @@
+"""
+Module Embedding Store - Bản sao dạng cột (sidecar) của bảng face_embeddings để memory-map.
+SQLite vẫn là nguồn dữ liệu gốc; store chỉ giúp Authenticator khởi động tức thì.
+Tên file có tiền tố <name>-<model>-<dim>-<storage> (vd. faces-embeddings-buffalo_l-512-int8), nên các
+DatabaseManager khác kiểu lưu / model không dùng chung file. Mỗi lần rebuild ghi 1 thế hệ (generation) mới:
+- <prefix>.<gen>.f32   : ma trận (N, D) float32 đã chuẩn hóa L2
+- <prefix>.<gen>.ids   : id embedding (int64), tăng dần
+- <prefix>.<gen>.codes : mã user (int32) của từng hàng
+- <prefix>.<gen>.pose  : mã pose (int8, theo POSE_BUCKETS, -1 = không rõ) của từng hàng
+- <prefix>.<gen>.users : user_id theo mã, mỗi dòng 1 user
+- <prefix>.<gen>.q     : bản lượng tử (float16 / int8) khi storage khác float32
+- <prefix>.<gen>.scale : scale float32 từng hàng (chỉ int8)
+- <prefix>.json        : header (version, dim, dtype, model, storage, generation, count, max_id, n_users, change_seq)
+Header được ghi sau cùng (atomic), nên dữ liệu thừa phía sau `count` luôn bị bỏ qua.
+Rebuild không ghi đè file của thế hệ đang được memory-map (Windows không cho thay file đang map):
+reader chuyển sang thế hệ mới ở lần sync() sau, file thế hệ cũ được xóa khi không còn ai map.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from modules.vector_index import STORAGE_MODES, quantize_rows
+
+STORE_VERSION = 3
+STORE_DTYPE = "float32"
+
+# Các nhóm pose lúc enrollment (face_embeddings.pose_type, không phân biệt hoa thường)
+POSE_BUCKETS = ("frontal", "left", "right", "up", "down")
+_POSE_CODES = {name: code for code, name in enumerate(POSE_BUCKETS)}
+
+# Khóa theo thư mục store: nhiều DatabaseManager trong cùng process dùng chung file
+_store_locks: dict[str, threading.Lock] = {}
+_store_locks_guard = threading.Lock()
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa L2 từng hàng, trả về float32 liền khối."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / (norms + 1e-8)
+
+
+def pose_code(pose_type: str | None) -> int:
+    """Mã pose của 1 giá trị pose_type ("Frontal", "left", ...); -1 nếu không thuộc POSE_BUCKETS."""
+    return _POSE_CODES.get((pose_type or "").lower(), -1)
+
+
+class EmbeddingStore:
+    """Đọc/ghi sidecar store cạnh database."""
+
+    def __init__(self, directory: Path, dim: int = 512, model: str = "buffalo_l",
+                 name: str = "embeddings", storage: str = "float32"):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Kiểu lưu không hợp lệ: {storage} (hỗ trợ: {', '.join(STORAGE_MODES)})")
+        self.directory = Path(directory)
+        self.dim = dim
+        self.model = model
+        self.storage = storage
+        self.prefix = f"{name}-{model}-{dim}-{storage}"
+        self.header_path = self.directory / f"{self.prefix}.json"
+        key = str(self.directory.resolve() / self.prefix)
+        with _store_locks_guard:
+            self.lock = _store_locks.setdefault(key, threading.Lock())
+
+    def read_header(self) -> dict | None:
+        """Đọc header; None nếu chưa có hoặc không khớp định dạng (dim/dtype/model/storage/version)."""
+        try:
+            header = json.loads(self.header_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        expected = {"version": STORE_VERSION, "dim": self.dim, "dtype": STORE_DTYPE,
+                    "model": self.model, "storage": self.storage}
+        if any(header.get(key) != value for key, value in expected.items()):
+            return None
+        return header
+
+    def is_consistent(self, header: dict | None, max_id: int, change_seq: int, count: int) -> bool:
+        """
+        Store khớp với database: cùng id lớn nhất, cùng seq nhật ký xóa/sửa và cùng số hàng.
+        So số hàng để phát hiện hàng bị thiếu phía dưới max_id (vd. crash giữa commit SQLite và append(),
+        sau đó writer khác nối tiếp id lớn hơn).
+        """
+        return (header is not None and header["max_id"] == max_id
+                and header["change_seq"] == change_seq and header["count"] == count)
+
+    def open(self, load_users: bool = True) -> dict | None:
+        """
+        Memory-map store (chỉ đọc). Thời gian mở không phụ thuộc số hàng (trừ danh sách user).
+
+        Returns:
+            dict: {"vectors", "ids", "codes", "poses", "quantized", "scales", "user_ids", "count", "max_id",
+                   "change_seq", "generation"}
+            ("quantized"/"scales" là None nếu storage không có) hoặc None nếu store chưa tồn tại / không hợp lệ
+        """
+        header = self.read_header()
+        if header is None:
+            return None
+        count, generation = header["count"], header["generation"]
+        try:
+            vectors = self._map(self._path(generation, "f32"), np.float32, count, self.dim)
+            ids = self._map(self._path(generation, "ids"), np.int64, count)
+            codes = self._map(self._path(generation, "codes"), np.int32, count)
+            poses = self._map(self._path(generation, "pose"), np.int8, count)
+            quantized = scales = None
+            if self.storage != "float32":
+                quantized = self._map(self._path(generation, "q"), self._quantized_dtype, count, self.dim)
+            if self.storage == "int8":
+                scales = self._map(self._path(generation, "scale"), np.float32, count)
+            user_ids = None
+            if load_users:
+                with open(self._path(generation, "users"), encoding="utf-8") as f:
+                    user_ids = f.read().split("\n")[:header["n_users"]]
+                if len(user_ids) != header["n_users"]:
+                    return None
+        except (OSError, ValueError) as e:
+            print(f"[EmbeddingStore] Không mở được store: {e}")
+            return None
+        return {
+            "vectors": vectors,
+            "ids": ids,
+            "codes": codes,
+            "poses": poses,
+            "quantized": quantized,
+            "scales": scales,
+            "user_ids": user_ids,
+            "count": count,
+            "max_id": header["max_id"],
+            "change_seq": header["change_seq"],
+            "generation": generation,
+        }
+
+    def rebuild(self, row_chunks, change_seq: int):
+        """
+        Ghi lại toàn bộ store từ các chunk [(id, user_id, embedding_bytes, pose_type), ...] theo id tăng dần.
+        Đọc theo chunk để không giữ N tuple trong bộ nhớ cùng lúc.
+        Ghi vào thế hệ mới rồi mới đổi header: memmap đang mở (process này hoặc process khác) vẫn đọc
+        thế hệ cũ, không file nào đang được map bị thay thế.
+        """
+        with self.lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            user_index: dict[str, int] = {}
+            count, max_id = 0, 0
+            generation = self._next_generation()
+            files = [open(path, "wb") for path in self._column_paths(generation)]
+            try:
+                for rows in row_chunks:
+                    if not rows:
+                        continue
+                    for f, data in zip(files, self._encode_rows(rows, user_index)):
+                        f.write(data.tobytes())
+                    count += len(rows)
+                    max_id = int(rows[-1][0])
+            finally:
+                for f in files:
+                    f.close()
+            self._path(generation, "users").write_text("\n".join(user_index), encoding="utf-8")
+            self._write_header(generation, count, max_id, len(user_index), change_seq)
+            self.remove_stale_generations()
+        print(f"[EmbeddingStore] Rebuilt store with {count} rows (generation {generation})")
+
+    def remove_stale_generations(self):
+        """
+        Xóa file của các thế hệ khác thế hệ hiện tại. File còn được map (Windows) thì để lại,
+        lần rebuild / sync sau thử xóa tiếp.
+        """
+        header = self.read_header()
+        current = header["generation"] if header is not None else None
+        for generation, path in self._generation_files():
+            if generation == current:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _generation_files(self) -> list[tuple[int, Path]]:
+        files = []
+        for path in self.directory.glob(f"{self.prefix}.*.*"):
+            generation = path.name[len(self.prefix) + 1:].split(".", 1)[0]
+            if generation.isdigit():
+                files.append((int(generation), path))
+        return files
+
+    def _next_generation(self) -> int:
+        """Lớn hơn mọi thế hệ còn file trên đĩa (kể cả thế hệ cũ chưa xóa được)."""
+        header = self.read_header()
+        generations = [generation for generation, _ in self._generation_files()]
+        if header is not None:
+            generations.append(header["generation"])
+        return max(generations, default=0) + 1
+
+    def append(self, rows: list[tuple[int, str, bytes, str]]) -> bool:
+        """
+        Nối các hàng mới (id lớn hơn max_id hiện tại) vào cuối store.
+        Trả về False nếu store không tồn tại / không nối tiếp được (sẽ rebuild ở lần mở sau).
+        """
+        if not rows:
+            return True
+        with self.lock:
+            header = self.read_header()
+            if header is None:
+                return False
+            generation = header["generation"]
+            if rows[0][0] <= header["max_id"]:
+                # Hàng chèn lệch thứ tự (vd. 2 tiến trình cùng enroll) -> đánh dấu cũ để rebuild
+                self._write_header(generation, header["count"], header["max_id"], header["n_users"], -1)
+                return False
+            users_path = self._path(generation, "users")
+            try:
+                with open(users_path, encoding="utf-8") as f:
+                    users = f.read().split("\n")[:header["n_users"]]
+                user_index = {uid: code for code, uid in enumerate(users)}
+                n_users = len(user_index)
+                arrays = self._encode_rows(rows, user_index)
+
+                count = header["count"]
+                for path, data in zip(self._column_paths(generation), arrays):
+                    # Mỗi file có kích thước hàng cố định -> offset = count * bytes/hàng
+                    self._write_at(path, count * (data.nbytes // len(rows)), data.tobytes())
+                if len(user_index) > n_users:
+                    new_users = list(user_index)[n_users:]
+                    prefix = "\n" if n_users else ""
+                    self._write_at(users_path, self._users_bytes(users),
+                                   (prefix + "\n".join(new_users)).encode("utf-8"))
+                self._write_header(generation, count + len(rows), int(rows[-1][0]), len(user_index),
+                                   header["change_seq"])
+            except OSError as e:
+                print(f"[EmbeddingStore] Không ghi được store: {e}")
+                return False
+        return True
+
+    @property
+    def _quantized_dtype(self):
+        return np.float16 if self.storage == "float16" else np.int8
+
+    def _map(self, path: Path, dtype, count: int, dim: int | None = None) -> np.ndarray:
+        shape = (count,) if dim is None else (count, dim)
+        if count == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    def _path(self, generation: int, suffix: str) -> Path:
+        return self.directory / f"{self.prefix}.{generation}.{suffix}"
+
+    def _column_paths(self, generation: int) -> list[Path]:
+        """Các file cột của 1 thế hệ theo thứ tự của _encode_rows()."""
+        suffixes = ["f32", "ids", "codes", "pose"]
+        if self.storage != "float32":
+            suffixes.append("q")
+        if self.storage == "int8":
+            suffixes.append("scale")
+        return [self._path(generation, suffix) for suffix in suffixes]
+
+    def _encode_rows(self, rows, user_index: dict[str, int]) -> list[np.ndarray]:
+        """Trả về [vectors, ids, codes, poses, (quantized), (scales)] khớp với _column_paths()."""
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        codes = np.array([user_index.setdefault(row[1], len(user_index)) for row in rows], dtype=np.int32)
+        vectors = normalize_rows(np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows]))
+        poses = np.array([pose_code(row[3]) for row in rows], dtype=np.int8)
+        arrays = [vectors, ids, codes, poses]
+        if self.storage != "float32":
+            quantized, scales = quantize_rows(vectors, self.storage)
+            arrays.append(quantized)
+            if scales is not None:
+                arrays.append(scales)
+        return arrays
+
+    @staticmethod
+    def _users_bytes(users: list[str]) -> int:
+        return len("\n".join(users).encode("utf-8"))
+
+    @staticmethod
+    def _write_at(path: Path, offset: int, data: bytes):
+        """Ghi tại offset rồi cắt bỏ phần thừa (từ lần ghi dở trước đó)."""
+        mode = "r+b" if path.exists() else "w+b"
+        with open(path, mode) as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+
+    def _write_header(self, generation: int, count: int, max_id: int, n_users: int, change_seq: int):
+        header = {
+            "version": STORE_VERSION,
+            "dim": self.dim,
+            "dtype": STORE_DTYPE,
+            "model": self.model,
+            "storage": self.storage,
+            "generation": generation,
+            "count": count,
+            "max_id": max_id,
+            "n_users": n_users,
+            "change_seq": change_seq,
+        }
+        tmp_path = self.header_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(header), encoding="utf-8")
+        os.replace(tmp_path, self.header_path)
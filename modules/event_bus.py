@@ -0,0 +1,47 @@
+"""
+Module Event Bus - Publish/subscribe trong process cho các thay đổi của database.
+DatabaseManager publish sau khi ghi xong (đã commit), nên subscriber có thể áp thay đổi trực tiếp
+(delta) thay vì truy vấn lại. Topic:
+- "events"       : list[EventRow] vừa ghi (đã có id), theo thứ tự id tăng dần
+- "user_added"   : dict user (cùng định dạng get_user)
+- "user_updated" : dict user sau khi sửa (DatabaseManager.update_user)
+- "user_deleted" : user_id
+Callback chạy trên thread publish (vd. thread EventWriter); lớp UI chuyển sang Qt signal
+để xử lý trên UI thread (UI/event_bridge.py).
+"""
+import threading
+from typing import Any, Callable
+
+TOPICS = ("events", "user_added", "user_updated", "user_deleted")
+
+
+class EventBus:
+    """Danh sách callback theo topic, an toàn khi subscribe / publish từ nhiều thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, list[Callable[[Any], None]]] = {}
+
+    def subscribe(self, topic: str, callback: Callable[[Any], None]):
+        if topic not in TOPICS:
+            raise ValueError(f"Topic không hợp lệ: {topic} (hỗ trợ: {', '.join(TOPICS)})")
+        with self._lock:
+            # Copy-on-write: publish đọc danh sách không cần giữ khóa
+            self._subscribers[topic] = [*self._subscribers.get(topic, []), callback]
+
+    def unsubscribe(self, topic: str, callback: Callable[[Any], None]):
+        with self._lock:
+            callbacks = self._subscribers.get(topic, [])
+            self._subscribers[topic] = [cb for cb in callbacks if cb != callback]
+
+    def has_subscribers(self, topic: str) -> bool:
+        """Cho phép publisher bỏ qua việc dựng payload khi không ai nghe."""
+        return bool(self._subscribers.get(topic))
+
+    def publish(self, topic: str, payload: Any):
+        """Gọi lần lượt các callback; lỗi của 1 subscriber không ảnh hưởng subscriber khác / người ghi."""
+        for callback in self._subscribers.get(topic, ()):
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"[EventBus] Subscriber của '{topic}' lỗi: {e}")
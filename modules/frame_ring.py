@@ -0,0 +1,192 @@
+"""
+Module Frame Ring - Vòng N slot frame cấp phát sẵn dùng chung giữa camera, AI worker và hiển thị.
+- Producer (CameraThread) ghi thẳng vào slot trống: acquire() -> ghi vào array của slot -> publish()
+- Consumer nhận FrameRef (slot + seq); giữ frame lâu hơn slot Qt thì retain(), xong thì release().
+  Slot còn ref không bao giờ bị ghi đè, nên không cần copy frame giữa các thread
+- FrameRef.array là view chỉ đọc: ai cần vẽ / sửa phải tự copy (vào buffer dùng lại)
+- Mỗi frame mang seq, timestamp (giây, đơn điệu theo dòng thời gian của nguồn - dùng cho kiểm tra theo thời gian)
+  và captured_at (time.monotonic() lúc publish - đo độ trễ tới khi có kết quả: latency_ms())
+- shared=True: slot nằm trong multiprocessing.shared_memory; process khác attach() theo tên và đọc frame
+  mới nhất không qua pickle (seq kiểm tra trước / sau khi đọc thay cho refcount)
+"""
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Số slot mặc định: 1 frame đang gửi qua signal + frame chờ / đang xử lý của các worker + frame giữ cho UI
+FRAME_RING_SLOTS = 6
+
+# seq của slot đang được ghi (reader khác process bỏ qua)
+_WRITING = -1
+
+
+class FrameRef:
+    """1 tham chiếu tới 1 slot; mỗi người giữ có FrameRef riêng (retain() tạo ref mới)."""
+
+    __slots__ = ("ring", "index", "seq", "timestamp", "captured_at", "array", "_released")
+
+    def __init__(self, ring: "FrameRing", index: int, seq: int):
+        self.ring = ring
+        self.index = index
+        self.seq = seq
+        # Slot còn ref thì không bị ghi lại nên thời gian của slot vẫn là của frame này
+        self.timestamp, self.captured_at = ring._times[index]
+        self.array = ring._views[index]
+        self._released = False
+
+    def latency_ms(self) -> float:
+        """Thời gian từ lúc frame được publish tới hiện tại (ms)."""
+        return 1000.0 * (time.monotonic() - self.captured_at)
+
+    def retain(self) -> "FrameRef":
+        """Thêm 1 ref tới cùng slot (cho thread / object giữ frame sau khi slot Qt trả về)."""
+        return self.ring._retain(self.index, self.seq)
+
+    def release(self):
+        """Trả ref (gọi nhiều lần không sao); slot được ghi lại khi không còn ref nào."""
+        if not self._released:
+            self._released = True
+            self.ring._release(self.index)
+
+
+class FrameRing:
+    """N slot cùng shape / dtype, refcount theo slot, seq tăng dần theo thứ tự publish."""
+
+    def __init__(self, shape: tuple, dtype=np.uint8, slots: int = FRAME_RING_SLOTS,
+                 shared: bool = False, name: str | None = None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self._shm, self._owner = None, True
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        size = slots * 8 + slots * frame_bytes
+        if shared:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            buffer = self._shm.buf
+        else:
+            buffer = bytearray(size)
+        self._map(buffer)
+        self._seqs[:] = 0
+        self._refs = [0] * slots
+        self._times = [(0.0, 0.0)] * slots
+        self._lock = threading.Lock()
+        self._next_seq = 1
+        self._latest = -1
+        self.stats = {"published": 0, "full": 0}
+
+    @classmethod
+    def attach(cls, name: str, shape: tuple, dtype=np.uint8, slots: int = FRAME_RING_SLOTS) -> "FrameRing":
+        """Mở ring shared_memory do process khác tạo (chỉ đọc bằng read_latest())."""
+        ring = cls.__new__(cls)
+        ring.shape, ring.dtype, ring.slots = tuple(shape), np.dtype(dtype), slots
+        ring._shm, ring._owner = shared_memory.SharedMemory(name=name), False
+        ring._map(ring._shm.buf)
+        return ring
+
+    def _map(self, buffer):
+        self._seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=buffer)
+        self._frames = np.ndarray((self.slots, *self.shape), dtype=self.dtype, buffer=buffer,
+                                  offset=self.slots * 8)
+        self._views = []
+        for index in range(self.slots):
+            view = self._frames[index].view()
+            view.flags.writeable = False
+            self._views.append(view)
+
+    @property
+    def name(self) -> str | None:
+        """Tên shared_memory để process khác attach (None nếu ring nằm trong process)."""
+        return self._shm.name if self._shm is not None else None
+
+    # ---------- Producer ----------
+
+    def acquire(self) -> tuple[int, np.ndarray] | None:
+        """
+        Slot trống cũ nhất để ghi: (index, array ghi được).
+        None nếu mọi slot đang được giữ (producer bỏ frame này thay vì chờ).
+        """
+        with self._lock:
+            free = [i for i in range(self.slots) if self._refs[i] == 0]
+            if not free:
+                self.stats["full"] += 1
+                return None
+            index = min(free, key=lambda i: self._seqs[i])
+            self._refs[index] = 1
+            self._seqs[index] = _WRITING
+            if index == self._latest:
+                self._latest = -1
+        return index, self._frames[index]
+
+    def publish(self, index: int, timestamp: float | None = None) -> FrameRef:
+        """
+        Đánh dấu slot đã ghi xong; ref của producer chuyển sang FrameRef trả về.
+        timestamp: thời điểm capture theo dòng thời gian của nguồn (None = time.monotonic() lúc publish).
+        """
+        captured_at = time.monotonic()
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seqs[index] = seq
+            self._times[index] = (captured_at if timestamp is None else timestamp, captured_at)
+            self._latest = index
+            self.stats["published"] += 1
+        return FrameRef(self, index, seq)
+
+    def abort(self, index: int):
+        """Bỏ slot đã acquire() mà không publish (vd. retrieve lỗi)."""
+        with self._lock:
+            self._seqs[index] = 0
+            self._refs[index] = 0
+
+    # ---------- Consumer ----------
+
+    def latest(self) -> FrameRef | None:
+        """Ref tới frame publish gần nhất (người gọi phải release())."""
+        with self._lock:
+            if self._latest < 0:
+                return None
+            self._refs[self._latest] += 1
+            return FrameRef(self, self._latest, int(self._seqs[self._latest]))
+
+    def read_latest(self, out: np.ndarray | None = None) -> tuple[int, np.ndarray] | None:
+        """
+        Cho process attach(): copy frame mới nhất vào `out` (cấp phát nếu None) -> (seq, out).
+        Không có refcount giữa các process: seq đọc lại sau khi copy, khác nhau nghĩa là slot bị ghi đè -> thử slot khác.
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=self.dtype)
+        for index in np.argsort(self._seqs)[::-1]:
+            seq = int(self._seqs[index])
+            if seq <= 0:
+                return None
+            np.copyto(out, self._frames[index])
+            if int(self._seqs[index]) == seq:
+                return seq, out
+        return None
+
+    def _retain(self, index: int, seq: int) -> FrameRef:
+        with self._lock:
+            self._refs[index] += 1
+        return FrameRef(self, index, seq)
+
+    def _release(self, index: int):
+        with self._lock:
+            self._refs[index] -= 1
+
+    def in_use(self) -> int:
+        """Số slot đang có ref (để kiểm tra rò ref)."""
+        with self._lock:
+            return sum(1 for count in self._refs if count > 0)
+
+    def close(self):
+        """Đóng shared_memory (process tạo ring thì unlink trước, process khác không attach được nữa)."""
+        if self._shm is None:
+            return
+        shm, self._shm = self._shm, None
+        self._views, self._frames, self._seqs = [], None, None
+        if self._owner:
+            shm.unlink()
+        # BufferError nếu còn FrameRef giữ view của slot: bộ nhớ được giải phóng khi các view bị thu hồi
+        shm.close()
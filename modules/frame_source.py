@@ -0,0 +1,360 @@
+"""
+Module Frame Source - Nguồn frame cho CameraThread: webcam, file video, thư mục ảnh, phiên đã ghi.
+Cùng giao diện con của cv2.VideoCapture mà CameraThread dùng (open / grab / retrieve / read / release),
+nên pipeline xác thực / đăng ký chạy được không cần webcam (benchmark, soak test, regression test).
+
+Nguồn không phải live có 2 chế độ phát:
+- realtime=True : giữ nhịp theo timestamp gốc của frame (giống camera thật)
+- realtime=False: nhanh nhất có thể (đo FPS tối đa của pipeline trên 1 CPU)
+
+Phiên đã ghi (SessionRecorder) là 1 thư mục: video.avi (MJPG) + timestamps.txt (giây từ lúc bắt đầu, mỗi dòng 1 frame).
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+SESSION_VIDEO = "video.avi"
+SESSION_TIMESTAMPS = "timestamps.txt"
+
+
+class FrameSource(ABC):
+    """
+    Lớp cơ sở: lớp con cài đặt _open(), _grab() -> timestamp (giây, theo dòng thời gian của nguồn) hoặc None
+    khi hết, _retrieve(out), _rewind() và _release() (tùy chọn). Lớp cơ sở lo việc giữ nhịp realtime và lặp lại.
+    """
+
+    live = False
+
+    def __init__(self, realtime: bool = True, loop: bool = False):
+        self.realtime = realtime
+        self.loop = loop
+        self.timestamp = 0.0  # Timestamp của frame grab gần nhất
+        self.frame_index = -1
+        self.exhausted = False  # Hết frame (không phải lỗi)
+        self._opened = False
+        self._wall_origin: float | None = None
+        self._loop_offset = 0.0
+
+    def open(self) -> bool:
+        self._opened = self._open()
+        return self._opened
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def grab(self) -> bool:
+        """Lấy frame kế tiếp (chưa decode nếu nguồn hỗ trợ); với realtime thì chờ tới đúng nhịp."""
+        timestamp = self._grab()
+        if timestamp is None and self.loop and self.frame_index >= 0:
+            # Phát lại từ đầu, timeline nối tiếp để nhịp không bị nhảy
+            self._loop_offset = self.timestamp + self._frame_interval()
+            self._rewind()
+            timestamp = self._grab()
+        if timestamp is None:
+            self.exhausted = True
+            return False
+        self.timestamp = self._loop_offset + timestamp
+        self.frame_index += 1
+        if self.realtime and not self.live:
+            self._pace(self.timestamp)
+        return True
+
+    def retrieve(self, out: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        """Decode frame vừa grab (vào `out` nếu nguồn hỗ trợ ghi vào buffer có sẵn)."""
+        return self._retrieve(out)
+
+    def read(self, out: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        if not self.grab():
+            return False, None
+        return self.retrieve(out)
+
+    def release(self):
+        if self._opened:
+            self._release()
+            self._opened = False
+
+    def _pace(self, timestamp: float):
+        now = time.monotonic()
+        if self._wall_origin is None:
+            self._wall_origin = now - timestamp
+        delay = self._wall_origin + timestamp - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _frame_interval(self) -> float:
+        return 1.0 / 30
+
+    # ---------- Lớp con cài đặt ----------
+
+    @abstractmethod
+    def _open(self) -> bool:
+        ...
+
+    @abstractmethod
+    def _grab(self) -> float | None:
+        ...
+
+    @abstractmethod
+    def _retrieve(self, out):
+        ...
+
+    @abstractmethod
+    def _rewind(self):
+        """Quay về frame đầu (dùng khi loop=True)."""
+
+    def _release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """Webcam qua cv2.VideoCapture (timestamp = thời điểm grab, nhịp do thiết bị quyết định)."""
+
+    live = True
+
+    def __init__(self, camera_id: int = 0, width: int = 640, height: int = 480, fps: int = 30):
+        super().__init__(realtime=True, loop=False)
+        self.camera_id = camera_id
+        self.width, self.height, self.fps = width, height, fps
+        self._cap = None
+        self._start = 0.0
+
+    def _open(self) -> bool:
+        # Ưu tiên backend DirectShow trên Windows để giảm độ trễ
+        if os.name == "nt":
+            self._cap = cv2.VideoCapture(self.camera_id, cv2.CAP_DSHOW)
+        else:
+            self._cap = cv2.VideoCapture(self.camera_id)
+        if not self._cap.isOpened():
+            return False
+        try:
+            # Giảm buffer để tránh lag khung hình
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception:
+            pass
+        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self._cap.set(cv2.CAP_PROP_FPS, self.fps)
+        self._start = time.monotonic()
+        return True
+
+    def _grab(self):
+        return time.monotonic() - self._start if self._cap.grab() else None
+
+    def _retrieve(self, out):
+        return self._cap.retrieve(out)
+
+    def _rewind(self):
+        # Nguồn live không phát lại được (loop luôn False, xem __init__)
+        pass
+
+    def _release(self):
+        self._cap.release()
+
+    def __repr__(self):
+        return f"camera {self.camera_id}"
+
+
+class VideoFileSource(FrameSource):
+    """File video; timestamp lấy từ CAP_PROP_POS_MSEC (hoặc chỉ số frame / FPS của file)."""
+
+    def __init__(self, path, realtime: bool = True, loop: bool = False):
+        super().__init__(realtime, loop)
+        self.path = Path(path)
+        self._cap = None
+        self._fps = 30.0
+
+    def _open(self) -> bool:
+        self._cap = cv2.VideoCapture(str(self.path))
+        if not self._cap.isOpened():
+            return False
+        self._fps = self._cap.get(cv2.CAP_PROP_FPS) or 30.0
+        return True
+
+    def _grab(self):
+        if not self._cap.grab():
+            return None
+        msec = self._cap.get(cv2.CAP_PROP_POS_MSEC)
+        index = self._cap.get(cv2.CAP_PROP_POS_FRAMES) - 1
+        return msec / 1000 if msec > 0 or index <= 0 else index / self._fps
+
+    def _retrieve(self, out):
+        return self._cap.retrieve(out)
+
+    def _rewind(self):
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def _frame_interval(self) -> float:
+        return 1.0 / self._fps
+
+    def _release(self):
+        self._cap.release()
+
+    def __repr__(self):
+        return f"video {self.path}"
+
+
+class ImageSequenceSource(FrameSource):
+    """Thư mục ảnh (sắp theo tên), phát với `fps` cố định."""
+
+    def __init__(self, directory, fps: float = 30.0, realtime: bool = True, loop: bool = False):
+        super().__init__(realtime, loop)
+        self.directory = Path(directory)
+        self.fps = fps
+        self._paths: list[Path] = []
+        self._position = -1
+
+    def _open(self) -> bool:
+        self._paths = sorted(p for p in self.directory.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        return bool(self._paths)
+
+    def _grab(self):
+        if self._position + 1 >= len(self._paths):
+            return None
+        self._position += 1
+        return self._position / self.fps
+
+    def _retrieve(self, out):
+        # imread không ghi vào buffer có sẵn: CameraThread flip frame vào slot ring ngay sau đó
+        frame = cv2.imread(str(self._paths[self._position]))
+        return frame is not None, frame
+
+    def _rewind(self):
+        self._position = -1
+
+    def _frame_interval(self) -> float:
+        return 1.0 / self.fps
+
+    def __repr__(self):
+        return f"images {self.directory} ({len(self._paths)} frames @ {self.fps:g} FPS)"
+
+
+class RecordedSessionSource(VideoFileSource):
+    """Phiên do SessionRecorder ghi: phát lại theo đúng timestamp gốc của từng frame (kể cả jitter)."""
+
+    def __init__(self, directory, realtime: bool = True, loop: bool = False):
+        super().__init__(Path(directory) / SESSION_VIDEO, realtime, loop)
+        self.directory = Path(directory)
+        self._timestamps: list[float] = []
+
+    def _open(self) -> bool:
+        try:
+            text = (self.directory / SESSION_TIMESTAMPS).read_text(encoding="utf-8")
+        except OSError:
+            return False
+        self._timestamps = [float(line) for line in text.split()]
+        self._position = -1
+        return super()._open()
+
+    def _grab(self):
+        if self._position + 1 >= len(self._timestamps) or not self._cap.grab():
+            return None
+        self._position += 1
+        return self._timestamps[self._position]
+
+    def _rewind(self):
+        super()._rewind()
+        self._position = -1
+
+    def _frame_interval(self) -> float:
+        if len(self._timestamps) > 1:
+            return (self._timestamps[-1] - self._timestamps[0]) / (len(self._timestamps) - 1)
+        return super()._frame_interval()
+
+    def __repr__(self):
+        return f"session {self.directory} ({len(self._timestamps)} frames)"
+
+
+class SessionRecorder:
+    """Ghi frame + timestamp gốc thành 1 phiên để phát lại bằng RecordedSessionSource."""
+
+    def __init__(self, directory, fps: float = 30.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fps = fps
+        self._writer = None
+        self._timestamps = open(self.directory / SESSION_TIMESTAMPS, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, frame: np.ndarray, timestamp: float):
+        if self._writer is None:
+            h, w = frame.shape[:2]
+            self._writer = cv2.VideoWriter(
+                str(self.directory / SESSION_VIDEO), cv2.VideoWriter_fourcc(*"MJPG"), self.fps, (w, h)
+            )
+        self._writer.write(frame)
+        self._timestamps.write(f"{timestamp:.6f}\n")
+        self.count += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        self._timestamps.close()
+
+
+def open_frame_source(spec, realtime: bool = True, loop: bool = False) -> FrameSource:
+    """
+    Tạo nguồn frame từ mô tả (chưa open()):
+    - số (hoặc chuỗi số): webcam
+    - thư mục có timestamps.txt: phiên đã ghi
+    - thư mục khác: chuỗi ảnh
+    - file: video
+    """
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec))
+    path = Path(spec)
+    if path.is_dir():
+        if (path / SESSION_TIMESTAMPS).exists():
+            return RecordedSessionSource(path, realtime, loop)
+        return ImageSequenceSource(path, realtime=realtime, loop=loop)
+    if path.is_file():
+        return VideoFileSource(path, realtime, loop)
+    raise ValueError(f"Không tìm thấy nguồn frame: {spec}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Phát / ghi / đo FPS của nguồn frame")
+    parser.add_argument("source", help="Chỉ số webcam, file video, thư mục ảnh hoặc thư mục phiên đã ghi")
+    parser.add_argument("--fast", action="store_true", help="Phát nhanh nhất có thể thay vì theo nhịp gốc")
+    parser.add_argument("--frames", type=int, default=0, help="Dừng sau N frame (0 = tới hết nguồn)")
+    parser.add_argument("--record", metavar="DIR", help="Ghi các frame đọc được thành phiên trong DIR")
+    parser.add_argument("--analyze", action="store_true",
+                        help="Chạy FaceAnalyzer trên từng frame để đo FPS tối đa của pipeline")
+    args = parser.parse_args()
+
+    source = open_frame_source(args.source, realtime=not args.fast)
+    if not source.open():
+        raise SystemExit(f"Không mở được {source}")
+    recorder = SessionRecorder(args.record) if args.record else None
+    analyzer = None
+    if args.analyze:
+        from modules.ai.face_analyzer import FaceAnalyzer, PoseType
+        analyzer = FaceAnalyzer()
+        analyzer._ensure_models()
+
+    count, start, frame = 0, time.perf_counter(), None
+    try:
+        while not args.frames or count < args.frames:
+            ok, frame = source.read(frame)
+            if not ok:
+                break
+            if recorder is not None:
+                recorder.write(frame, source.timestamp)
+            if analyzer is not None:
+                analyzer.analyze_frame(frame, PoseType.FRONTAL)
+            count += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.release()
+        if recorder is not None:
+            recorder.close()
+    elapsed = time.perf_counter() - start
+    print(f"[FrameSource] {source}: {count} frames in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.1f} FPS)")
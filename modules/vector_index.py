@@ -0,0 +1,872 @@
+"""
+Module Vector Index - Lớp chỉ mục vector cho gallery embedding.
+Tất cả chỉ mục dùng chung 1 interface `search(query, k)` trên vector đã chuẩn hóa L2
+(inner product = cosine similarity):
+- BruteForceIndex: quét toàn bộ (chính xác tuyệt đối; tùy chọn lượng tử float16/int8 + chấm lại float32)
+- IVFIndex: k-means coarse quantizer thuần NumPy, tham số `nprobe`
+- HNSWIndex: đồ thị HNSW (cần cài thêm `hnswlib`, tùy chọn)
+
+Mỗi hàng có 1 label int64 (= face_embeddings.id) để ánh xạ ổn định khi lưu/khôi phục.
+Vị trí trả về từ `search` là chỉ số hàng trong `index.vectors`.
+"""
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Số hàng xử lý mỗi lần khi gán cụm, để giới hạn bộ nhớ tạm (chunk x nlist)
+_ASSIGN_CHUNK = 8192
+# Số hàng giải lượng tử mỗi lần khi quét gallery lượng tử hóa (chunk x D float32 ~ 8 MB)
+_SCAN_CHUNK = 4096
+
+# Kiểu lưu gallery: float32 (gốc), float16 (1/2 bộ nhớ), int8 đối xứng + scale từng vector (~1/4)
+STORAGE_MODES = ("float32", "float16", "int8")
+
+
+def quantize_rows(vectors: np.ndarray, storage: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Lượng tử hóa các hàng đã chuẩn hóa.
+
+    Returns:
+        (codes, scales): float16 -> scales None; int8 -> vector ~= codes * scale (scale float32 theo hàng)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if storage == "float16":
+        return vectors.astype(np.float16), None
+    if storage == "int8":
+        scales = (np.abs(vectors).max(axis=1) / 127.0 + 1e-12).astype(np.float32)
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales
+    if storage == "float32":
+        return vectors, None
+    raise ValueError(f"Kiểu lưu không hợp lệ: {storage} (hỗ trợ: {', '.join(STORAGE_MODES)})")
+
+
+def _top_k(positions: np.ndarray, similarities: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Chọn k phần tử có similarity lớn nhất, sắp xếp giảm dần."""
+    k = min(k, len(similarities))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    if k < len(similarities):
+        top = np.argpartition(-similarities, k - 1)[:k]
+    else:
+        top = np.arange(len(similarities))
+    top = top[np.argsort(-similarities[top], kind="stable")]
+    return positions[top], similarities[top]
+
+
+def _grow(buffer: np.ndarray, used: int, needed: int) -> np.ndarray:
+    """Trả về buffer ghi được có sức chứa >= needed (tăng gấp đôi, giữ `used` phần tử đầu)."""
+    if needed <= len(buffer) and buffer.flags.writeable:
+        return buffer
+    grown = np.empty((max(needed, 2 * len(buffer), 64),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:used] = buffer[:used]
+    return grown
+
+
+class VectorIndex:
+    """Interface chung cho các chỉ mục vector (lưu vector + label, tìm top-k)."""
+
+    kind = "base"
+    exact = False
+    # Có cấu trúc cần lưu/khôi phục (save/restore) hay dựng lại tức thì từ vector
+    persistent = True
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._size = 0
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Ma trận (N, D) float32 đã chuẩn hóa."""
+        return self._vectors[:self._size]
+
+    @property
+    def labels(self) -> np.ndarray:
+        """Label int64 của từng hàng."""
+        return self._labels[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def build(self, vectors: np.ndarray, labels: np.ndarray):
+        """Dựng lại toàn bộ chỉ mục từ đầu."""
+        self._vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._labels = np.asarray(labels, dtype=np.int64)
+        self._size = len(self._labels)
+        self._rebuild()
+
+    def add(self, vectors: np.ndarray, labels: np.ndarray):
+        """Thêm hàng mới vào cuối (amortized O(1) nhờ buffer tăng gấp đôi)."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels = np.asarray(labels, dtype=np.int64)
+        n_new = len(labels)
+        if n_new == 0:
+            return
+        start, end = self._size, self._size + n_new
+        self._vectors = _grow(self._vectors, start, end)
+        self._labels = _grow(self._labels, start, end)
+        self._vectors[start:end] = vectors
+        self._labels[start:end] = labels
+        self._size = end
+        self._on_add(start)
+
+    def attach(self, vectors: np.ndarray, labels: np.ndarray) -> bool:
+        """
+        Thay bộ nhớ bằng mảng dài hơn (vd. memmap store vừa được nối thêm) mà không copy.
+        Yêu cầu phần đầu trùng với dữ liệu hiện tại; hàng phía sau được coi như add().
+        Trả về False nếu không khớp (nơi gọi dùng add() thay thế).
+        """
+        start = self._size
+        if len(labels) < start or (start and labels[start - 1] != self._labels[start - 1]):
+            return False
+        self._vectors = vectors
+        self._labels = np.asarray(labels, dtype=np.int64)
+        self._size = len(self._labels)
+        if self._size > start:
+            self._on_add(start)
+        return True
+
+    def remove(self, labels: np.ndarray) -> np.ndarray:
+        """
+        Xóa các hàng có label thuộc `labels` (compact lại).
+        Trả về mask giữ lại (N cũ,) để nơi gọi cập nhật mảng song song.
+        """
+        keep = ~np.isin(self.labels, np.asarray(labels, dtype=np.int64))
+        if keep.all():
+            return keep
+        self._vectors = np.ascontiguousarray(self.vectors[keep])
+        self._labels = self.labels[keep].copy()
+        self._size = len(self._labels)
+        self._on_remove(keep)
+        return keep
+
+    def update(self, vectors: np.ndarray, labels: np.ndarray) -> int:
+        """Ghi đè vector của các label đã có tại chỗ (label chưa có bị bỏ qua). Trả về số hàng đã sửa."""
+        positions, found = self.positions_of(labels)
+        if not found.any():
+            return 0
+        if not self._vectors.flags.writeable:
+            self._vectors = np.array(self._vectors)
+        positions = positions[found]
+        self._vectors[positions] = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)[found]
+        self._on_update(positions)
+        return len(positions)
+
+    def positions_of(self, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Ánh xạ label -> vị trí hàng. Trả về (positions, found_mask)."""
+        labels = np.asarray(labels, dtype=np.int64)
+        if self._size == 0:
+            return np.zeros(len(labels), dtype=np.int64), np.zeros(len(labels), dtype=bool)
+        sorter = np.argsort(self.labels, kind="stable")
+        idx = np.clip(np.searchsorted(self.labels, labels, sorter=sorter), 0, self._size - 1)
+        positions = sorter[idx]
+        return positions, self.labels[positions] == labels
+
+    def row_vectors(self, positions: np.ndarray | None = None) -> np.ndarray:
+        """Vector float32 của các hàng `positions` (None = toàn bộ)."""
+        return self.vectors if positions is None else self.vectors[positions]
+
+    def score_rows(self, query: np.ndarray, positions: np.ndarray | None = None) -> np.ndarray:
+        """Cosine similarity của query với các hàng `positions` (None = toàn bộ), theo thứ tự `positions`."""
+        return self.row_vectors(positions) @ query
+
+    def score_error(self) -> float:
+        """Sai số tối đa của score_rows() so với cosine thật (0 = chính xác)."""
+        return 0.0
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Tìm k hàng gần nhất với query (đã chuẩn hóa).
+
+        Returns:
+            (positions, similarities): vị trí hàng trong `vectors` và cosine similarity, giảm dần
+        """
+        raise NotImplementedError
+
+    # --- Persistence ---
+
+    def save(self, path: Path):
+        """Lưu cấu trúc chỉ mục (không lưu vector - vector lấy lại từ database)."""
+        np.savez(str(path), kind=self.kind, labels=self.labels, **self._state())
+
+    def restore(self, path: Path, vectors: np.ndarray, labels: np.ndarray) -> bool:
+        """
+        Khôi phục cấu trúc đã lưu rồi cập nhật tăng dần theo dữ liệu hiện tại:
+        hàng đã bị xóa được loại bỏ, hàng mới (label chưa có trong file) được add().
+        Trả về False nếu không dùng được file (khi đó nơi gọi nên build()).
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
+        try:
+            with np.load(str(path)) as data:
+                if str(data["kind"]) != self.kind:
+                    return False
+                saved_labels = data["labels"]
+                labels = np.asarray(labels, dtype=np.int64)
+                known = np.isin(labels, saved_labels)
+                keep = np.isin(saved_labels, labels[known])
+                # Hàng cũ phải giữ nguyên thứ tự tương đối như lúc lưu
+                if not np.array_equal(saved_labels[keep], labels[known]):
+                    return False
+                self._vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)[known])
+                self._labels = labels[known].copy()
+                self._size = len(self._labels)
+                if not self._load_state(data, keep):
+                    return False
+        except (OSError, KeyError, ValueError) as e:
+            print(f"[VectorIndex] Không đọc được index {path}: {e}")
+            return False
+        self.add(np.asarray(vectors)[~known], labels[~known])
+        return True
+
+    # --- Hooks cho lớp con ---
+
+    def _rebuild(self):
+        pass
+
+    def _on_add(self, start: int):
+        pass
+
+    def _on_remove(self, keep: np.ndarray):
+        pass
+
+    def _on_update(self, positions: np.ndarray):
+        pass
+
+    def _state(self) -> dict:
+        return {}
+
+    def _load_state(self, data, keep: np.ndarray) -> bool:
+        return True
+
+
+class BruteForceIndex(VectorIndex):
+    """
+    Quét toàn bộ gallery bằng 1 phép GEMV - kết quả chính xác.
+
+    Với storage "float16"/"int8", lượt quét chạy trên bản lượng tử hóa (nhỏ hơn 2-4 lần, ít cache miss),
+    sau đó chỉ `rerank` ứng viên tốt nhất được chấm lại bằng vector float32. Khi vector float32 là
+    memmap (embedding store), chỉ các trang của ứng viên được nạp vào RAM.
+
+    keep_vectors=False: không giữ bản float32 trong RAM (chỉ còn bản lượng tử); ứng viên được chấm lại
+    bằng `rerank_source(labels)` (vd. đọc BLOB từ SQLite), không có thì dùng điểm xấp xỉ.
+    """
+
+    kind = "flat"
+    persistent = False
+
+    def __init__(self, dim: int = 512, storage: str = "float32", rerank: int = 64, keep_vectors: bool = True):
+        """
+        Args:
+            storage: "float32", "float16" hoặc "int8"
+            rerank: Số ứng viên chấm lại bằng float32 (tối thiểu = k)
+            keep_vectors: Giữ bản float32 cạnh bản lượng tử (luôn True với storage "float32")
+        """
+        super().__init__(dim)
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Kiểu lưu không hợp lệ: {storage} (hỗ trợ: {', '.join(STORAGE_MODES)})")
+        self.storage = storage
+        self.rerank = rerank
+        self.exact = storage == "float32"
+        self.keep_vectors = keep_vectors
+        # Callable(labels) -> (vectors (len(labels), D) float32 đã chuẩn hóa, found mask), dùng khi không giữ float32
+        self.rerank_source = None
+        self._codes = None
+        self._scales = None
+        self._preset = None
+        # max(scale) đã tính cho score_error() (None = tính lại khi cần)
+        self._max_scale = None
+
+    @property
+    def _keeps_vectors(self) -> bool:
+        return self.exact or self.keep_vectors
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Ma trận (N, D) float32; không giữ bản float32 thì giải lượng tử (tốn N x D x 4 byte tạm)."""
+        if self._keeps_vectors:
+            return super().vectors
+        return self.row_vectors()
+
+    @property
+    def nbytes(self) -> int:
+        """Số byte được quét mỗi truy vấn (bản lượng tử hóa, hoặc float32 nếu không lượng tử)."""
+        if self.exact:
+            return self._size * self.dim * 4
+        scales = 0 if self._scales is None else self._size * 4
+        return self._size * self.dim * self._codes.itemsize + scales
+
+    def build(self, vectors: np.ndarray, labels: np.ndarray,
+              codes: np.ndarray | None = None, scales: np.ndarray | None = None):
+        """Như VectorIndex.build(); `codes`/`scales` đã lượng tử sẵn (vd. từ store) để khỏi tính lại."""
+        self._preset = (codes, scales) if codes is not None else None
+        if self._keeps_vectors:
+            super().build(vectors, labels)
+            return
+        self._labels = np.asarray(labels, dtype=np.int64)
+        self._size = len(self._labels)
+        self._vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        try:
+            self._rebuild()
+        finally:
+            self._vectors = np.empty((0, self.dim), dtype=np.float32)
+
+    def add(self, vectors: np.ndarray, labels: np.ndarray):
+        if self._keeps_vectors:
+            return super().add(vectors, labels)
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return
+        codes, scales = quantize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim), self.storage)
+        start, end = self._size, self._size + len(labels)
+        self._labels = _grow(self._labels, start, end)
+        self._labels[start:end] = labels
+        self._codes = _grow(self._codes, start, end)
+        self._codes[start:end] = codes
+        if scales is not None:
+            self._scales = _grow(self._scales, start, end)
+            self._scales[start:end] = scales
+            self._max_scale = None
+        self._size = end
+
+    def remove(self, labels: np.ndarray) -> np.ndarray:
+        if self._keeps_vectors:
+            return super().remove(labels)
+        keep = ~np.isin(self.labels, np.asarray(labels, dtype=np.int64))
+        if not keep.all():
+            self._labels = self.labels[keep].copy()
+            self._size = len(self._labels)
+            self._on_remove(keep)
+        return keep
+
+    def update(self, vectors: np.ndarray, labels: np.ndarray) -> int:
+        if self._keeps_vectors:
+            return super().update(vectors, labels)
+        positions, found = self.positions_of(labels)
+        if not found.any():
+            return 0
+        positions = positions[found]
+        self._write_codes(positions, np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)[found])
+        return len(positions)
+
+    def attach(self, vectors: np.ndarray, labels: np.ndarray,
+               codes: np.ndarray | None = None, scales: np.ndarray | None = None) -> bool:
+        """Như VectorIndex.attach(); `codes`/`scales` của store (cùng số hàng) thay bản lượng tử hiện tại."""
+        if not self._keeps_vectors:
+            return False
+        self._preset = (codes, scales) if codes is not None else None
+        try:
+            attached = super().attach(vectors, labels)
+            if attached and not self.exact:
+                # Cùng số hàng (vd. store vừa dựng lại sang thế hệ mới): _on_add không chạy
+                self._take_preset()
+        finally:
+            self._preset = None
+        return attached
+
+    def _take_preset(self) -> bool:
+        """Dùng bản lượng tử truyền vào build()/attach() nếu đủ hàng."""
+        preset, self._preset = self._preset, None
+        if preset is None or len(preset[0]) != self._size:
+            return False
+        self._codes, self._scales = preset
+        self._max_scale = None
+        return True
+
+    def _rebuild(self):
+        self._codes = self._scales = self._max_scale = None
+        if self.exact:
+            return
+        if not self._take_preset():
+            self._codes, self._scales = self._quantize(0, self._size)
+
+    def _quantize(self, start: int, end: int) -> tuple[np.ndarray, np.ndarray | None]:
+        parts = [quantize_rows(self._vectors[i:min(i + _SCAN_CHUNK, end)], self.storage)
+                 for i in range(start, end, _SCAN_CHUNK)]
+        if not parts:
+            return quantize_rows(np.empty((0, self.dim), dtype=np.float32), self.storage)
+        codes = np.concatenate([c for c, _ in parts])
+        scales = None if parts[0][1] is None else np.concatenate([sc for _, sc in parts])
+        return codes, scales
+
+    def _on_add(self, start: int):
+        if self.exact or self._take_preset():
+            return
+        codes, scales = self._quantize(start, self._size)
+        self._codes = _grow(self._codes, start, self._size)
+        self._codes[start:self._size] = codes
+        if scales is not None:
+            self._scales = _grow(self._scales, start, self._size)
+            self._scales[start:self._size] = scales
+            self._max_scale = None
+
+    def _on_remove(self, keep: np.ndarray):
+        if self.exact:
+            return
+        self._codes = self._codes[:len(keep)][keep]
+        if self._scales is not None:
+            self._scales = self._scales[:len(keep)][keep]
+
+    def _on_update(self, positions: np.ndarray):
+        if self.exact:
+            return
+        self._write_codes(positions, self._vectors[positions])
+
+    def _write_codes(self, positions: np.ndarray, vectors: np.ndarray):
+        codes, scales = quantize_rows(vectors, self.storage)
+        if not self._codes.flags.writeable:
+            self._codes = np.array(self._codes)
+        self._codes[positions] = codes
+        if scales is not None:
+            if not self._scales.flags.writeable:
+                self._scales = np.array(self._scales)
+            self._scales[positions] = scales
+            self._max_scale = None
+
+    def row_vectors(self, positions: np.ndarray | None = None) -> np.ndarray:
+        if self._keeps_vectors:
+            return super().row_vectors(positions)
+        codes = self._codes[:self._size] if positions is None else self._codes[positions]
+        vectors = codes.astype(np.float32)
+        if self._scales is not None:
+            vectors *= (self._scales[:self._size] if positions is None else self._scales[positions])[:, None]
+        return vectors
+
+    def approximate_scores(self, query: np.ndarray, positions: np.ndarray | None = None) -> np.ndarray:
+        """Similarity xấp xỉ của các hàng `positions` (None = toàn gallery) từ bản lượng tử, theo chunk."""
+        n_rows = self._size if positions is None else len(positions)
+        scores = np.empty(n_rows, dtype=np.float32)
+        for i in range(0, n_rows, _SCAN_CHUNK):
+            j = min(i + _SCAN_CHUNK, n_rows)
+            rows = slice(i, j) if positions is None else positions[i:j]
+            scores[i:j] = self._codes[rows].astype(np.float32) @ query
+            if self._scales is not None:
+                scores[i:j] *= self._scales[rows]
+        return scores
+
+    def score_rows(self, query: np.ndarray, positions: np.ndarray | None = None) -> np.ndarray:
+        """Quét bản lượng tử, `rerank` hàng điểm cao nhất được chấm lại bằng float32 (như search())."""
+        if self.exact:
+            return super().score_rows(query, positions)
+        scores = self.approximate_scores(query, positions)
+        if not self._keeps_vectors and self.rerank_source is None:
+            return scores
+        top = np.arange(len(scores))
+        if self.rerank < len(scores):
+            top = np.argpartition(-scores, self.rerank - 1)[:self.rerank]
+        rows = top if positions is None else np.asarray(positions)[top]
+        scores[top] = self._exact_rows(rows) @ query
+        return scores
+
+    def score_error(self) -> float:
+        """Sai số tối đa của điểm xấp xỉ (hàng không được chấm lại) so với cosine thật, vector đơn vị."""
+        if self.exact:
+            return 0.0
+        if self._scales is None:
+            # float16: sai số tương đối <= 2^-11 mỗi thành phần, tổng |q_i * v_i| <= 1
+            return 2.0 ** -11
+        if self._max_scale is None:
+            self._max_scale = float(self._scales[:self._size].max()) if self._size else 0.0
+        scale = self._max_scale
+        # int8: sai số làm tròn <= scale / 2 mỗi thành phần -> |q . e| <= scale / 2 * sqrt(D)
+        return 0.5 * scale * float(np.sqrt(self.dim))
+
+    def _exact_rows(self, positions: np.ndarray) -> np.ndarray:
+        """Vector float32 gốc để chấm lại ứng viên (bản lượng tử nếu không còn nguồn float32)."""
+        if self._keeps_vectors:
+            return self._vectors[positions]
+        if self.rerank_source is None:
+            return self.row_vectors(positions)
+        vectors, found = self.rerank_source(self._labels[positions])
+        if not found.all():
+            # Hàng không đọc được (vừa bị xóa, lỗi I/O): giữ điểm xấp xỉ
+            vectors[~found] = self.row_vectors(np.asarray(positions)[~found])
+        return vectors
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if self.exact:
+            similarities = self.vectors @ query
+            return _top_k(np.arange(self._size), similarities, k)
+        # Giai đoạn 1: quét bản lượng tử; giai đoạn 2: chấm lại ứng viên bằng float32
+        candidates, _ = _top_k(np.arange(self._size), self.approximate_scores(query), max(k, self.rerank))
+        candidates = np.sort(candidates)
+        return _top_k(candidates, self._exact_rows(candidates) @ query, k)
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted File index: chia gallery thành `nlist` cụm bằng spherical k-means,
+    mỗi truy vấn chỉ quét `nprobe` cụm có tâm gần nhất.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim: int = 512, nlist: int | None = None, nprobe: int = 8,
+                 n_iter: int = 10, retrain_ratio: float = 2.0, seed: int = 0):
+        """
+        Args:
+            nlist: Số cụm (None = tự chọn ~sqrt(N))
+            nprobe: Số cụm được quét mỗi truy vấn (tăng = recall cao hơn, chậm hơn)
+            n_iter: Số vòng lặp k-means
+            retrain_ratio: Train lại k-means khi gallery lớn gấp ratio lần lúc train (`retrain_due`;
+                không train trong add(), nơi gọi chạy retrain_snapshot / train_centroids / swap_centroids)
+        """
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.retrain_ratio = retrain_ratio
+        self.seed = seed
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self._assign = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        # Inverted lists dạng CSR: _list_rows[_list_offsets[c]:_list_offsets[c+1]] là các hàng của cụm c
+        self._list_rows = np.empty(0, dtype=np.int64)
+        self._list_offsets = np.zeros(1, dtype=np.int64)
+        self._lists_dirty = False
+        # Số lần update() tại chỗ: bản chụp retrain đã cũ nếu giá trị này đổi
+        self._update_count = 0
+
+    def _rebuild(self):
+        if self._size == 0:
+            self.centroids = np.empty((0, self.dim), dtype=np.float32)
+            self._assign = np.empty(0, dtype=np.int32)
+            self._trained_size = 0
+            self._lists_dirty = True
+            return
+        nlist = self.nlist or max(1, int(np.sqrt(self._size)))
+        self.centroids = self._train_kmeans(self.vectors, min(nlist, self._size))
+        self._assign = self._assign_rows(self.vectors)
+        self._trained_size = self._size
+        self._lists_dirty = True
+
+    def _train_kmeans(self, vectors: np.ndarray, nlist: int) -> np.ndarray:
+        """Spherical k-means trên tối đa 256 mẫu/cụm."""
+        rng = np.random.default_rng(self.seed)
+        n_sample = min(len(vectors), nlist * 256)
+        sample_idx = rng.choice(len(vectors), n_sample, replace=False)
+        sample = np.ascontiguousarray(vectors[np.sort(sample_idx)])
+        centroids = sample[rng.choice(n_sample, nlist, replace=False)].copy()
+
+        for _ in range(self.n_iter):
+            assign = self._assign_rows(sample, centroids)
+            counts = np.bincount(assign, minlength=nlist)
+            order = np.argsort(assign, kind="stable")
+            non_empty = counts > 0
+            starts = (np.cumsum(counts) - counts)[non_empty]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[non_empty] = sums
+            # Cụm rỗng -> gieo lại bằng 1 mẫu ngẫu nhiên
+            n_empty = int((~non_empty).sum())
+            if n_empty:
+                centroids[~non_empty] = sample[rng.choice(n_sample, n_empty, replace=False)]
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-8
+        return centroids
+
+    def _assign_rows(self, vectors: np.ndarray, centroids: np.ndarray | None = None) -> np.ndarray:
+        centroids = self.centroids if centroids is None else centroids
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _ASSIGN_CHUNK):
+            block = vectors[start:start + _ASSIGN_CHUNK]
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assign
+
+    def _refresh_lists(self):
+        counts = np.bincount(self._assign, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self._list_rows = np.argsort(self._assign, kind="stable").astype(np.int64)
+        self._lists_dirty = False
+
+    def _on_add(self, start: int):
+        if len(self.centroids) == 0:
+            self._rebuild()
+            return
+        # Chỉ gán cụm cho hàng mới; train lại (retrain_due) chạy ngoài đường nóng
+        self._assign = np.concatenate((self._assign, self._assign_rows(self.vectors[start:])))
+        self._lists_dirty = True
+
+    def _on_remove(self, keep: np.ndarray):
+        self._assign = self._assign[keep]
+        self._lists_dirty = True
+
+    def _on_update(self, positions: np.ndarray):
+        self._assign[positions] = self._assign_rows(self.vectors[positions])
+        self._update_count += 1
+        self._lists_dirty = True
+
+    @property
+    def retrain_due(self) -> bool:
+        """Gallery đã lớn gấp retrain_ratio lần lúc train k-means."""
+        return len(self.centroids) > 0 and self._size > self._trained_size * self.retrain_ratio
+
+    def retrain_snapshot(self) -> tuple[np.ndarray, np.ndarray, int]:
+        """Bản chụp (vectors, labels, update_count) để train ngoài khóa; chỉ tạo view, gọi dưới khóa của nơi gọi."""
+        return self.vectors, self.labels.copy(), self._update_count
+
+    def train_centroids(self, snapshot: tuple) -> tuple:
+        """
+        Train k-means và gán cụm trên bản chụp, không đụng tới trạng thái index
+        (chạy được trong khi search() / add() tiếp tục với tâm cụm cũ).
+        """
+        vectors, labels, update_count = snapshot
+        nlist = self.nlist or max(1, int(np.sqrt(len(labels))))
+        centroids = self._train_kmeans(vectors, min(nlist, len(labels)))
+        return centroids, labels, self._assign_rows(vectors, centroids), update_count
+
+    def swap_centroids(self, trained: tuple) -> bool:
+        """
+        Đổi sang tâm cụm vừa train: hàng còn trong bản chụp giữ phép gán đã tính,
+        chỉ hàng thêm sau bản chụp được gán lại. Trả về False nếu không còn cần train lại
+        (vd. index vừa được build lại).
+        """
+        centroids, labels, assign, update_count = trained
+        if not self.retrain_due or len(labels) == 0:
+            return False
+        if update_count != self._update_count:
+            # Vector bị sửa sau bản chụp: gán lại toàn bộ
+            assign = self._assign_rows(self.vectors, centroids)
+        else:
+            sorter = np.argsort(labels, kind="stable")
+            idx = np.clip(np.searchsorted(labels, self.labels, sorter=sorter), 0, len(labels) - 1)
+            source = sorter[idx]
+            found = labels[source] == self.labels
+            assign = assign[source]
+            if not found.all():
+                assign[~found] = self._assign_rows(self.vectors[~found], centroids)
+        self.centroids = centroids
+        self._assign = assign.astype(np.int32)
+        self._trained_size = len(labels)
+        self._lists_dirty = True
+        return True
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if self._size == 0:
+            return _top_k(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), k)
+        if self._lists_dirty:
+            self._refresh_lists()
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = _top_k(np.arange(len(self.centroids)), self.centroids @ query, nprobe)[0]
+        candidates = np.concatenate([
+            self._list_rows[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probe
+        ])
+        similarities = self.vectors[candidates] @ query
+        return _top_k(candidates, similarities, k)
+
+    def _state(self) -> dict:
+        return {
+            "centroids": self.centroids,
+            "assign": self._assign,
+            "trained_size": np.int64(self._trained_size),
+        }
+
+    def _load_state(self, data, keep: np.ndarray) -> bool:
+        self.centroids = data["centroids"].astype(np.float32)
+        self._assign = data["assign"][keep].astype(np.int32)
+        self._trained_size = int(data["trained_size"])
+        self._lists_dirty = True
+        return True
+
+
+class HNSWIndex(VectorIndex):
+    """Đồ thị HNSW qua thư viện `hnswlib` (tùy chọn, chỉ import khi dùng)."""
+
+    kind = "hnsw"
+
+    def __init__(self, dim: int = 512, M: int = 16, ef_construction: int = 200, ef: int = 64):
+        """
+        Args:
+            M: Số cạnh mỗi nút
+            ef_construction: Độ rộng tìm kiếm khi dựng đồ thị
+            ef: Độ rộng tìm kiếm khi truy vấn (tăng = recall cao hơn, chậm hơn)
+        """
+        super().__init__(dim)
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("HNSWIndex cần cài đặt hnswlib: pip install hnswlib") from e
+        self._hnswlib = hnswlib
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self._graph = None
+        self._label_order = None
+        self._removed_labels = np.empty(0, dtype=np.int64)
+        self._restore_path = None
+
+    def _new_graph(self, capacity: int):
+        graph = self._hnswlib.Index(space="ip", dim=self.dim)
+        graph.init_index(max_elements=max(capacity, 16), ef_construction=self.ef_construction,
+                         M=self.M, allow_replace_deleted=True)
+        graph.set_ef(self.ef)
+        return graph
+
+    def _rebuild(self):
+        self._graph = self._new_graph(self._size * 2)
+        if self._size:
+            self._graph.add_items(self.vectors, self.labels)
+        self._label_order = None
+
+    def _on_add(self, start: int):
+        if self._graph is None:
+            self._rebuild()
+            return
+        # Nút mark_deleted vẫn chiếm chỗ trong đồ thị: so sánh với số nút đã cấp (kể cả đã xóa)
+        needed = self._graph.get_current_count() + (self._size - start)
+        if needed > self._graph.get_max_elements():
+            self._graph.resize_index(needed * 2)
+        self._graph.add_items(self.vectors[start:], self.labels[start:])
+        self._label_order = None
+
+    def _on_remove(self, keep: np.ndarray):
+        # Label của hàng đã xóa: đánh dấu deleted trong đồ thị, không cần dựng lại
+        for label in self._removed_labels:
+            self._graph.mark_deleted(int(label))
+        self._label_order = None
+
+    def _on_update(self, positions: np.ndarray):
+        # hnswlib: add_items với label đã tồn tại sẽ cập nhật vector của nút đó
+        self._graph.add_items(self.vectors[positions], self.labels[positions])
+
+    def remove(self, labels: np.ndarray) -> np.ndarray:
+        self._removed_labels = np.intersect1d(self.labels, np.asarray(labels, dtype=np.int64))
+        return super().remove(labels)
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if self._size == 0 or self._graph is None:
+            return _top_k(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), k)
+        # Hàng đã xóa được compact khỏi vectors nhưng nút vẫn nằm (mark_deleted) trong đồ thị:
+        # k tính theo số nút còn sống
+        k = min(k, self._size)
+        self._graph.set_ef(max(self.ef, k))
+        try:
+            found, distances = self._graph.knn_query(query.reshape(1, -1), k=k)
+        except RuntimeError as e:
+            # hnswlib không tìm đủ k nút còn sống (đồ thị thưa sau khi xóa nhiều): quét chính xác
+            print(f"[HNSWIndex] knn_query thất bại ({e}), quét toàn bộ {self._size} hàng")
+            return _top_k(np.arange(self._size), self.vectors @ query, k)
+        if self._label_order is None:
+            self._label_order = np.argsort(self.labels, kind="stable")
+        # Ánh xạ label -> vị trí hàng
+        positions = self._label_order[np.searchsorted(self.labels, found[0], sorter=self._label_order)]
+        return positions.astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+    def save(self, path: Path):
+        super().save(path)
+        self._graph.save_index(str(Path(path).with_suffix(".hnsw")))
+
+    def _load_state(self, data, keep: np.ndarray) -> bool:
+        graph_path = Path(self._restore_path).with_suffix(".hnsw")
+        if not graph_path.exists():
+            return False
+        self._graph = self._hnswlib.Index(space="ip", dim=self.dim)
+        self._graph.load_index(str(graph_path), allow_replace_deleted=True)
+        self._graph.set_ef(self.ef)
+        for label in data["labels"][~keep]:
+            self._graph.mark_deleted(int(label))
+        self._label_order = None
+        return True
+
+    def restore(self, path: Path, vectors: np.ndarray, labels: np.ndarray) -> bool:
+        self._restore_path = path
+        return super().restore(path, vectors, labels)
+
+
+INDEX_TYPES = {
+    BruteForceIndex.kind: BruteForceIndex,
+    IVFIndex.kind: IVFIndex,
+    HNSWIndex.kind: HNSWIndex,
+}
+
+
+def create_index(kind: str = "flat", dim: int = 512, **params) -> VectorIndex:
+    """Tạo chỉ mục theo tên: 'flat', 'ivf', 'hnsw'."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Loại index không hợp lệ: {kind} (hỗ trợ: {', '.join(INDEX_TYPES)})")
+    return INDEX_TYPES[kind](dim=dim, **params)
+
+
+def evaluate_index(index: VectorIndex, queries: np.ndarray, k: int = 1) -> dict:
+    """
+    So sánh 1 chỉ mục với kết quả chính xác (brute force) trên cùng dữ liệu.
+
+    Returns:
+        dict: recall@k, latency trung bình (ms) của index và của brute force
+    """
+    exact = BruteForceIndex(index.dim)
+    exact.build(index.vectors, index.labels)
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, index.dim)
+    queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-8)
+
+    hits = 0
+    exact_time = index_time = 0.0
+    for query in queries:
+        t0 = time.perf_counter()
+        truth, _ = exact.search(query, k)
+        t1 = time.perf_counter()
+        found, _ = index.search(query, k)
+        t2 = time.perf_counter()
+        exact_time += t1 - t0
+        index_time += t2 - t1
+        hits += len(np.intersect1d(truth, found))
+
+    n = max(len(queries), 1)
+    return {
+        "kind": index.kind,
+        f"recall@{k}": hits / (n * k),
+        "latency_ms": 1000.0 * index_time / n,
+        "exact_latency_ms": 1000.0 * exact_time / n,
+    }
+
+
+# Benchmark standalone trên gallery ngẫu nhiên
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark recall@1 / latency của vector index")
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--poses", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--rerank", type=int, default=64)
+    args = parser.parse_args()
+
+    # Gallery mô phỏng: mỗi user có `poses` embedding quanh 1 tâm định danh
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.users, 512)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    gallery = np.repeat(centers, args.poses, axis=0)
+    gallery += 0.03 * rng.standard_normal(gallery.shape).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    # Query = tâm của 1 user + nhiễu (giống 1 lần chụp khác của cùng người)
+    picks = rng.choice(args.users, args.queries, replace=False)
+    queries = centers[picks] + 0.03 * rng.standard_normal((args.queries, 512)).astype(np.float32)
+    labels = np.arange(len(gallery), dtype=np.int64)
+
+    # Brute force theo kiểu lưu: bộ nhớ quét vs recall@1 / latency (float32 là chuẩn)
+    for storage in STORAGE_MODES:
+        flat = BruteForceIndex(storage=storage, rerank=args.rerank)
+        flat.build(gallery, labels)
+        print(f"flat/{storage} ({flat.nbytes / 2**20:.0f} MB): {evaluate_index(flat, queries)}")
+
+    ivf = IVFIndex(nlist=args.nlist)
+    t0 = time.perf_counter()
+    ivf.build(gallery, labels)
+    print(f"IVF build ({len(ivf.centroids)} lists): {time.perf_counter() - t0:.1f}s")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        print(f"nprobe={nprobe}: {evaluate_index(ivf, queries)}")
+
+    try:
+        hnsw = HNSWIndex()
+    except ImportError as e:
+        print(e)
+    else:
+        t0 = time.perf_counter()
+        hnsw.build(gallery, labels)
+        print(f"HNSW build: {time.perf_counter() - t0:.1f}s")
+        print(evaluate_index(hnsw, queries))
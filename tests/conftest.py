@@ -0,0 +1,56 @@
+"""Fixture dùng chung: database tạm (mỗi test 1 file riêng) và embedding ngẫu nhiên đã chuẩn hóa."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.database import DatabaseManager  # noqa: E402
+
+EMBEDDING_DIM = 512
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """Tạo DatabaseManager trên file tạm; mọi manager được đóng khi test kết thúc."""
+    managers = []
+
+    def factory(storage: str = "float32", name: str = "faces.db") -> DatabaseManager:
+        db = DatabaseManager(tmp_path / name, embedding_storage=storage)
+        managers.append(db)
+        return db
+
+    yield factory
+    for db in managers:
+        db.close()
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
+
+
+def random_embedding(rng) -> np.ndarray:
+    vector = rng.normal(size=EMBEDDING_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def enroll(db: DatabaseManager, rng, n_users: int, poses=("frontal", "left", "right")) -> dict:
+    """Thêm n_users user, mỗi user 1 hàng / pose quanh 1 vector gốc. Trả về {user_id: vector gốc}."""
+    bases = {}
+    for u in range(n_users):
+        user_id = f"user{u:03d}"
+        db.add_user(user_id, f"User {u}")
+        base = random_embedding(rng)
+        for pose in poses:
+            noisy = base + 0.01 * rng.normal(size=EMBEDDING_DIM).astype(np.float32)
+            db.add_embedding(user_id, noisy / np.linalg.norm(noisy), pose_type=pose)
+        bases[user_id] = base
+    return bases
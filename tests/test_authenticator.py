@@ -0,0 +1,224 @@
+"""Authenticator so với tham chiếu brute force tính thẳng từ các hàng face_embeddings."""
+import numpy as np
+import pytest
+
+from modules.authenticator import Authenticator
+from tests.conftest import EMBEDDING_DIM, enroll, random_embedding
+
+
+def _reference(db, query: np.ndarray, reduce: str = "max") -> list[tuple[float, str]]:
+    """[(distance, user_id), ...] gần nhất trước, điểm theo user gộp bằng `reduce` trên các pose."""
+    query = query / np.linalg.norm(query)
+    scores: dict[str, list[float]] = {}
+    for _, user_id, embedding, _ in db.get_embedding_rows():
+        scores.setdefault(user_id, []).append(float(embedding @ query / np.linalg.norm(embedding)))
+    combine = max if reduce == "max" else np.mean
+    return sorted((1.0 - float(combine(values)), user_id) for user_id, values in scores.items())
+
+
+def _near(rng, base: np.ndarray, noise: float = 0.01) -> np.ndarray:
+    return base + noise * rng.normal(size=EMBEDDING_DIM).astype(np.float32)
+
+
+def _queries(rng, bases: dict) -> list[np.ndarray]:
+    """Truy vấn gần từng user + vài truy vấn ngẫu nhiên không khớp ai."""
+    return [_near(rng, base) for base in bases.values()] + [random_embedding(rng) for _ in range(5)]
+
+
+@pytest.fixture
+def gallery(db, rng):
+    return db, enroll(db, rng, 30)
+
+
+def test_authenticate_matches_brute_force(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+    for query in _queries(rng, bases):
+        best_distance, best_user = _reference(db, query)[0]
+        success, user_id, distance = auth.authenticate(query)
+        assert distance == pytest.approx(best_distance, abs=1e-5)
+        assert success == (best_distance < auth.threshold)
+        assert user_id == (best_user if success else None)
+
+
+def test_authenticate_empty_gallery(db):
+    auth = Authenticator(db_manager=db)
+    assert auth.authenticate(np.ones(EMBEDDING_DIM, dtype=np.float32)) == (False, None, 1.0)
+
+
+@pytest.mark.parametrize("reduce", ["max", "mean"])
+def test_topk_reduces_scores_per_user(gallery, rng, reduce):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+    for query in _queries(rng, bases):
+        expected = _reference(db, query, reduce)[:3]
+        result = auth.authenticate_topk(query, k=3, reduce=reduce)
+        assert result["user_ids"] == [user_id for _, user_id in expected]
+        np.testing.assert_allclose(result["distances"], [distance for distance, _ in expected], atol=1e-5)
+        assert result["margin"] == pytest.approx(expected[1][0] - expected[0][0], abs=1e-5)
+        assert result["success"] == (expected[0][0] < auth.threshold and result["margin"] >= auth.min_margin)
+        assert result["comparisons"] == {"coarse": 0, "fine": 90}
+
+
+def test_topk_rejects_unknown_reduce(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+    with pytest.raises(ValueError):
+        auth.authenticate_topk(bases["user000"], reduce="median")
+
+
+def test_sync_applies_enrollment_update_and_deletion(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+
+    db.add_user("late", "Late user")
+    late = random_embedding(rng)
+    db.add_embedding("late", late, pose_type="frontal")
+    db.delete_user("user002")
+    moved = random_embedding(rng)
+    first_row = db.get_embedding_rows()[0][0]
+    db.update_embedding(first_row, moved)
+    assert auth.sync() == 5
+    assert auth.sync() == 0
+
+    assert len(auth.index) == 88
+    for query in (late, moved, bases["user002"], _near(rng, bases["user005"])):
+        best_distance, best_user = _reference(db, query)[0]
+        success, user_id, distance = auth.authenticate(query)
+        assert distance == pytest.approx(best_distance, abs=1e-5)
+        assert user_id == (best_user if success else None)
+    assert auth.authenticate(bases["user002"])[0] is False
+
+
+def test_sync_reloads_when_change_log_was_pruned(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+
+    db.delete_user("user003")
+    db.prune_embedding_changes(db.get_embedding_change_seq())
+    assert auth.sync() == 87
+    assert len(auth.index) == 87
+    assert auth.authenticate(bases["user003"])[0] is False
+    assert auth.sync() == 0
+
+
+@pytest.mark.parametrize("reduce", ["max", "mean"])
+def test_batch_matches_topk(gallery, rng, reduce):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+    queries = np.stack(_queries(rng, bases))
+    batch = auth.authenticate_batch(queries, k=3, reduce=reduce, chunk_size=4)
+
+    for i, query in enumerate(queries):
+        single = auth.authenticate_topk(query, k=3, reduce=reduce)
+        assert batch["user_ids"][i].tolist() == single["user_ids"]
+        np.testing.assert_allclose(batch["distances"][i], single["distances"], atol=1e-5)
+        assert batch["margin"][i] == pytest.approx(single["margin"], abs=1e-5)
+        assert batch["success"][i] == single["success"]
+
+
+def test_batch_pads_when_gallery_has_fewer_than_k_users(db, rng):
+    bases = enroll(db, rng, 1)
+    auth = Authenticator(db_manager=db, recent_users=0)
+    batch = auth.authenticate_batch(np.stack([bases["user000"]]), k=3)
+    assert batch["user_ids"][0].tolist() == ["user000", None, None]
+    assert batch["distances"][0, 1] == 1.0 and batch["margin"][0] == 1.0
+
+
+def test_coarse_search_over_every_user_is_exact(gallery, rng):
+    db, bases = gallery
+    exact = Authenticator(db_manager=db, recent_users=0)
+    coarse = Authenticator(db_manager=db, recent_users=0, coarse_users=len(bases))
+    for query in _queries(rng, bases):
+        expected = exact.authenticate_topk(query, k=3)
+        result = coarse.authenticate_topk(query, k=3)
+        assert result["user_ids"] == expected["user_ids"]
+        np.testing.assert_allclose(result["distances"], expected["distances"], atol=1e-5)
+        assert coarse.authenticate(query) == pytest.approx(exact.authenticate(query))
+
+
+def test_coarse_search_rescores_only_top_users(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0, coarse_users=4)
+    for user_id, base in bases.items():
+        result = auth.authenticate_topk(_near(rng, base), k=2)
+        assert result["user_id"] == user_id
+        # 30 centroid, sau đó toàn bộ 3 pose của 4 user đứng đầu
+        assert result["comparisons"] == {"coarse": 30, "fine": 12}
+
+
+def test_pose_bucket_decides_when_margin_is_clear(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+    for user_id, base in bases.items():
+        query = _near(rng, base)
+        result = auth.authenticate_topk(query, k=2, pose="left")
+        assert result["pose"] == "left"
+        assert result["user_id"] == user_id
+        assert result["comparisons"]["fine"] == len(bases)
+        left_rows = [(embedding, uid) for _, uid, embedding, pose in db.get_embedding_rows() if pose == "left"]
+        best = max(left_rows, key=lambda row: float(row[0] @ query))
+        assert result["distance"] == pytest.approx(
+            1.0 - float(best[0] @ query / np.linalg.norm(query)), abs=1e-5)
+
+
+def test_pose_bucket_falls_back_to_full_gallery(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0, pose_fallback_margin=2.0)
+    for query in _queries(rng, bases):
+        result = auth.authenticate_topk(query, k=3, pose="left")
+        expected = auth.authenticate_topk(query, k=3)
+        assert result["pose"] is None
+        assert result["user_ids"] == expected["user_ids"]
+        assert result["comparisons"]["fine"] == len(bases) + 90
+
+
+def test_unknown_pose_scans_full_gallery(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db, recent_users=0)
+    result = auth.authenticate_topk(_near(rng, bases["user003"]), pose="sideways")
+    assert result["pose"] is None and result["comparisons"]["fine"] == 90
+
+
+def test_recent_user_exits_early_with_a_safe_margin(gallery, rng):
+    db, bases = gallery
+    auth = Authenticator(db_manager=db)
+    for user_id in ("user001", "user007", "user013"):
+        auth.remember_user(user_id)
+
+    for user_id in ("user001", "user007", "user013"):
+        query = _near(rng, bases[user_id])
+        expected = _reference(db, query)
+        result = auth.authenticate_topk(query, k=2)
+        assert result["recent"] is True
+        assert result["user_id"] == user_id == expected[0][1]
+        assert result["distance"] == pytest.approx(expected[0][0], abs=1e-5)
+        # Margin của fast path là cận dưới của margin thật trên toàn gallery
+        assert result["margin"] <= expected[1][0] - expected[0][0] + 1e-5
+        assert result["comparisons"] == {"coarse": 30, "fine": 9}
+    assert auth.get_recency_stats()["early_exits"] >= 3
+
+
+@pytest.mark.parametrize("storage", ["float32", "float16", "int8"])
+def test_recent_user_never_hides_closer_user_outside_lru(make_db, rng, storage):
+    db = make_db(storage)
+    bases = enroll(db, rng, 10)
+    # "twin" gần user000 (cos ~0.85) nhưng không nằm trong LRU
+    twin = bases["user000"] + 0.025 * rng.normal(size=EMBEDDING_DIM).astype(np.float32)
+    twin /= np.linalg.norm(twin)
+    db.add_user("twin", "Twin")
+    for pose in ("frontal", "left", "right"):
+        db.add_embedding("twin", _near(rng, twin), pose_type=pose)
+    auth = Authenticator(db_manager=db)
+
+    for _ in range(10):
+        query = _near(rng, twin)
+        auth._recent.clear()
+        auth.remember_user("user000")
+        assert auth.authenticate(query)[1] == "twin"
+        auth._recent.clear()
+        auth.remember_user("user000")
+        result = auth.authenticate_topk(query, k=2)
+        assert result["user_id"] == "twin" and result["recent"] is False
+        # LRU có ứng viên user000 nhưng cận trên theo centroid (10 user + twin) chặn early exit
+        assert result["comparisons"]["coarse"] == 11
@@ -0,0 +1,230 @@
+"""Event writer, migration, bộ đếm thống kê, phân trang keyset, cache get_user, prune nhật ký embedding và vacuum của DatabaseManager."""
+import sqlite3
+
+import pytest
+
+from modules import database
+from modules.database import MIGRATIONS, SCHEMA_VERSION, EventWriter
+from tests.conftest import enroll
+
+
+def _event_row(user_id: str, index: int, created_at: str = "2026-01-01 00:00:00") -> tuple:
+    return ("auth", user_id, "success", 0.1, str(index), created_at, None, None, None, None, None, None)
+
+
+def test_event_writer_keeps_put_order_and_ignores_put_after_close(db):
+    writer = EventWriter(db._pool, max_pending=4, put_timeout=1.0)
+    for i in range(50):
+        assert writer.put(_event_row("u1", i))
+    writer.flush()
+    writer.close()
+
+    assert not writer.put(_event_row("u1", 50))
+    assert writer._thread is None
+    details = [int(row.details) for row in db.iter_events(page_size=100)]
+    assert details == list(range(49, -1, -1))
+    stats = writer.get_stats()
+    assert stats["written"] == 50 and stats["dropped"] == 0
+
+
+
+def _schema_versions(path) -> list[int]:
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    finally:
+        conn.close()
+
+
+def test_new_database_applies_every_migration(db):
+    assert _schema_versions(db.db_path) == [version for version, _, _ in MIGRATIONS]
+    assert _schema_versions(db.db_path)[-1] == SCHEMA_VERSION
+
+
+def test_migrations_resume_from_older_version(db):
+    # Giả lập database dừng ở version 6 (chưa có change_markers; embedding_changes đã có từ trước migration 8)
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("DELETE FROM schema_version WHERE version >= 7")
+    for op in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER trg_users_marker_{op}")
+    conn.execute("DROP TABLE change_markers")
+    conn.commit()
+    conn.close()
+
+    db._migrate()
+
+    assert _schema_versions(db.db_path)[-1] == SCHEMA_VERSION
+    db.add_user("u1", "User 1")
+    assert db._users_change_seq() == 1
+    assert db.get_embedding_changes() == []
+
+
+def test_migrate_is_idempotent(db):
+    db._migrate()
+    db._migrate()
+    assert _schema_versions(db.db_path) == [version for version, _, _ in MIGRATIONS]
+
+
+
+def _counter_rows(db) -> list[tuple]:
+    conn = sqlite3.connect(db.db_path)
+    try:
+        return conn.execute("SELECT name, day, value FROM stats_counters ORDER BY name, day").fetchall()
+    finally:
+        conn.close()
+
+
+def test_rebuild_stats_counters_matches_trigger_counts(db):
+    db.add_user("u1", "User 1")
+    db.add_user("u2", "User 2")
+    for i in range(6):
+        db.add_event("auth", "u1", "success")
+    db.add_event("auth_fail", "u1", "fail")
+    db.add_event("enroll", "u2", "success")
+    db.add_event("logout", "u1", "success")
+    db.flush_events()
+    maintained = _counter_rows(db)
+    stats = db.get_stats()
+    assert (stats["total_users"], stats["total_enrolls"], stats["total_auth_success"], stats["total_auth_fail"]) \
+        == (2, 1, 6, 1)
+
+    conn = db._get_connection()
+    conn.execute("UPDATE stats_counters SET value = 0")
+    conn.commit()
+    db.rebuild_stats_counters()
+
+    assert _counter_rows(db) == maintained
+    assert db.get_stats() == stats
+
+
+
+def test_events_pages_cover_every_row_once(db):
+    for i in range(23):
+        db.add_event("auth", f"u{i % 3}", "success")
+    db.flush_events()
+
+    pages, before_id = [], None
+    while True:
+        page = db.get_events_page(before_id, page_size=5)
+        if not page:
+            break
+        pages.append(page)
+        before_id = page[-1].id
+
+    ids = [row.id for page in pages for row in page]
+    assert ids == sorted(ids, reverse=True)
+    assert len(ids) == len(set(ids)) == 23
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [row.id for row in db.iter_events(page_size=4)] == ids
+
+
+def test_events_pages_apply_filters(db):
+    for i in range(12):
+        db.add_event("auth", f"u{i % 3}", "success" if i % 2 else "fail")
+    db.flush_events()
+
+    rows = list(db.iter_events(page_size=2, user_id="u1", result="success"))
+    assert rows and all(row.user_id == "u1" and row.result == "success" for row in rows)
+    assert len(rows) == sum(1 for i in range(12) if i % 3 == 1 and i % 2)
+
+
+def test_iter_users_in_registration_order(db):
+    for i in range(7):
+        db.add_user(f"u{i}", f"User {i}")
+    users = list(db.iter_users(page_size=3))
+    assert [user.id for user in users] == sorted(user.id for user in users)
+    assert len(users) == 7
+
+
+
+def test_user_cache_hits_skip_marker_query(db, monkeypatch):
+    db.add_user("u1", "User 1")
+    db.get_user("u1")
+    calls = []
+    monkeypatch.setattr(db, "_users_change_seq", lambda: calls.append(1) or 0)
+    for _ in range(5):
+        assert db.get_user("u1")["fullname"] == "User 1"
+    assert calls == []
+
+
+def test_user_cache_sees_changes_from_other_connections(db, monkeypatch):
+    db.add_user("u1", "Old name")
+    assert db.get_user("u1")["fullname"] == "Old name"
+
+    other = sqlite3.connect(db.db_path)
+    other.execute("UPDATE users SET fullname = 'New name' WHERE id = 'u1'")
+    other.commit()
+    # Trong chu kỳ kiểm tra cache vẫn trả bản cũ, hết chu kỳ thì đọc lại mốc
+    assert db.get_user("u1")["fullname"] == "Old name"
+    monkeypatch.setattr(database, "USER_CACHE_CHECK_INTERVAL", 0.0)
+    assert db.get_user("u1")["fullname"] == "New name"
+
+    other.execute("DELETE FROM users WHERE id = 'u1'")
+    other.commit()
+    other.close()
+    assert db.get_user("u1") is None
+
+
+def test_update_user_refreshes_cache_and_publishes(db):
+    db.add_user("u1", "Old name")
+    db.get_user("u1")
+    published = []
+    db.bus.subscribe("user_updated", published.append)
+
+    assert db.update_user("u1", fullname="New name", email="u1@example.com")
+    assert not db.update_user("missing", fullname="x")
+    with pytest.raises(ValueError):
+        db.update_user("u1", id="u2")
+
+    assert [user["fullname"] for user in published] == ["New name"]
+    user = db.get_user("u1")
+    assert (user["fullname"], user["email"]) == ("New name", "u1@example.com")
+
+
+def test_close_does_not_leave_a_dead_writer_for_other_managers(make_db):
+    first, other = make_db(), make_db()
+    first.add_event("auth", "u1", "success")
+    first.close()
+
+    later = make_db()
+    assert other.add_event("auth", "u1", "success")
+    assert later.add_event("auth", "u1", "success")
+    later.flush_events()
+    assert len(list(later.iter_events())) == 3
+
+
+def test_prune_embedding_changes_keeps_seq_and_flags_gap(db, rng):
+    enroll(db, rng, 3)
+    db.delete_user("user000")
+    db.delete_user("user001")
+    seq = db.get_embedding_change_seq()
+    assert seq == 6
+
+    assert db.prune_embedding_changes(3) == 3
+    assert [change[0] for change in db.get_embedding_changes(3)] == [4, 5, 6]
+    # Watermark dưới mốc prune: delta đã mất, người gọi phải load lại
+    assert db.get_embedding_changes(2) is None
+
+    assert db.prune_embedding_changes(seq) == 3
+    assert db.get_embedding_change_seq() == seq
+    assert db.get_embedding_changes(seq) == []
+    db.delete_user("user002")
+    assert [change[0] for change in db.get_embedding_changes(seq)] == [7, 8, 9]
+
+
+def test_maintenance_never_vacuums_legacy_database(make_db, tmp_path):
+    # Database cũ tạo trước khi có auto_vacuum=INCREMENTAL
+    legacy = sqlite3.connect(tmp_path / "legacy.db")
+    legacy.execute("CREATE TABLE legacy (id INTEGER PRIMARY KEY)")
+    legacy.commit()
+    legacy.close()
+    db = make_db(name="legacy.db")
+    conn = db._get_connection()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    db._incremental_vacuum(conn)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    assert db.enable_incremental_vacuum()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert not db.enable_incremental_vacuum()
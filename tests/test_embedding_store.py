@@ -0,0 +1,95 @@
+"""Sidecar embedding store: kiểm tra khớp với SQLite, thế hệ file, kiểu lưu lượng tử và sync() của Authenticator."""
+import numpy as np
+import pytest
+
+from modules.authenticator import Authenticator
+from tests.conftest import enroll, random_embedding
+
+
+def _store_files(db) -> set[str]:
+    store = db.embedding_store
+    return {path.name for path in store.directory.glob(f"{store.prefix}.*")}
+
+
+def test_storage_modes_use_separate_files(make_db, rng):
+    db32 = make_db("float32")
+    enroll(db32, rng, 3)
+    db8 = make_db("int8")
+
+    assert db32.open_embedding_store()["count"] == 9
+    assert db8.open_embedding_store()["quantized"] is not None
+    assert db32.embedding_store.prefix != db8.embedding_store.prefix
+    # Mở store int8 không dựng lại store float32
+    assert db32.embedding_store.read_header()["generation"] == 1
+
+
+def test_new_rows_are_appended_without_rebuild(db, rng):
+    enroll(db, rng, 2)
+    generation = db.open_embedding_store()["generation"]
+
+    db.add_user("late", "Late user")
+    db.add_embedding("late", random_embedding(rng), pose_type="frontal")
+    store = db.open_embedding_store()
+
+    assert store["generation"] == generation
+    assert store["count"] == 7 and store["user_ids"][-1] == "late"
+
+
+def test_count_mismatch_rebuilds_into_new_generation(db, rng):
+    enroll(db, rng, 3)
+    store = db.embedding_store
+    header = db.open_embedding_store()
+    old_files = _store_files(db)
+
+    # Header báo thừa 1 hàng so với SQLite (vd. crash giữa commit và append)
+    store._write_header(header["generation"], header["count"] + 1, header["max_id"],
+                        len(header["user_ids"]), header["change_seq"])
+    rebuilt = db.open_embedding_store()
+
+    assert rebuilt["generation"] == header["generation"] + 1
+    assert rebuilt["count"] == header["count"]
+    np.testing.assert_array_equal(rebuilt["ids"], header["ids"])
+    del header
+    assert not old_files & _store_files(db) - {store.header_path.name}
+
+
+def test_delete_marks_store_stale(db, rng):
+    enroll(db, rng, 3)
+    first = db.open_embedding_store()
+    db.delete_user("user001")
+    second = db.open_embedding_store()
+
+    assert second["generation"] == first["generation"] + 1
+    assert "user001" not in second["user_ids"] and second["count"] == 6
+
+
+def test_sync_switches_to_rebuilt_generation(db, rng):
+    enroll(db, rng, 3)
+    auth = Authenticator(db_manager=db)
+    generation = auth._store_generation
+
+    # Process khác dựng lại store với cùng nội dung
+    store = db.embedding_store
+    header = store.read_header()
+    store._write_header(header["generation"], header["count"] + 1, header["max_id"],
+                        header["n_users"], header["change_seq"])
+    db.open_embedding_store()
+    auth.sync()
+
+    assert auth._store_generation == generation + 1
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+@pytest.mark.parametrize("use_store", [True, False])
+def test_quantized_gallery_matches_float32(make_db, rng, storage, use_store):
+    db32 = make_db("float32")
+    bases = enroll(db32, rng, 20)
+    reference = Authenticator(db_manager=db32, recent_users=0)
+    quantized = Authenticator(db_manager=make_db(storage), recent_users=0, use_store=use_store)
+
+    for user_id, base in bases.items():
+        query = base + 0.01 * rng.normal(size=base.shape).astype(np.float32)
+        expected = reference.authenticate(query)
+        result = quantized.authenticate(query)
+        assert result[:2] == expected[:2] == (True, user_id)
+        assert result[2] == pytest.approx(expected[2], abs=1e-5)
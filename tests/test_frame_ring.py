@@ -0,0 +1,105 @@
+"""Vòng đời slot của FrameRing: acquire / publish / retain / release / abort."""
+import numpy as np
+import pytest
+
+from modules.frame_ring import FrameRing
+
+SHAPE = (4, 6, 3)
+
+
+def _publish(ring: FrameRing, value: int):
+    index, array = ring.acquire()
+    array[:] = value
+    return ring.publish(index)
+
+
+def test_release_returns_every_slot():
+    ring = FrameRing(SHAPE, slots=3)
+    refs = [_publish(ring, i) for i in range(3)]
+    assert ring.in_use() == 3
+    for ref in refs:
+        ref.release()
+    assert ring.in_use() == 0
+    assert ring.stats["published"] == 3
+
+
+def test_seq_increases_and_latest_is_newest():
+    ring = FrameRing(SHAPE, slots=3)
+    seqs = []
+    for i in range(5):
+        ref = _publish(ring, i)
+        seqs.append(ref.seq)
+        ref.release()
+    assert seqs == sorted(seqs)
+
+    latest = ring.latest()
+    assert latest.seq == seqs[-1]
+    assert np.all(latest.array == 4)
+    latest.release()
+
+
+def test_retained_slot_is_not_overwritten():
+    ring = FrameRing(SHAPE, slots=2)
+    ref = _publish(ring, 7)
+    held = ref.retain()
+    ref.release()
+    for i in range(5):
+        _publish(ring, i).release()
+    # Ref gốc đã trả nhưng ref retain() vẫn giữ slot
+    assert np.all(held.array == 7)
+    held.release()
+    assert ring.in_use() == 0
+
+
+def test_full_ring_drops_frame():
+    ring = FrameRing(SHAPE, slots=2)
+    refs = [_publish(ring, i) for i in range(2)]
+    assert ring.acquire() is None
+    assert ring.stats["full"] == 1
+
+    refs[0].release()
+    assert ring.acquire() is not None
+    refs[1].release()
+
+
+def test_release_is_idempotent():
+    ring = FrameRing(SHAPE, slots=2)
+    ref = _publish(ring, 1)
+    other = ref.retain()
+    ref.release()
+    ref.release()
+    assert ring.in_use() == 1
+    other.release()
+    assert ring.in_use() == 0
+
+
+def test_abort_frees_slot_without_publishing():
+    ring = FrameRing(SHAPE, slots=1)
+    index, _ = ring.acquire()
+    ring.abort(index)
+    assert ring.in_use() == 0
+    assert ring.latest() is None
+    assert ring.acquire() is not None
+
+
+def test_frame_view_is_read_only():
+    ring = FrameRing(SHAPE, slots=2)
+    ref = _publish(ring, 3)
+    with pytest.raises(ValueError):
+        ref.array[0, 0, 0] = 0
+    ref.release()
+
+
+def test_shared_ring_read_latest_from_attached_ring():
+    ring = FrameRing(SHAPE, slots=2, shared=True)
+    try:
+        reader = FrameRing.attach(ring.name, SHAPE, slots=2)
+        try:
+            ref = _publish(ring, 9)
+            seq, frame = reader.read_latest()
+            assert seq == ref.seq and np.all(frame == 9)
+            ref.release()
+        finally:
+            reader.close()
+    finally:
+        ring.close()
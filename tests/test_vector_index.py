@@ -0,0 +1,52 @@
+"""Vector index: train lại IVF ngoài add() và HNSW khi còn ít nút sống hơn k."""
+import numpy as np
+import pytest
+
+from modules.vector_index import BruteForceIndex, IVFIndex, create_index
+from tests.conftest import EMBEDDING_DIM
+
+
+def _unit_rows(rng, n: int) -> np.ndarray:
+    rows = rng.normal(size=(n, EMBEDDING_DIM)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_ivf_add_defers_retrain(rng):
+    index = IVFIndex(nlist=4, nprobe=4)
+    index.build(_unit_rows(rng, 40), np.arange(40))
+    centroids = index.centroids
+
+    index.add(_unit_rows(rng, 60), np.arange(40, 100))
+    assert index.centroids is centroids
+    assert index.retrain_due
+
+
+def test_ivf_swap_keeps_rows_changed_after_snapshot(rng):
+    index = IVFIndex(nlist=4, nprobe=4)
+    index.build(_unit_rows(rng, 40), np.arange(40))
+    index.add(_unit_rows(rng, 60), np.arange(40, 100))
+    trained = index.train_centroids(index.retrain_snapshot())
+
+    # Thay đổi xen giữa lúc train và lúc đổi tâm cụm
+    index.remove(np.arange(0, 10))
+    index.add(_unit_rows(rng, 5), np.arange(100, 105))
+    assert index.swap_centroids(trained)
+    assert not index.retrain_due
+    assert not index.swap_centroids(trained)
+
+    # nprobe = nlist: quét mọi cụm nên kết quả phải trùng brute force (mọi hàng đều nằm trong 1 cụm)
+    exact = BruteForceIndex()
+    exact.build(index.vectors, index.labels)
+    for query in _unit_rows(rng, 10):
+        assert np.array_equal(index.search(query, 5)[0], exact.search(query, 5)[0])
+
+
+def test_hnsw_search_after_removing_most_rows(rng):
+    pytest.importorskip("hnswlib")
+    index = create_index("hnsw")
+    index.build(_unit_rows(rng, 50), np.arange(50))
+    index.remove(np.arange(47))
+
+    positions, similarities = index.search(_unit_rows(rng, 1)[0], 10)
+    assert sorted(index.labels[positions]) == [47, 48, 49]
+    assert len(similarities) == 3